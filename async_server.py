@@ -0,0 +1,197 @@
+import io
+import sys
+import json
+import asyncio
+import traceback
+import multiprocessing
+import concurrent.futures
+from aiohttp import web  # type: ignore
+from multidict import CIMultiDict  # type: ignore
+
+from config import config
+from config import shards
+from config import startup
+from config.admission import Overloaded
+
+# ===========================
+# Async serving mode (SERVER_MODE=async)
+# ===========================
+#
+# /ask and /ask/stream run on the event loop: a request waits for an LLM slot
+# and for its tokens without holding a thread, so thousands of open SSE
+# streams cost little more than their sockets. Generations themselves run on
+# LLM_MAX_CONCURRENCY worker threads. Every other route is the Flask app from
+# server.py, called on a small thread pool through a minimal WSGI bridge.
+# server.py hands its app to main() rather than being imported here, so it is
+# never loaded a second time as the "server" module.
+
+BRIDGE_WORKERS = 8
+CORS_HEADERS = {"Access-Control-Allow-Origin": "*"}
+HOP_HEADERS = {"content-length", "transfer-encoding", "connection"}
+_bridge_pool = concurrent.futures.ThreadPoolExecutor(max_workers=BRIDGE_WORKERS)
+_flask_app = None  # Set by create_app
+
+
+def overloaded_response(e):
+    return web.json_response(
+        {"error": str(e), "queue_depth": e.queue_depth, "retry_after": e.retry_after},
+        status=e.status,
+        headers={"Retry-After": str(e.retry_after), **CORS_HEADERS},
+    )
+
+
+async def read_question(request):
+    """Returns (question, mods, error response)."""
+    try:
+        data = await request.json()
+    except (ValueError, UnicodeDecodeError):
+        data = None
+    if not isinstance(data, dict) or "question" not in data:
+        return None, None, web.json_response({"error": "Missing 'question' field"}, status=400, headers=CORS_HEADERS)
+    mods, error = shards.request_mods(data)
+    if error:
+        return None, None, web.json_response({"error": error}, status=400, headers=CORS_HEADERS)
+    return data["question"], mods, None
+
+
+async def ask(request):
+    question, mods, error = await read_question(request)
+    if error is not None:
+        return error
+    try:
+        from config import rag_pipeline
+
+        answer = await rag_pipeline.agenerate_answer(question, mods)
+        return web.json_response({"answer": answer}, headers=CORS_HEADERS)
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        traceback.print_exc()
+        return web.json_response({"error": "Server error", "details": str(e)}, status=500, headers=CORS_HEADERS)
+
+
+async def send_event(response, event_type, content):
+    event_data = json.dumps({"type": event_type, "content": content})
+    await response.write(f"data: {event_data}\n\n".encode("utf-8"))
+
+
+async def ask_stream(request):
+    """Same Server-Sent Events as the Flask endpoint."""
+    question, mods, error = await read_question(request)
+    if error is not None:
+        return error
+
+    # As in server.py, the first event decides between a stream and a 429/503.
+    from config import rag_pipeline
+
+    events = rag_pipeline.astream_answer(question, mods)
+    first, failure = [], None
+    try:
+        first = [await events.__anext__()]
+    except StopAsyncIteration:
+        pass
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        failure = e
+
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+        **CORS_HEADERS,
+    })
+    await response.prepare(request)
+    try:
+        if failure is not None:
+            raise failure
+        for event_type, content in first:
+            await send_event(response, event_type, content)
+        async for event_type, content in events:
+            await send_event(response, event_type, content)
+    except ConnectionResetError:
+        pass  # The client went away; the generation carries on for anyone following it.
+    except Exception as e:
+        traceback.print_exc()
+        await send_event(response, "error", str(e))
+    finally:
+        await events.aclose()
+    return response
+
+
+# ---- Flask bridge ----
+
+def _call_flask(environ):
+    started = []
+
+    def start_response(status, headers, exc_info=None):
+        started[:] = [status, headers]
+
+    result = _flask_app.wsgi_app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return started[0], started[1], body
+
+
+async def flask_bridge(request):
+    body = await request.read()
+    environ = {
+        "REQUEST_METHOD": request.method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": request.path,
+        "QUERY_STRING": request.query_string,
+        "SERVER_NAME": request.host.split(":", 1)[0],
+        "SERVER_PORT": str(config.SERVER_PORT),
+        "SERVER_PROTOCOL": f"HTTP/{request.version.major}.{request.version.minor}",
+        "REMOTE_ADDR": request.remote or "",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": request.scheme,
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in request.headers.items():
+        key = name.upper().replace("-", "_")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key != "CONTENT_LENGTH":
+            key = "HTTP_" + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    loop = asyncio.get_running_loop()
+    status, headers, payload = await loop.run_in_executor(_bridge_pool, _call_flask, environ)
+    headers = CIMultiDict((k, v) for k, v in headers if k.lower() not in HOP_HEADERS)
+    return web.Response(status=int(status.split(" ", 1)[0]), headers=headers, body=payload)
+
+
+def create_app(flask_app):
+    global _flask_app
+    _flask_app = flask_app
+    app = web.Application()
+    app.router.add_post("/ask", ask)
+    app.router.add_post("/ask/stream", ask_stream)
+    app.router.add_route("*", "/{tail:.*}", flask_bridge)
+    return app
+
+
+def main(flask_app, load_pipeline):
+    """Starts loading the pipeline in the background, then serves until stopped."""
+    startup.start(load_pipeline)
+    print(
+        f"🌐 Async server on port {config.SERVER_PORT} "
+        f"({config.LLM_MAX_CONCURRENCY} LLM slots, up to {config.LLM_QUEUE_SIZE} waiting)."
+    )
+    web.run_app(create_app(flask_app), host="0.0.0.0", port=config.SERVER_PORT, print=None)
+
+
+if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn", force=True)
+    import server
+
+    main(server.app, server.load_pipeline)
@@ -0,0 +1,104 @@
+import os
+import re
+import time
+import argparse
+import difflib
+from config import config
+from wiki import clean_data
+
+
+def legacy_clean_text(text):
+    """The original seven-pass regex cleaner, kept as the benchmark baseline."""
+    text = re.sub(r"==+.*?==+", "", text)
+    text = re.sub(r"\[\[Category:.*?\]\]", "", text)
+    text = re.sub(r"\{\{.*?\}\}", "", text, flags=re.DOTALL)
+    text = re.sub(r"\[\[|\]\]", "", text)
+    text = re.sub(r"http\S+", "", text)
+    text = re.sub(r"[^ -~\n]", "", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+# Wikitext the shipped corpus (plaintext extracts) does not contain: markup
+# inside and after templates, and the single-pass cleaner's expected output.
+MARKUP_CASES = [
+    ("{{url|http://x.com}}[[Foo]] bar", "Foo bar"),
+    ("{{x|a==b}} [[Link]] more ==H== end", "Link more  end"),
+    ("a {{outer|{{inner|http://y}}|b==c}} [[B]] {{t|x}}z", "a  B z"),
+    ("{{a|{{b}}}}==H==[[Category:C]]text http://z.com", "text"),
+    ("{{unclosed [[Foo]] http://x", "{{unclosed Foo"),
+]
+
+
+def check_markup_cases():
+    """Returns the MARKUP_CASES clean_text gets wrong, as (raw, expected, got)."""
+    failures = []
+    for raw, expected in MARKUP_CASES:
+        got = clean_data.clean_text(raw)
+        if got != expected:
+            failures.append((raw, expected, got))
+    return failures
+
+
+def load_corpus(source_dir):
+    corpus = []
+    for root, _, files in os.walk(source_dir):
+        for file in files:
+            if file.endswith(".txt"):
+                path = os.path.join(root, file)
+                with open(path, "r", encoding="utf-8") as f:
+                    corpus.append((os.path.relpath(path, source_dir), f.read()))
+    return corpus
+
+
+def time_cleaner(cleaner, corpus, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        outputs = [cleaner(text) for _, text in corpus]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, outputs
+
+
+def run(source_dir, repeat, show_diffs):
+    corpus = load_corpus(source_dir)
+    total_bytes = sum(len(text.encode("utf-8")) for _, text in corpus)
+    print(f"📂 Loaded {len(corpus)} pages ({total_bytes / 1e6:.1f} MB) from '{source_dir}'")
+
+    legacy_time, legacy_out = time_cleaner(legacy_clean_text, corpus, repeat)
+    new_time, new_out = time_cleaner(clean_data.clean_text, corpus, repeat)
+
+    for name, elapsed in (("regex (7 passes)", legacy_time), ("single pass", new_time)):
+        print(
+            f"⏱️ {name:<17} {elapsed * 1000:8.1f} ms  "
+            f"{total_bytes / 1e6 / elapsed:7.1f} MB/s  {len(corpus) / elapsed:8.0f} pages/s"
+        )
+    print(f"🚀 Speedup: {legacy_time / new_time:.2f}x")
+
+    differing = [
+        (rel_path, old, new)
+        for (rel_path, _), old, new in zip(corpus, legacy_out, new_out)
+        if old != new
+    ]
+    print(f"🔍 Identical output for {len(corpus) - len(differing)}/{len(corpus)} pages.")
+
+    failures = check_markup_cases()
+    print(f"🧪 Markup cases: {len(MARKUP_CASES) - len(failures)}/{len(MARKUP_CASES)} cleaned as expected.")
+    for raw, expected, got in failures:
+        print(f"❌ {raw!r}: expected {expected!r}, got {got!r}")
+    for rel_path, old, new in differing[:show_diffs]:
+        print(f"\n--- {rel_path}")
+        diff = difflib.unified_diff(old.splitlines(), new.splitlines(), "regex", "single pass", lineterm="", n=1)
+        for line in list(diff)[:20]:
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark clean_text against the legacy regex cleaner.")
+    parser.add_argument("--source", default=config.DATA_DIR_RAW, help="Directory of raw wiki pages")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per cleaner (best is reported)")
+    parser.add_argument("--show-diffs", type=int, default=5, help="Number of differing pages to print")
+    args = parser.parse_args()
+
+    run(args.source, args.repeat, args.show_diffs)
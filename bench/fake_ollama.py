@@ -0,0 +1,161 @@
+import re
+import json
+import math
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ===========================
+# Stand-in Ollama server
+# ===========================
+#
+# Enough of the Ollama HTTP API to run NotchNet without a GPU or a model:
+#   /api/embed, /api/embeddings  deterministic bag-of-words vectors, so
+#                                related texts really are close
+#   /api/chat, /api/generate     a fixed answer streamed at --token-rate after
+#                                a prefill delay that grows with the prompt
+# Generations beyond --parallel wait for a slot, as they do in Ollama. Final
+# chunks carry the prompt/eval counts and durations Ollama reports.
+
+ANSWER = (
+    "To craft it, open a crafting table and place the ingredients in the pattern shown on its page. "
+    "Smelt the ore first if the recipe needs ingots, and keep a stack of torches nearby while you mine. "
+)
+CHARS_PER_TOKEN = 4
+
+
+def embed(text, dim):
+    vector = [0.0] * dim
+    for token in re.findall(r"\w+", text.lower()):
+        vector[int(hashlib.md5(token.encode()).hexdigest(), 16) % dim] += 1.0
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def answer_tokens(count):
+    words = ANSWER.split()
+    return [words[i % len(words)] + " " for i in range(count)]
+
+
+class FakeOllama(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options = None  # argparse namespace, set by serve()
+    slots = None  # Semaphore limiting concurrent generations
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            return self._send_json({"models": []})
+        body = b"Ollama is running"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path == "/api/embed":
+            texts = request.get("input", [])
+            texts = [texts] if isinstance(texts, str) else texts
+            time.sleep(self.options.embed_ms / 1000)
+            return self._send_json({"model": request.get("model"), "embeddings": [embed(t, self.options.dim) for t in texts]})
+        if self.path == "/api/embeddings":
+            time.sleep(self.options.embed_ms / 1000)
+            return self._send_json({"embedding": embed(request.get("prompt", ""), self.options.dim)})
+        if self.path in ("/api/chat", "/api/generate"):
+            return self._generate(request, chat=self.path == "/api/chat")
+        self._send_json({"error": "not found"}, status=404)
+
+    def _generate(self, request, chat):
+        if chat:
+            prompt = "".join(m.get("content", "") for m in request.get("messages", []))
+        else:
+            prompt = request.get("prompt", "")
+        if not prompt:
+            # An empty prompt only loads the model.
+            return self._send_json({"model": request.get("model"), "response": "", "done": True})
+
+        prompt_tokens = max(1, len(prompt) // CHARS_PER_TOKEN)
+        tokens = answer_tokens(self.options.answer_tokens)
+
+        def piece(text):
+            if chat:
+                return {"model": request.get("model"), "message": {"role": "assistant", "content": text}}
+            return {"model": request.get("model"), "response": text}
+
+        with self.slots:
+            started = time.monotonic()
+            prefill = (self.options.prefill_ms + prompt_tokens * self.options.prefill_ms_per_token) / 1000
+            time.sleep(prefill)
+            final = piece("")
+            final.update(
+                done=True,
+                prompt_eval_count=prompt_tokens,
+                prompt_eval_duration=int(prefill * 1e9),
+                eval_count=len(tokens),
+                eval_duration=int(len(tokens) / self.options.token_rate * 1e9),
+            )
+            if not request.get("stream", True):
+                time.sleep(len(tokens) / self.options.token_rate)
+                final.update(piece("".join(tokens)))
+                final["total_duration"] = int((time.monotonic() - started) * 1e9)
+                return self._send_json(final)
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for token in tokens:
+                self._send_chunk({**piece(token), "done": False})
+                time.sleep(1 / self.options.token_rate)
+            final["total_duration"] = int((time.monotonic() - started) * 1e9)
+            self._send_chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+
+    def _send_chunk(self, obj):
+        line = (json.dumps(obj) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+
+def serve(options):
+    FakeOllama.options = options
+    FakeOllama.slots = threading.Semaphore(options.parallel)
+    server = ThreadingHTTPServer((options.host, options.port), FakeOllama)
+    server.daemon_threads = True
+    print(
+        f"🦙 Fake Ollama on {options.host}:{options.port} ({options.token_rate:g} tokens/s, "
+        f"prefill {options.prefill_ms:g}ms + {options.prefill_ms_per_token:g}ms/token, {options.parallel} parallel)"
+    )
+    server.serve_forever()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Stand-in Ollama server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--token-rate", type=float, default=50, help="Answer tokens streamed per second")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Tokens in every answer")
+    parser.add_argument("--prefill-ms", type=float, default=50, help="Fixed delay before the first token")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.2, help="Extra prefill delay per prompt token")
+    parser.add_argument("--embed-ms", type=float, default=2, help="Delay per embedding request")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimensions")
+    parser.add_argument("--parallel", type=int, default=2, help="Generations served at once (OLLAMA_NUM_PARALLEL)")
+    return parser
+
+
+if __name__ == "__main__":
+    serve(build_parser().parse_args())
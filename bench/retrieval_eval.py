@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import itertools
+import numpy as np
+import faiss  # type: ignore
+from langchain_core.embeddings import Embeddings  # type: ignore
+from langchain_text_splitters import RecursiveCharacterTextSplitter  # type: ignore
+from langchain_community.vectorstores import FAISS  # type: ignore
+from langchain_community.docstore.in_memory import InMemoryDocstore  # type: ignore
+
+from config import config
+from config import build_index
+from config import index_store
+from config import lexical_index
+from config import rag_pipeline
+from config import embedding_cache
+from bench.fake_ollama import embed
+from bench.serve_bench import RESULTS_DIR, git_revision, percentile, read_rss
+
+# ===========================
+# Retrieval evaluation
+# ===========================
+#
+# Scores retrieval against bench/golden_set.json, a list of questions with the
+# wiki pages that answer them. For every combination of chunk size, overlap,
+# index type, hybrid search and k it:
+#   1. splits the cleaned pages with build_index's splitter settings
+#   2. embeds the chunks, once per chunking, and publishes them with
+#      build_index.publish_index into a scratch directory
+#   3. loads that version the way the server does and asks every question
+#      through ShardedRetriever.search
+#   4. reports recall@k, MRR, per-query latency, index size and RSS
+# A question is a hit when a retrieved chunk comes from one of its pages.
+# Pages are matched by title, since the same page can sit in several
+# categories. Embeddings are deterministic hashed bags of words by default,
+# so runs need no Ollama and are comparable; --embeddings ollama uses the
+# configured model through the persistent embedding cache.
+
+GOLDEN_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden_set.json")
+EMBED_BATCH = 500
+
+
+class HashEmbeddings(Embeddings):
+    """The stand-in Ollama's bag-of-words vectors, computed in process."""
+
+    def __init__(self, dim):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return [embed(text, self.dim) for text in texts]
+
+    def embed_query(self, text):
+        return embed(text, self.dim)
+
+
+def load_golden_set(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def page_title(path):
+    return lexical_index.title_of(path).lower()
+
+
+def list_pages(data_dir, golden, max_pages, seed):
+    """Relative paths of the pages to index: all, or the golden pages plus a seeded sample of the rest."""
+    pages = sorted(
+        os.path.relpath(os.path.join(root, name), data_dir)
+        for root, _, names in os.walk(data_dir)
+        for name in names
+        if name.endswith(".txt")
+    )
+    if not max_pages or max_pages >= len(pages):
+        return pages
+    wanted = {page_title(p) for item in golden for p in item["pages"]}
+    chosen = [p for p in pages if page_title(p) in wanted]
+    others = [p for p in pages if page_title(p) not in wanted]
+    chosen += random.Random(seed).sample(others, max(0, min(len(others), max_pages - len(chosen))))
+    return sorted(chosen)
+
+
+def split_pages(data_dir, pages, chunk_size, chunk_overlap):
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=len, is_separator_regex=False
+    )
+    docs = []
+    for rel_path in pages:
+        path = os.path.join(data_dir, rel_path)
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        chunks, ids = build_index.split_file(text_splitter, path, rel_path, text)
+        for chunk, chunk_id in zip(chunks, ids):
+            chunk.id = chunk_id
+            docs.append(chunk)
+    return docs
+
+
+def embed_chunks(embeddings, docs):
+    vectors = []
+    for start in range(0, len(docs), EMBED_BATCH):
+        vectors.extend(embeddings.embed_documents([d.page_content for d in docs[start : start + EMBED_BATCH]]))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def publish(embeddings, docs, vectors, index_path, index_type):
+    """Publishes the chunks as an `index_type` version under index_path and returns its directory and manifest."""
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    vector_store = FAISS(
+        embeddings, flat, InMemoryDocstore({d.id: d for d in docs}), {i: d.id for i, d in enumerate(docs)}
+    )
+    manifest = {"settings": {}, "files": {}}
+    config.INDEX_TYPE = index_type
+    config.ANN_MIN_VECTORS = 0  # Build the requested type however small the sample is
+    build_index.publish_index(vector_store, manifest, index_path)
+    return index_store.current_index_dir(index_path), manifest
+
+
+def dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def score(retriever, golden):
+    """Returns (recall, MRR, per-query seconds) of `retriever` over the golden set."""
+    hits = 0
+    reciprocal_ranks = 0.0
+    seconds = []
+    for item in golden:
+        expected = {page_title(p) for p in item["pages"]}
+        started = time.perf_counter()
+        docs = retriever.search(item["question"])
+        seconds.append(time.perf_counter() - started)
+        for rank, doc in enumerate(docs, 1):
+            if page_title(doc.metadata.get("source", "")) in expected:
+                hits += 1
+                reciprocal_ranks += 1.0 / rank
+                break
+    return hits / len(golden), reciprocal_ranks / len(golden), seconds
+
+
+def evaluate(args, embeddings, golden, pages, workdir):
+    rows = []
+    ms = lambda v: round(v * 1000, 2)
+    for chunk_size, chunk_overlap in itertools.product(args.chunk_size, args.chunk_overlap):
+        if chunk_overlap >= chunk_size:
+            continue
+        docs = split_pages(args.data_dir, pages, chunk_size, chunk_overlap)
+        print(f"✂️ chunk_size {chunk_size}, overlap {chunk_overlap}: {len(docs)} chunks from {len(pages)} pages. Embedding...")
+        started = time.monotonic()
+        vectors = embed_chunks(embeddings, docs)
+        embed_s = time.monotonic() - started
+
+        for index_type in args.index_type:
+            index_path = os.path.join(workdir, f"c{chunk_size}-o{chunk_overlap}-{index_type}")
+            index_dir, manifest = publish(embeddings, docs, vectors, index_path, index_type)
+            rss_before = read_rss(os.getpid())
+            store = rag_pipeline._load_shard(index_dir)
+            lexical = lexical_index.load(index_dir)
+
+            for hybrid, k in itertools.product(args.hybrid, args.k):
+                config.HYBRID_SEARCH = hybrid
+                retriever = rag_pipeline.ShardedRetriever(
+                    {"eval": store}, {"eval": 0}, k, {"eval": lexical}, embeddings=embeddings
+                )
+                retriever.search(golden[0]["question"])  # Warm up
+                recall, mrr, seconds = score(retriever, golden)
+                rss_after = read_rss(os.getpid())
+                row = {
+                    "chunk_size": chunk_size,
+                    "chunk_overlap": chunk_overlap,
+                    "index_type": manifest["index"]["type"],
+                    "hybrid": hybrid,
+                    "k": k,
+                    "recall@k": round(recall, 3),
+                    "mrr": round(mrr, 3),
+                    "latency_ms": {"p50": ms(percentile(seconds, 0.5)), "p95": ms(percentile(seconds, 0.95)), "mean": ms(sum(seconds) / len(seconds))},
+                    "chunks": len(docs),
+                    "embed_s": round(embed_s, 2),
+                    "index_mb": round(dir_bytes(index_dir) / 1e6, 2),
+                    "vectors_mb": round(os.path.getsize(os.path.join(index_dir, build_index.VECTORS_FILE)) / 1e6, 2),
+                    "rss_mb": round(rss_after / 1e6, 1) if rss_after else None,
+                    "rss_delta_mb": round((rss_after - rss_before) / 1e6, 1) if rss_after and rss_before else None,
+                }
+                rows.append(row)
+                print_row(row)
+    return rows
+
+
+def print_row(row):
+    print(
+        f"📊 size {row['chunk_size']:>5} overlap {row['chunk_overlap']:>4} {row['index_type']:>5} "
+        f"hybrid {'on ' if row['hybrid'] else 'off'} k {row['k']:>2} | recall@k {row['recall@k']:.3f} "
+        f"MRR {row['mrr']:.3f} | p50 {row['latency_ms']['p50']}ms p95 {row['latency_ms']['p95']}ms | "
+        f"{row['chunks']} chunks, index {row['index_mb']} MB, RSS {row['rss_mb']} MB"
+    )
+
+
+def run(args):
+    golden = load_golden_set(args.golden_set)
+    pages = list_pages(args.data_dir, golden, args.max_pages, args.seed)
+    if args.embeddings == "ollama":
+        embeddings = embedding_cache.get_embeddings()
+    else:
+        embeddings = HashEmbeddings(args.dim)
+    print(f"🎯 {len(golden)} golden questions over {len(pages)} pages, {args.embeddings} embeddings.")
+
+    workdir = tempfile.mkdtemp(prefix="notchnet-eval-")
+    try:
+        rows = evaluate(args, embeddings, golden, pages, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "revision": git_revision(),
+        "settings": {
+            "golden_set": os.path.relpath(args.golden_set), "questions": len(golden), "pages": len(pages),
+            "embeddings": args.embeddings if args.embeddings == "hash" else config.EMBEDDING_MODEL,
+            "dim": args.dim if args.embeddings == "hash" else None,
+        },
+        "results": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"retrieval-{args.embeddings}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Saved results to {output}")
+    return report
+
+
+def int_list(text):
+    return [int(v) for v in text.split(",")]
+
+
+def switch_list(text):
+    return [v.strip().lower() in ("on", "true", "1") for v in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score retrieval quality and latency over the golden set.")
+    parser.add_argument("--golden-set", default=GOLDEN_SET, help="JSON list of {question, pages}")
+    parser.add_argument("--data-dir", default=config.DATA_DIR_CLEANED, help="Cleaned wiki pages to index")
+    parser.add_argument("--max-pages", type=int, default=0, help="Index only the golden pages plus a sample of others (0 = all)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--embeddings", choices=["hash", "ollama"], default="hash", help="Deterministic stand-in or the configured Ollama model (cached)")
+    parser.add_argument("--dim", type=int, default=256, help="Dimensions of the hash embeddings")
+    parser.add_argument("--chunk-size", type=int_list, default=[build_index.INDEX_SETTINGS["chunk_size"]], help="Comma-separated chunk sizes")
+    parser.add_argument("--chunk-overlap", type=int_list, default=[build_index.INDEX_SETTINGS["chunk_overlap"]], help="Comma-separated chunk overlaps")
+    parser.add_argument("--index-type", type=lambda t: t.split(","), default=[config.INDEX_TYPE], help="Comma-separated index types (flat, ivf, hnsw)")
+    parser.add_argument("--hybrid", type=switch_list, default=[True, False], help="Comma-separated on/off")
+    parser.add_argument("--k", type=int_list, default=[config.RETRIEVER_K], help="Comma-separated chunks retrieved per question")
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: bench/results/retrieval-*.json)")
+    run(parser.parse_args())
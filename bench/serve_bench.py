@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import aiohttp  # type: ignore
+
+# ===========================
+# Serving benchmark
+# ===========================
+#
+# Drives server.py end to end against the stand-in Ollama (bench/fake_ollama.py):
+#   1. starts the fake Ollama, or uses --ollama
+#   2. builds a synthetic wiki index in a scratch directory, or uses --workdir
+#   3. starts server.py there and waits for /readyz
+#   4. sends questions to /ask or /ask/stream from --concurrency clients
+#   5. reports p50/p95/p99 latency, time to first token, requests/s and the
+#      server's RSS, and writes everything to a JSON file for later comparison
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "bench", "results")
+
+ITEMS = [
+    "Shield", "Diamond Sword", "Iron Pickaxe", "Bow", "Crossbow", "Trident", "Elytra", "Beacon",
+    "Anvil", "Enchanting Table", "Brewing Stand", "Furnace", "Blast Furnace", "Smoker", "Hopper",
+    "Piston", "Observer", "Redstone Torch", "Lantern", "Campfire", "Compass", "Clock", "Map",
+    "Fishing Rod", "Shears", "Lead", "Saddle", "Spyglass", "Netherite Ingot", "Totem of Undying",
+]
+MATERIALS = ["planks", "iron ingots", "sticks", "string", "cobblestone", "gold ingots", "redstone", "diamonds", "obsidian"]
+PLACES = ["the Nether", "villages", "strongholds", "ancient cities", "deep caves", "ocean monuments", "woodland mansions"]
+QUESTIONS = [
+    "How do I craft a {item}?",
+    "What is the {item} used for?",
+    "Where can I find {material} to make a {item}?",
+    "Can a {item} be enchanted?",
+    "What do I need before going to {place}?",
+]
+
+
+# ---- setup ----
+
+def write_corpus(data_dir, pages, seed):
+    """Writes `pages` synthetic wiki pages under data_dir/Items/."""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(data_dir, "Items"), exist_ok=True)
+    for i in range(pages):
+        item = ITEMS[i % len(ITEMS)] + ("" if i < len(ITEMS) else f" Mk{i // len(ITEMS)}")
+        sentences = [f"{item} is an item in Minecraft."]
+        for _ in range(rng.randint(8, 30)):
+            a, b = rng.sample(MATERIALS, 2)
+            sentences.append(
+                rng.choice([
+                    f"It is crafted from {a} and {b} on a crafting table.",
+                    f"Players often find {a} near {rng.choice(PLACES)}.",
+                    f"The {item} can be repaired with {a} in an anvil.",
+                    f"A {item} lasts longer when enchanted with Unbreaking.",
+                    f"Villagers sometimes trade {b} for emeralds.",
+                ])
+            )
+        with open(os.path.join(data_dir, "Items", f"{item}.txt"), "w", encoding="utf-8") as f:
+            f.write(" ".join(sentences))
+
+
+def make_questions(count, seed):
+    rng = random.Random(seed)
+    return [
+        rng.choice(QUESTIONS).format(item=rng.choice(ITEMS), material=rng.choice(MATERIALS), place=rng.choice(PLACES))
+        for _ in range(count)
+    ]
+
+
+def wait_for(url, timeout, ok=(200,)):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as response:
+                if response.status in ok:
+                    return True
+        except Exception:
+            pass
+        time.sleep(0.1)
+    return False
+
+
+def start_fake_ollama(args, log):
+    port = args.ollama_port
+    command = [
+        sys.executable, "-m", "bench.fake_ollama", "--port", str(port),
+        "--token-rate", str(args.token_rate), "--answer-tokens", str(args.answer_tokens),
+        "--prefill-ms", str(args.prefill_ms), "--parallel", str(args.ollama_parallel),
+    ]
+    process = subprocess.Popen(command, cwd=REPO_ROOT, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    if not wait_for(url, 10):
+        process.kill()
+        raise RuntimeError(f"Fake Ollama did not start on port {port}")
+    return process, url
+
+
+def server_env(args, ollama_url):
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": REPO_ROOT + os.pathsep + env.get("PYTHONPATH", ""),
+        "OLLAMA_HOST": ollama_url,
+        "SERVER_PORT": str(args.port),
+        "SERVER_MODE": args.mode,
+        "ANSWER_CACHE_ENABLED": "true" if args.answer_cache else "false",
+    })
+    return env
+
+
+def build_workdir(args, env, log):
+    workdir = tempfile.mkdtemp(prefix="notchnet-bench-")
+    write_corpus(os.path.join(workdir, "data", "wiki_pages_cleaned"), args.pages, args.seed)
+    print(f"🧱 Building an index of {args.pages} synthetic pages in {workdir}...")
+    subprocess.run(
+        [sys.executable, "-m", "config.build_index"],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT, check=True,
+    )
+    return workdir
+
+
+# ---- measurement ----
+
+def read_rss(pid):
+    """Resident set size of `pid` in bytes (Linux), or None."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            rss = read_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self.stopped.wait(self.interval)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+async def ask_once(session, url, question, stream):
+    """Returns (status, seconds to first token, total seconds)."""
+    started = time.perf_counter()
+    first = None
+    async with session.post(url, json={"question": question}) as response:
+        if not stream or response.status != 200:
+            await response.read()
+            total = time.perf_counter() - started
+            return response.status, total, total
+        async for line in response.content:
+            if first is None and line.startswith(b"data: ") and b'"token"' in line:
+                first = time.perf_counter() - started
+        total = time.perf_counter() - started
+        return response.status, first if first is not None else total, total
+
+
+async def drive(base_url, questions, concurrency, stream):
+    url = base_url + ("/ask/stream" if stream else "/ask")
+    pending = list(reversed(questions))
+    results = []
+    timeout = aiohttp.ClientTimeout(total=600)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        async def client():
+            while pending:
+                question = pending.pop()
+                try:
+                    results.append(await ask_once(session, url, question, stream))
+                except aiohttp.ClientError as e:
+                    results.append((type(e).__name__, None, None))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r[0] == 200]
+    statuses = {}
+    for status, _, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latency = [r[2] for r in ok]
+    ttft = [r[1] for r in ok]
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "statuses": statuses,
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": {"p50": ms(percentile(latency, 0.5)), "p95": ms(percentile(latency, 0.95)), "p99": ms(percentile(latency, 0.99))},
+        "ttft_ms": {"p50": ms(percentile(ttft, 0.5)), "p95": ms(percentile(ttft, 0.95)), "p99": ms(percentile(ttft, 0.99))},
+    }
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except OSError:
+        return None
+
+
+# ---- main ----
+
+def run(args):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    log = open(os.path.join(RESULTS_DIR, "serve_bench.log"), "w")
+    processes = []
+    workdir = args.workdir
+    try:
+        if args.ollama:
+            ollama_url = args.ollama
+        else:
+            process, ollama_url = start_fake_ollama(args, log)
+            processes.append(process)
+        env = server_env(args, ollama_url)
+        if workdir is None:
+            workdir = build_workdir(args, env, log)
+
+        started = time.monotonic()
+        server = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_ROOT, "server.py")], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+        )
+        processes.append(server)
+        base_url = f"http://127.0.0.1:{args.port}"
+        if not wait_for(base_url + "/readyz", args.ready_timeout):
+            raise RuntimeError(f"server.py was not ready within {args.ready_timeout}s, see {log.name}")
+        ready_s = time.monotonic() - started
+        idle_rss = read_rss(server.pid)
+        print(f"🟢 server.py ({args.mode}) ready in {ready_s:.2f}s, RSS {idle_rss / 1e6 if idle_rss else 0:.0f} MB")
+
+        stream = args.endpoint == "stream"
+        if args.warmup:
+            asyncio.run(drive(base_url, make_questions(args.warmup, args.seed + 1), min(args.concurrency, args.warmup), stream))
+
+        sampler = RssSampler(server.pid)
+        sampler.start()
+        results, elapsed = asyncio.run(drive(base_url, make_questions(args.requests, args.seed), args.concurrency, stream))
+        sampler.stopped.set()
+        sampler.join()
+
+        summary = summarize(results, elapsed)
+        summary["rss_mb"] = {
+            "idle": round(idle_rss / 1e6, 1) if idle_rss else None,
+            "peak": round(max(sampler.samples) / 1e6, 1) if sampler.samples else None,
+            "end": round(sampler.samples[-1] / 1e6, 1) if sampler.samples else None,
+        }
+        summary["ready_s"] = round(ready_s, 3)
+        report = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "settings": {
+                "mode": args.mode, "endpoint": args.endpoint, "concurrency": args.concurrency,
+                "requests": args.requests, "answer_cache": args.answer_cache, "pages": args.pages,
+                "ollama": args.ollama or "fake", "token_rate": args.token_rate, "answer_tokens": args.answer_tokens,
+                "prefill_ms": args.prefill_ms, "ollama_parallel": args.ollama_parallel,
+            },
+            "results": summary,
+        }
+        print_summary(summary)
+        output = args.output or os.path.join(RESULTS_DIR, f"serve-{args.mode}-{args.endpoint}-c{args.concurrency}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Saved results to {output}")
+        return report
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log.close()
+        if workdir is not None and args.workdir is None and not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_summary(summary):
+    latency, ttft, rss = summary["latency_ms"], summary["ttft_ms"], summary["rss_mb"]
+    print(f"📨 {summary['ok']}/{summary['requests']} answered in {summary['elapsed_s']:.1f}s ({summary['requests_per_s']} req/s), statuses {summary['statuses']}")
+    print(f"⏱️ latency p50 {latency['p50']} ms | p95 {latency['p95']} ms | p99 {latency['p99']} ms")
+    print(f"⚡ first token p50 {ttft['p50']} ms | p95 {ttft['p95']} ms | p99 {ttft['p99']} ms")
+    print(f"🧠 server RSS idle {rss['idle']} MB | peak {rss['peak']} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark server.py end to end against a stand-in Ollama.")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="SERVER_MODE of the server under test")
+    parser.add_argument("--endpoint", choices=["ask", "stream"], default="stream", help="/ask or /ask/stream")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients sending questions at once")
+    parser.add_argument("--requests", type=int, default=200, help="Questions sent in the timed run")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed questions sent first")
+    parser.add_argument("--answer-cache", action="store_true", help="Leave the answer cache on (off by default)")
+    parser.add_argument("--port", type=int, default=8765, help="Port for server.py")
+    parser.add_argument("--ready-timeout", type=float, default=120, help="Seconds to wait for /readyz")
+    parser.add_argument("--workdir", default=None, help="Run server.py in this directory and use its index instead of a synthetic one")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the synthetic index directory afterwards")
+    parser.add_argument("--pages", type=int, default=300, help="Synthetic wiki pages to index")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--ollama", default=None, help="Use this Ollama URL instead of starting the fake one")
+    parser.add_argument("--ollama-port", type=int, default=11435, help="Port for the fake Ollama")
+    parser.add_argument("--token-rate", type=float, default=50, help="Fake Ollama: answer tokens per second")
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Fake Ollama: tokens per answer")
+    parser.add_argument("--prefill-ms", type=float, default=50, help="Fake Ollama: delay before the first token")
+    parser.add_argument("--ollama-parallel", type=int, default=2, help="Fake Ollama: generations served at once")
+    parser.add_argument("--output", default=None, help="JSON file for the results (default: bench/results/serve-*.json)")
+    run(parser.parse_args())
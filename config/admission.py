@@ -0,0 +1,181 @@
+import math
+import time
+import asyncio
+import threading
+import collections
+from contextlib import contextmanager
+
+from config import config
+from config import metrics
+
+# ===========================
+# LLM admission control
+# ===========================
+#
+# Ollama answers a few generations at a time; everything beyond that only
+# queues inside it. The gate lets LLM_MAX_CONCURRENCY generations run, keeps
+# at most LLM_QUEUE_SIZE more waiting (first come, first served), and turns
+# everything else away at once:
+#   429  the wait queue is full
+#   503  a request waited LLM_QUEUE_TIMEOUT seconds without getting a slot
+# Both carry a Retry-After estimate from recent generation times. Only
+# generations take a slot; cached answers and requests following an answer
+# that is already being generated never wait here.
+
+STATS_WINDOW = 1000
+
+
+class Overloaded(Exception):
+    def __init__(self, status, retry_after, queue_depth, message):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake  # Called (under the gate lock) when a slot is handed over
+        self.granted_at = None
+        self.queued_at = time.monotonic()
+
+
+class LLMGate:
+    def __init__(self, slots, queue_size, timeout):
+        self.slots = max(1, slots)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._waiters = collections.deque()
+        self.active = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._waits = collections.deque(maxlen=STATS_WINDOW)
+        self._holds = collections.deque(maxlen=STATS_WINDOW)
+
+    # ---- admission ----
+
+    def _admit_or_enqueue(self, wake):
+        """Takes a free slot (returns its start time) or queues a waiter (returns it). Called under the lock."""
+        if self.active < self.slots and not self._waiters:
+            self.active += 1
+            return self._admitted(0.0)
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_full += 1
+            raise self._overloaded(429, "Too many questions are waiting for an answer, try again shortly.")
+        waiter = _Waiter(wake)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _give_up(self, waiter):
+        """Leaves the queue after a timeout or cancellation. Returns True if the slot arrived first."""
+        with self._lock:
+            if waiter.granted_at is not None:
+                return True
+            self._waiters.remove(waiter)
+            return False
+
+    def _timed_out(self):
+        with self._lock:
+            self.rejected_timeout += 1
+            return self._overloaded(503, "The server is busy answering other questions, try again shortly.")
+
+    def _admitted(self, waited):
+        self.admitted += 1
+        self._waits.append(waited)
+        return time.monotonic()
+
+    def acquire(self):
+        """
+        Blocks until a generation slot is free and returns the time it was
+        granted, to be passed to release(). Raises Overloaded instead of
+        waiting too long.
+        """
+        event = threading.Event()
+        with self._lock:
+            waiter = self._admit_or_enqueue(event.set)
+        if not isinstance(waiter, _Waiter):
+            return waiter
+        if not event.wait(self.timeout) and not self._give_up(waiter):
+            raise self._timed_out()
+        return waiter.granted_at
+
+    async def acquire_async(self):
+        """Like acquire(), but waits for the slot without holding a thread."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        with self._lock:
+            waiter = self._admit_or_enqueue(wake)
+        if not isinstance(waiter, _Waiter):
+            return waiter
+        try:
+            await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            if not self._give_up(waiter):
+                raise self._timed_out()
+        except BaseException:
+            # Client went away while queued: hand back a slot that arrived meanwhile.
+            if self._give_up(waiter):
+                self.release(waiter.granted_at)
+            raise
+        return waiter.granted_at
+
+    def release(self, granted_at):
+        with self._lock:
+            self._holds.append(time.monotonic() - granted_at)
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter.
+                waiter = self._waiters.popleft()
+                waiter.granted_at = self._admitted(time.monotonic() - waiter.queued_at)
+                waiter.wake()
+            else:
+                self.active -= 1
+
+    @contextmanager
+    def slot(self):
+        granted_at = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(granted_at)
+
+    # ---- reporting ----
+
+    def _overloaded(self, status, message):
+        return Overloaded(status, self._retry_after(), len(self._waiters), message)
+
+    def _retry_after(self):
+        """Seconds until the current queue should have drained, from recent generation times."""
+        holds = list(self._holds)
+        average = sum(holds) / len(holds) if holds else 5.0
+        return max(1, math.ceil(average * (len(self._waiters) + 1) / self.slots))
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            holds = list(self._holds)
+            return {
+                "slots": self.slots,
+                "active": self.active,
+                "queue_depth": len(self._waiters),
+                "queue_size": self.queue_size,
+                "queue_timeout": self.timeout,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_full,
+                "rejected_timeout": self.rejected_timeout,
+                "wait_ms_p50": round(waits[len(waits) // 2] * 1000, 1) if waits else 0.0,
+                "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+                "avg_generation_s": round(sum(holds) / len(holds), 2) if holds else 0.0,
+                "retry_after": self._retry_after(),
+            }
+
+
+llm_gate = LLMGate(config.LLM_MAX_CONCURRENCY, config.LLM_QUEUE_SIZE, config.LLM_QUEUE_TIMEOUT)
+metrics.LLM_QUEUE_DEPTH.set_function(lambda: len(llm_gate._waiters))
+metrics.LLM_ACTIVE.set_function(lambda: llm_gate.active)
+metrics.LLM_REJECTED.set_function(lambda: {"429": llm_gate.rejected_full, "503": llm_gate.rejected_timeout})
@@ -0,0 +1,131 @@
+import time
+import numpy as np
+import faiss  # type: ignore
+
+from config import config
+
+# ===========================
+# Approximate nearest neighbour indexes
+# ===========================
+#
+# Builders always work on an exact IndexFlatL2: LangChain's FAISS store deletes
+# by position, which only an exact index keeps consistent. When a version is
+# published, the flat vectors are turned into the configured ANN index
+# (INDEX_TYPE = flat | ivf | hnsw) and that is what gets saved and served.
+# Loading a version for an update turns it back into a flat index, so changing
+# the index type or its parameters never needs re-embedding.
+
+
+def settings():
+    """Build-time parameters; a change makes the next build re-publish the shard."""
+    index_type = config.INDEX_TYPE.lower()
+    if index_type == "ivf":
+        return {"type": "ivf", "nlist": config.IVF_NLIST}
+    if index_type == "hnsw":
+        return {"type": "hnsw", "m": config.HNSW_M, "ef_construction": config.HNSW_EF_CONSTRUCTION}
+    return {"type": "flat"}
+
+
+def configure(index):
+    """Applies the search-time parameters (nprobe / efSearch) to a loaded index."""
+    if isinstance(index, faiss.IndexIVF):
+        index.nprobe = config.IVF_NPROBE
+    elif isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = config.HNSW_EF_SEARCH
+    return index
+
+
+def to_flat(index):
+    """Returns an exact IndexFlatL2 holding the same vectors in the same order."""
+    if isinstance(index, faiss.IndexFlat):
+        return index
+    if isinstance(index, faiss.IndexIVF):
+        index.make_direct_map()
+    flat = faiss.IndexFlatL2(index.d)
+    if index.ntotal:
+        flat.add(index.reconstruct_n(0, index.ntotal))
+    return flat
+
+
+def _vectors(flat):
+    return flat.reconstruct_n(0, flat.ntotal)
+
+
+def _sample(n, size, rng):
+    return np.sort(rng.choice(n, size=min(n, size), replace=False))
+
+
+def build(flat):
+    """
+    Builds the configured ANN index from a flat index. Returns None when the
+    flat index should be served as is (INDEX_TYPE=flat, or fewer than
+    ANN_MIN_VECTORS vectors, where an exact search is already fast).
+    """
+    params = settings()
+    n = flat.ntotal
+    if params["type"] == "flat" or n < max(1, config.ANN_MIN_VECTORS):
+        return None
+
+    vectors = _vectors(flat)
+    rng = np.random.default_rng(0)
+    started = time.monotonic()
+    if params["type"] == "ivf":
+        # Default to ~4*sqrt(n) lists; faiss wants ~39 training points per list.
+        nlist = params["nlist"] or int(4 * np.sqrt(n))
+        nlist = max(1, min(nlist, n // 39))
+        index = faiss.index_factory(flat.d, f"IVF{nlist},Flat", faiss.METRIC_L2)
+        sample = vectors[_sample(n, max(config.ANN_TRAIN_SAMPLE, 39 * nlist), rng)]
+        print(f"🧮 Training IVF{nlist},Flat on {len(sample)} of {n} vectors...")
+        index.train(sample)
+    else:
+        index = faiss.IndexHNSWFlat(flat.d, params["m"], faiss.METRIC_L2)
+        index.hnsw.efConstruction = params["ef_construction"]
+        print(f"🧮 Building HNSW{params['m']} over {n} vectors...")
+    index.add(vectors)
+    print(f"✅ {params['type'].upper()} index built in {time.monotonic() - started:.1f}s.")
+    return configure(index)
+
+
+def _timed_search(index, queries, k):
+    """Searches one query at a time, like the server does. Returns (ids, per-query seconds)."""
+    ids = np.empty((len(queries), k), dtype=np.int64)
+    latencies = np.empty(len(queries))
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        _, ids[i] = index.search(query[None, :], k)
+        latencies[i] = time.perf_counter() - started
+    return ids, latencies
+
+
+def evaluate(flat, index, k=None, queries=None):
+    """
+    Compares an ANN index with exact search: recall@k of the ANN hits against
+    the flat hits, and per-query latency of both. Queries default to a sample
+    of the indexed vectors.
+    """
+    k = k or config.RETRIEVER_K
+    if queries is None:
+        queries = _vectors(flat)[_sample(flat.ntotal, config.ANN_EVAL_QUERIES, np.random.default_rng(1))]
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    k = min(k, flat.ntotal)
+    exact, flat_latency = _timed_search(flat, queries, k)
+    approx, ann_latency = _timed_search(index, queries, k)
+    hits = sum(len(set(e) & set(a)) for e, a in zip(exact, approx))
+    return {
+        "k": k,
+        "queries": len(queries),
+        "recall": round(hits / (len(queries) * k), 4),
+        "flat_ms_p50": round(float(np.percentile(flat_latency, 50)) * 1000, 3),
+        "flat_ms_p95": round(float(np.percentile(flat_latency, 95)) * 1000, 3),
+        "ann_ms_p50": round(float(np.percentile(ann_latency, 50)) * 1000, 3),
+        "ann_ms_p95": round(float(np.percentile(ann_latency, 95)) * 1000, 3),
+    }
+
+
+def describe(index):
+    """Type and search parameters of an index, for manifests and stats."""
+    if isinstance(index, faiss.IndexIVF):
+        return {"type": "ivf", "nlist": index.nlist, "nprobe": index.nprobe}
+    if isinstance(index, faiss.IndexHNSW):
+        return {"type": "hnsw", "m": index.hnsw.nb_neighbors(1), "ef_search": index.hnsw.efSearch}
+    return {"type": "flat"}
@@ -0,0 +1,187 @@
+import re
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+
+from config import config
+from config import metrics
+
+# ===========================
+# Answer cache + in-flight collapsing
+# ===========================
+#
+# Answers are keyed by the normalized question and the index version, so a
+# reload of the QA chain naturally stops serving answers from the old index.
+# Identical questions that arrive while an answer is still being generated
+# attach to the running generation instead of starting their own LLM call.
+
+
+def normalize_question(question):
+    """Lowercases, drops punctuation and collapses whitespace."""
+    return " ".join(re.sub(r"[^\w\s]", " ", question.lower()).split())
+
+
+def make_key(question, index_version):
+    return (normalize_question(question), index_version)
+
+
+def split_tokens(answer):
+    """Splits a cached answer into word-sized pieces for SSE replay."""
+    return re.findall(r"\s*\S+", answer)
+
+
+class InFlight:
+    """A generation in progress that other requests for the same key can follow."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._async_waiters = set()  # (loop, asyncio.Event) of async followers
+        self.tokens = []
+        self.answer = None
+        self.error = None
+        self.done = False
+
+    def _notify(self):
+        self._cond.notify_all()
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def publish(self, token):
+        with self._cond:
+            self.tokens.append(token)
+            self._notify()
+
+    def finish(self, answer):
+        with self._cond:
+            self.answer = answer
+            self.done = True
+            self._notify()
+
+    def fail(self, error):
+        with self._cond:
+            self.error = str(error)
+            self.done = True
+            self._notify()
+
+    def iter_tokens(self):
+        """Yields tokens as the leader produces them, including those already sent."""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self.tokens) and not self.done:
+                    self._cond.wait()
+                pending = self.tokens[i:]
+                finished = self.done
+            for token in pending:
+                yield token
+            i += len(pending)
+            if finished and i >= len(self.tokens):
+                return
+
+    async def aiter_tokens(self):
+        """Like iter_tokens, but waits on the event loop instead of blocking a thread."""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._cond:
+            self._async_waiters.add(waiter)
+        try:
+            i = 0
+            while True:
+                with self._cond:
+                    pending = self.tokens[i:]
+                    finished = self.done
+                    if not pending and not finished:
+                        waiter[1].clear()
+                for token in pending:
+                    yield token
+                i += len(pending)
+                if finished and not pending:
+                    return
+                if not pending:
+                    await waiter[1].wait()
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+    def wait(self):
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+        if self.error is not None:
+            raise RuntimeError(self.error)
+        return self.answer
+
+
+class AnswerCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, stored_at = entry
+                if time.time() - stored_at <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return answer
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, answer):
+        with self._lock:
+            self._entries[key] = (answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def join_flight(self, key):
+        """Returns (flight, is_leader). The leader must call end_flight when done."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.collapsed += 1
+                return flight, False
+            flight = InFlight()
+            self._flights[key] = flight
+            return flight, True
+
+    def end_flight(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if not flight.done:
+            flight.fail("Generation was interrupted.")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": config.ANSWER_CACHE_ENABLED,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "collapsed": self.collapsed,
+                "in_flight": len(self._flights),
+            }
+
+
+answer_cache = AnswerCache(config.ANSWER_CACHE_MAX_ENTRIES, config.ANSWER_CACHE_TTL)
+metrics.ANSWER_CACHE.set_function(
+    lambda: {"hit": answer_cache.hits, "miss": answer_cache.misses, "collapsed": answer_cache.collapsed}
+)
@@ -1,85 +1,289 @@
 import os
-import shutil
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
+import json
+import hashlib
+import argparse
+import faiss
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from tqdm import tqdm
 from config import config
+from config import embedding_cache
+from config import index_store
+from config import shards
+from config import lexical_index
+from config import ann_index
+from config import chunk_store
+
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "index.faiss"
+BATCH_SIZE = 100
+
+# Anything that changes how chunks are produced or embedded. If these differ
+# from what an existing index was built with, an incremental update is unsafe.
+INDEX_SETTINGS = {
+    "chunk_size": 1000,
+    "chunk_overlap": 100,
+    "embedding_model": config.EMBEDDING_MODEL,
+    "embedding_api": "embed",  # Ollama /api/embed (normalized vectors)
+}
+
+
+def load_manifest(index_path):
+    """Loads the source file -> hash -> chunk IDs manifest stored next to the index."""
+    manifest_path = os.path.join(index_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not read index manifest: {e}")
+        return None
+
+
+def save_manifest(index_path, manifest):
+    manifest_path = os.path.join(index_path, MANIFEST_FILE)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def split_file(text_splitter, path, rel_path, text):
+    """Splits one source file into chunks with stable, path-derived IDs."""
+    doc = Document(page_content=text, metadata={"source": path})
+    chunks = text_splitter.split_documents([doc])
+    ids = [f"{rel_path}::{i}" for i in range(len(chunks))]
+    return chunks, ids
+
+
+def make_text_splitter():
+    return RecursiveCharacterTextSplitter(
+        chunk_size=INDEX_SETTINGS["chunk_size"],
+        chunk_overlap=INDEX_SETTINGS["chunk_overlap"],
+        length_function=len,
+        is_separator_regex=False,
+    )
+
+
+def live_manifest(index_path):
+    """Returns (index_dir, manifest) of the live index if it can be updated incrementally, else (None, None)."""
+    current_dir = index_store.current_index_dir(index_path)
+    manifest = load_manifest(current_dir) if current_dir else None
+    if manifest is None or manifest.get("settings") != INDEX_SETTINGS or not chunk_store.exists(current_dir):
+        return None, None
+    return current_dir, manifest
+
+
+def publish_index(vector_store, manifest, index_path):
+    """
+    Saves an index, its chunk store, lexical index and manifest as a new
+    version and publishes it. The store's flat index is saved as the
+    configured ANN index, with its recall and latency against exact search
+    recorded in the manifest. Returns the version.
+    """
+    version, staging_dir = index_store.new_version_dir(index_path)
+    flat = vector_store.index
+    try:
+        ann = ann_index.build(flat)
+        manifest["index"] = {"settings": ann_index.settings(), **ann_index.describe(ann or flat)}
+        if ann is not None:
+            report = ann_index.evaluate(flat, ann)
+            manifest["index"]["report"] = report
+            print(
+                f"📏 {manifest['index']['type'].upper()} recall@{report['k']}: {report['recall']:.3f} | "
+                f"p50 {report['ann_ms_p50']:.2f}ms vs flat {report['flat_ms_p50']:.2f}ms "
+                f"(p95 {report['ann_ms_p95']:.2f}ms vs {report['flat_ms_p95']:.2f}ms)"
+            )
+        print(f"💾 Saving index version {version} to '{staging_dir}'...")
+        faiss.write_index(ann or flat, os.path.join(staging_dir, VECTORS_FILE))
+        rows = [
+            (chunk_id, vector_store.docstore.search(chunk_id))
+            for chunk_id in (vector_store.index_to_docstore_id[i] for i in range(flat.ntotal))
+        ]
+        chunk_store.write(staging_dir, rows)
+        lexical_index.build(
+            (chunk_id, doc.page_content, doc.metadata.get("source", "")) for chunk_id, doc in rows
+        ).save(staging_dir)
+        save_manifest(staging_dir, manifest)
+    except Exception:
+        index_store.discard_version(version, index_path)
+        raise
+    index_store.publish_version(version, index_path)
+    return version
+
+
+def load_for_update(index_dir, embeddings):
+    """Loads a published index for incremental updates: an exact flat index over an in-memory docstore."""
+    index = ann_index.to_flat(faiss.read_index(os.path.join(index_dir, VECTORS_FILE)))
+    chunks = chunk_store.ChunkStore(index_dir)
+    docs = {}
+    index_to_docstore_id = {}
+    for row in range(len(chunks)):
+        doc = chunks.document(row)
+        docs[doc.id] = doc
+        index_to_docstore_id[row] = doc.id
+    return FAISS(embeddings, index, InMemoryDocstore(docs), index_to_docstore_id)
+
+
+def build_shard(shard, incremental=True, paths=None):
+    """
+    Builds or updates one shard's FAISS index from its cleaned wiki pages.
+
+    In incremental mode only files whose content hash changed since the last
+    build are re-split and re-embedded; vectors of changed or removed files
+    are deleted. If `paths` (relative to the cleaned directory) is given, only
+    those files are checked and every other file is assumed unchanged.
+    A full rebuild happens when no usable manifest exists.
+    The result is written to a new version directory and published only once
+    it is complete. Returns True if a new index version was published.
+    """
+    print(f"🚀 Starting FAISS index build for shard '{shard}'...")
 
-def build_index():
-    print("🚀 Starting FAISS index build...")
-    
     # 1. Setup paths
     source_dir = config.DATA_DIR_CLEANED
-    index_path = config.INDEX_PATH
-    
+    index_path = shards.shard_index_path(shard)
+
     if not os.path.exists(source_dir):
         print(f"❌ Error: Source directory '{source_dir}' does not exist.")
-        return
-
-    # 2. Load documents
-    print(f"📂 Loading documents from '{source_dir}'...")
-    loader = DirectoryLoader(
-        source_dir,
-        glob="**/*.txt",
-        loader_cls=TextLoader,
-        loader_kwargs={"encoding": "utf-8"}
-    )
-    
-    # Use tqdm for loading progress
-    documents = []
-    
-    # Count files to show an accurate progress bar
-    import glob
-    file_list = glob.glob(os.path.join(source_dir, "**/*.txt"), recursive=True)
-    total_files = len(file_list)
-    
-    for doc in tqdm(loader.lazy_load(), total=total_files, desc="Loading"):
-        documents.append(doc)
-        
-    print(f"✅ Loaded {len(documents)} documents.")
-
-    # 3. Split documents
-    print("✂️ Splitting documents into chunks...")
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=100,
-        length_function=len,
-        is_separator_regex=False,
-    )
-    chunks = text_splitter.split_documents(documents)
-    print(f"✅ Created {len(chunks)} chunks.")
+        return False
 
-    # 4. Initialize embeddings
-    print(f"🧠 Initializing embeddings (Ollama: nomic-embed-text)...")
-    embeddings = OllamaEmbeddings(
-        model="nomic-embed-text",
-        base_url=config.OLLAMA_HOST
-    )
+    # 2. Initialize embeddings
+    print(f"🧠 Initializing embeddings (Ollama: {INDEX_SETTINGS['embedding_model']})...")
+    embeddings = embedding_cache.get_embeddings()
 
-    # 5. Build and save FAISS index
-    print("🏗️ Building FAISS index (this may take a while)...")
-    
-    BATCH_SIZE = 100
+    # 3. Load the live index + manifest when updating incrementally
+    current_dir, manifest = live_manifest(index_path) if incremental else (None, None)
     vector_store = None
-    
+    if incremental and manifest is None and index_store.current_version(index_path):
+        print("⚠️ No usable manifest or chunk store, or index settings changed since the last build. Doing a full rebuild.")
+    if manifest is not None:
+        try:
+            vector_store = load_for_update(current_dir, embeddings)
+            print(f"🔁 Loaded existing index from '{current_dir}' for incremental update.")
+        except Exception as e:
+            print(f"⚠️ Could not load existing index ({e}). Doing a full rebuild.")
+            manifest = None
+    if manifest is None:
+        incremental = False
+        manifest = {"settings": INDEX_SETTINGS, "files": {}}
+
+    # 4. Diff the source files against the manifest
+    old_files = manifest["files"]
+    new_files = {}
+    if incremental and paths is not None:
+        print(f"📂 Checking {len(paths)} changed documents in '{source_dir}'...")
+        paths = set(paths)
+        file_list = sorted(
+            os.path.join(source_dir, p) for p in paths if os.path.exists(os.path.join(source_dir, p))
+        )
+        new_files = {rel_path: entry for rel_path, entry in old_files.items() if rel_path not in paths}
+    else:
+        print(f"📂 Scanning documents of '{shard}' in '{source_dir}'...")
+        file_list = sorted(
+            os.path.join(source_dir, p) for p in shards.shard_files(shard)
+            if os.path.exists(os.path.join(source_dir, p))
+        )
+
+    to_embed = []
+    seen = set(new_files)
+    for path in tqdm(file_list, desc="Hashing"):
+        rel_path = os.path.relpath(path, source_dir)
+        seen.add(rel_path)
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        file_hash = hash_text(text)
+        previous = old_files.get(rel_path)
+        if previous is not None and previous["hash"] == file_hash:
+            new_files[rel_path] = previous
+        else:
+            to_embed.append((path, rel_path, text, file_hash))
+
+    stale_ids = []
+    for rel_path, entry in old_files.items():
+        if new_files.get(rel_path) is not entry:
+            stale_ids.extend(entry["chunks"])
+
+    removed = len(set(old_files) - seen)
+    print(f"✅ {len(new_files)} unchanged, {len(to_embed)} new/changed, {removed} removed files.")
+
+    if incremental and not to_embed and not stale_ids:
+        if manifest.get("index", {}).get("settings", {"type": "flat"}) == ann_index.settings():
+            print("✨ Index is already up to date.")
+            return False
+        print(f"🔧 Index type settings changed, re-publishing as {ann_index.settings()}...")
+
+    # 5. Drop vectors of changed or removed files
+    if vector_store is not None and stale_ids:
+        print(f"🗑️ Removing {len(stale_ids)} stale chunks...")
+        vector_store.delete(stale_ids)
+
+    # 6. Split changed documents
+    print("✂️ Splitting documents into chunks...")
+    text_splitter = make_text_splitter()
+    chunks = []
+    chunk_ids = []
+    for path, rel_path, text, file_hash in to_embed:
+        file_chunks, ids = split_file(text_splitter, path, rel_path, text)
+        chunks.extend(file_chunks)
+        chunk_ids.extend(ids)
+        new_files[rel_path] = {"hash": file_hash, "chunks": ids}
+    print(f"✅ Created {len(chunks)} chunks.")
+
+    # 7. Embed and add only the new chunks
+    print("🏗️ Embedding chunks into the FAISS index (this may take a while)...")
     for i in tqdm(range(0, len(chunks), BATCH_SIZE), desc="Indexing"):
         batch = chunks[i : i + BATCH_SIZE]
+        batch_ids = chunk_ids[i : i + BATCH_SIZE]
         if vector_store is None:
-            vector_store = FAISS.from_documents(batch, embeddings)
+            vector_store = FAISS.from_documents(batch, embeddings, ids=batch_ids)
         else:
-            vector_store.add_documents(batch)
-    
-    print(f"💾 Saving index to '{index_path}'...")
-    if os.path.exists(index_path) and vector_store is not None:
-        shutil.rmtree(index_path)
-    
-    if vector_store is not None:
-        vector_store.save_local(index_path)
-        print("🎉 FAISS index built and saved successfully!")
-    else:
+            vector_store.add_documents(batch, ids=batch_ids)
+
+    if vector_store is None:
         print("⚠️ No documents were indexed.")
+        return False
+
+    # 8. Save index and manifest into a staging version, then publish it
+    manifest["files"] = new_files
+    version = publish_index(vector_store, manifest, index_path)
+    print(f"🎉 FAISS index version {version} published ({vector_store.index.ntotal} vectors).")
+    print(f"🗃️ Embedding cache: {embedding_cache.cache_stats()}")
+    return True
+
+
+def build_index(incremental=True, paths=None, shard=None):
+    """
+    Builds or updates the index of one shard, or of every shard when `shard`
+    is None. Returns True if any new shard version was published.
+    """
+    if shard is not None:
+        return build_shard(shard, incremental, paths)
+
+    published = False
+    for name in shards.all_shards():
+        published = build_shard(name, incremental, None) or published
+
+    # Once every shard exists, the pre-sharding global index is no longer used.
+    if index_store.current_version(config.INDEX_PATH) and shards.live_shards():
+        print("🧹 Removing the old global index now that shards are built.")
+        shards.retire_global_index()
+    return published
+
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Build the NotchNet FAISS index shards.")
+    parser.add_argument("--full", action="store_true", help="Ignore the manifest and rebuild from scratch")
+    parser.add_argument("--shard", default=None, help="Only build this shard (a wiki host, e.g. minecraft.fandom.com)")
+    parser.add_argument("--index-type", choices=["flat", "ivf", "hnsw"], default=None, help="Override INDEX_TYPE")
+    args = parser.parse_args()
+    if args.index_type:
+        config.INDEX_TYPE = args.index_type
+
+    build_index(incremental=not args.full, shard=args.shard)
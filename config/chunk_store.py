@@ -0,0 +1,94 @@
+import os
+import json
+import mmap
+import numpy as np
+from langchain_core.documents import Document  # type: ignore
+
+# ===========================
+# Memory-mapped chunk store
+# ===========================
+#
+# Chunk texts and metadata of one index version, in FAISS row order:
+#   chunks.txt          every chunk's UTF-8 text, back to back
+#   chunk_offsets.npy   int64 byte offsets into chunks.txt (rows + 1 entries)
+#   chunk_meta.npy      int32 codes, one column per metadata key
+#   chunks.json         chunk IDs and the distinct values of each metadata column
+#
+# The blob and arrays are memory-mapped, so loading a shard reads almost
+# nothing and only the texts of the hits a query returns are ever touched.
+# Unlike LangChain's pickled docstore, nothing here can execute code on load.
+
+TEXT_FILE = "chunks.txt"
+OFFSETS_FILE = "chunk_offsets.npy"
+META_FILE = "chunk_meta.npy"
+INDEX_FILE = "chunks.json"
+
+
+def exists(index_dir):
+    return all(os.path.exists(os.path.join(index_dir, name)) for name in (TEXT_FILE, OFFSETS_FILE, META_FILE, INDEX_FILE))
+
+
+def write(index_dir, rows):
+    """Writes (chunk_id, Document) pairs, in FAISS row order."""
+    ids = []
+    offsets = [0]
+    columns = {}  # key -> {value: code}
+    codes = []
+    with open(os.path.join(index_dir, TEXT_FILE), "wb") as f:
+        for chunk_id, doc in rows:
+            data = doc.page_content.encode("utf-8")
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+            ids.append(chunk_id)
+            row = {}
+            for key, value in doc.metadata.items():
+                values = columns.setdefault(key, {})
+                row[key] = values.setdefault(value, len(values))
+            codes.append(row)
+
+    keys = sorted(columns)
+    meta = np.full((len(ids), len(keys)), -1, dtype=np.int32)
+    for i, row in enumerate(codes):
+        for j, key in enumerate(keys):
+            meta[i, j] = row.get(key, -1)
+    np.save(os.path.join(index_dir, OFFSETS_FILE), np.asarray(offsets, dtype=np.int64))
+    np.save(os.path.join(index_dir, META_FILE), meta)
+    with open(os.path.join(index_dir, INDEX_FILE), "w", encoding="utf-8") as f:
+        json.dump({"ids": ids, "columns": {key: list(columns[key]) for key in keys}}, f)
+
+
+class ChunkStore:
+    """Read-only view of a version's chunk store. `search` mirrors LangChain's docstore."""
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        self.ids = meta["ids"]
+        self.columns = list(meta["columns"].items())
+        self.offsets = np.load(os.path.join(index_dir, OFFSETS_FILE), mmap_mode="r")
+        self.meta = np.load(os.path.join(index_dir, META_FILE), mmap_mode="r")
+        self._rows = None
+        with open(os.path.join(index_dir, TEXT_FILE), "rb") as f:
+            # mmap cannot map an empty file
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.offsets[-1] else b""
+
+    def __len__(self):
+        return len(self.ids)
+
+    def document(self, row):
+        start, end = int(self.offsets[row]), int(self.offsets[row + 1])
+        metadata = {}
+        for j, (key, values) in enumerate(self.columns):
+            code = self.meta[row, j]
+            if code >= 0:
+                metadata[key] = values[code]
+        return Document(id=self.ids[row], page_content=self.blob[start:end].decode("utf-8"), metadata=metadata)
+
+    def row(self, chunk_id):
+        if self._rows is None:
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return self._rows.get(chunk_id)
+
+    def search(self, chunk_id):
+        row = self.row(chunk_id)
+        return None if row is None else self.document(row)
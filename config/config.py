@@ -28,15 +28,98 @@ CLOUD_API_KEY = os.environ.get("CLOUD_API_KEY", "")
 # Default to a smaller model for local users if not specified, 
 # but if cloud mode is true, we might want a bigger default or user specified.
 LLM_MODEL = os.environ.get("LLM_MODEL", "llama3:8b") 
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "nomic-embed-text")
 
 # Paths
 DATA_DIR_RAW = "data/wiki_pages"
 DATA_DIR_CLEANED = "data/wiki_pages_cleaned"
 INDEX_PATH = "faiss_index"
+WIKI_STATE_DIR = "data/wiki_state"
+EMBEDDING_CACHE_DIR = "embedding_cache"
+INDEX_KEEP_VERSIONS = int(os.environ.get("INDEX_KEEP_VERSIONS", 2))
+
+# ANN index (see config/ann_index.py)
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")  # flat | ivf | hnsw
+ANN_MIN_VECTORS = int(os.environ.get("ANN_MIN_VECTORS", 10000))  # Smaller shards stay flat
+ANN_TRAIN_SAMPLE = int(os.environ.get("ANN_TRAIN_SAMPLE", 50000))  # Vectors sampled to train IVF
+ANN_EVAL_QUERIES = int(os.environ.get("ANN_EVAL_QUERIES", 200))  # Queries for the build-time recall report
+IVF_NLIST = int(os.environ.get("IVF_NLIST", 0))  # 0 = ~4*sqrt(vectors)
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 16))
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 80))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 64))
+
+# Retrieval
+RETRIEVER_K = int(os.environ.get("RETRIEVER_K", 4))  # Chunks retrieved per question
+SHARD_SEARCH_WORKERS = int(os.environ.get("SHARD_SEARCH_WORKERS", 4))  # Shards searched in parallel
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "true").lower() == "true"  # Fuse BM25 and title hits with vector hits
+LEXICAL_SKIP_EMBEDDING = os.environ.get("LEXICAL_SKIP_EMBEDDING", "true").lower() == "true"  # Skip the embedding on confident title matches
+LEXICAL_CANDIDATES = int(os.environ.get("LEXICAL_CANDIDATES", 20))  # BM25 hits per shard fed into fusion
+RRF_K = int(os.environ.get("RRF_K", 60))  # Reciprocal rank fusion constant
+EMBED_BATCH_WINDOW_MS = float(os.environ.get("EMBED_BATCH_WINDOW_MS", 5))  # Query embedding batch window, 0 = off
+EMBED_BATCH_MAX = int(os.environ.get("EMBED_BATCH_MAX", 32))  # Queries per batched embedding call
+
+# Context packing
+CONTEXT_PACKING = os.environ.get("CONTEXT_PACKING", "true").lower() == "true"  # Merge, dedup and trim retrieved chunks
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", 1024))  # Max context tokens in the prompt
+CONTEXT_MMR_DIVERSITY = float(os.environ.get("CONTEXT_MMR_DIVERSITY", 0.3))  # 0 = relevance only, 1 = diversity only
+
+# Embedding Cache
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 250000))
+
+# Answer Cache
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 2000))
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 6 * 3600))
+
+# Serving
+SERVER_MODE = os.environ.get("SERVER_MODE", "sync")  # sync (Flask) | async (aiohttp)
+SERVER_PORT = int(os.environ.get("SERVER_PORT", 8000))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 2))  # Generations sent to Ollama at once
+LLM_QUEUE_SIZE = int(os.environ.get("LLM_QUEUE_SIZE", 32))  # Generations allowed to wait for a slot
+LLM_QUEUE_TIMEOUT = float(os.environ.get("LLM_QUEUE_TIMEOUT", 30))  # Seconds a generation may wait
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")  # Seconds or a duration like "30m" that Ollama keeps our models loaded ("-1" = forever)
+LLM_WARMUP = os.environ.get("LLM_WARMUP", "true").lower() == "true"  # Load both models at startup
+LLM_KEEP_WARM_INTERVAL = int(os.environ.get("LLM_KEEP_WARM_INTERVAL", 0))  # Seconds between keep-warm pings (0 = off)
 
 # Wiki Fetching
 WIKI_API_URL_DEFAULT = "https://minecraft.fandom.com/api.php"
 MAX_WORKERS = int(os.environ.get("MAX_WORKERS", 8))
+FETCH_CONCURRENCY_PER_HOST = int(os.environ.get("FETCH_CONCURRENCY_PER_HOST", MAX_WORKERS))
+FETCH_MAX_RETRIES = int(os.environ.get("FETCH_MAX_RETRIES", 4))
+FETCH_BACKOFF_BASE = float(os.environ.get("FETCH_BACKOFF_BASE", 1.0))
+FETCH_BACKOFF_CAP = float(os.environ.get("FETCH_BACKOFF_CAP", 30.0))
+FETCH_TIMEOUT = float(os.environ.get("FETCH_TIMEOUT", 30.0))
+WIKI_MAXLAG = int(os.environ.get("WIKI_MAXLAG", 5))
+WIKI_FETCH_MODE = os.environ.get("WIKI_FETCH_MODE", "batched")  # "batched" or "single"; page text is one request per page either way
+WIKI_BATCH_SIZE = int(os.environ.get("WIKI_BATCH_SIZE", 50))  # Titles per listing, image and revision query (MediaWiki max 50)
+WIKI_SYNC_INTERVAL = int(os.environ.get("WIKI_SYNC_INTERVAL", 3600))  # Min seconds between syncs of a wiki
+WIKI_RC_MAX_AGE_DAYS = int(os.environ.get("WIKI_RC_MAX_AGE_DAYS", 30))  # Older cursors fall back to revid checks
+
+# Cleaning
+CLEAN_WORKERS = int(os.environ.get("CLEAN_WORKERS", os.cpu_count() or 1))
+CLEAN_CHUNKSIZE = int(os.environ.get("CLEAN_CHUNKSIZE", 0))  # 0 = pick automatically
+
+# Ingestion
+INGEST_MODE = os.environ.get("INGEST_MODE", "pipeline")  # "pipeline" (streaming) or "batch" (fetch, clean, index)
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 64))  # Items buffered between pipeline stages
+INGEST_CLEAN_WORKERS = int(os.environ.get("INGEST_CLEAN_WORKERS", 2))
+INGEST_EMBED_WORKERS = int(os.environ.get("INGEST_EMBED_WORKERS", 4))  # Concurrent embedding batches
+INGEST_EMBED_BATCH = int(os.environ.get("INGEST_EMBED_BATCH", 32))  # Chunks per embedding batch
+INGEST_PUBLISH_INTERVAL = float(os.environ.get("INGEST_PUBLISH_INTERVAL", 30))  # Seconds between index publishes
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 2))  # Wikis downloaded at once
+INGEST_COALESCE_SECONDS = float(os.environ.get("INGEST_COALESCE_SECONDS", 10))  # Max wait to index finished downloads together
+INGEST_JOBS_FILE = os.environ.get("INGEST_JOBS_FILE", "data/ingest_jobs.json")
+INGEST_JOB_HISTORY = int(os.environ.get("INGEST_JOB_HISTORY", 100))  # Finished jobs kept for /admin/jobs
+INGEST_INDEX_RETRIES = int(os.environ.get("INGEST_INDEX_RETRIES", 3))  # Failed index passes retried before a job fails
+INGEST_RETRY_BACKOFF = float(os.environ.get("INGEST_RETRY_BACKOFF", 30))  # Seconds before the first retry, doubled each time
+
+# Mod Discovery
+MOD_WIKI_CACHE_SIZE = int(os.environ.get("MOD_WIKI_CACHE_SIZE", 4096))  # Mod -> wiki results kept in memory (LRU)
+MOD_FUZZY_THRESHOLD = float(os.environ.get("MOD_FUZZY_THRESHOLD", 0.75))  # Min trigram similarity to a mods.db name
+MOD_DISCOVERY_WORKERS = int(os.environ.get("MOD_DISCOVERY_WORKERS", 16))  # Parallel online wiki searches (0 = mods.db only)
+MOD_WIKI_RECHECK_SECONDS = int(os.environ.get("MOD_WIKI_RECHECK_SECONDS", 7 * 86400))  # Retry mods without a wiki after this
 
 def get_llm_model_name():
     return LLM_MODEL
@@ -0,0 +1,285 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+import ollama  # type: ignore
+from langchain_core.embeddings import Embeddings  # type: ignore
+
+from config import config
+from config import metrics
+from config import llm_client
+from config.query_batcher import QueryBatcher
+
+# ===========================
+# On-disk embedding cache
+# ===========================
+#
+# Layout (one directory per embedding model):
+#   vectors.f16   fixed-width float16 rows, one slot per cached text
+#   index.sqlite  key -> slot, last_used (LRU), plus the vector dimension
+#
+# Keys are sha1 hashes of the text plus a "doc"/"query" marker, because
+# Ollama embeds documents and queries with different instruction prefixes.
+
+DTYPE = np.float16
+SQL_BATCH = 500
+EMBED_REQUEST_BATCH = 64  # Texts per /api/embed request
+
+_shared_embeddings = None
+_shared_lock = threading.Lock()
+
+
+def text_key(kind, text):
+    return hashlib.sha1(f"{kind}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, cache_dir, max_entries):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)")
+        self._db.commit()
+
+        row = self._db.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        self.dim = row[0] if row else None
+        self._count = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        max_slot = self._db.execute("SELECT MAX(slot) FROM entries").fetchone()[0]
+        self._next_slot = 0 if max_slot is None else max_slot + 1
+        used = {r[0] for r in self._db.execute("SELECT slot FROM entries")}
+        self._free_slots = [s for s in range(self._next_slot) if s not in used]
+
+        vectors_path = os.path.join(cache_dir, "vectors.f16")
+        if not os.path.exists(vectors_path):
+            open(vectors_path, "wb").close()
+        self._file = open(vectors_path, "r+b")
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def _row_bytes(self):
+        return self.dim * np.dtype(DTYPE).itemsize
+
+    def get_many(self, keys):
+        """Returns {key: vector} for the keys present in the cache."""
+        found = {}
+        with self._lock:
+            if self.dim is None:
+                self.misses += len(keys)
+                return found
+            slots = {}
+            for i in range(0, len(keys), SQL_BATCH):
+                batch = keys[i : i + SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for key, slot in self._db.execute(
+                    f"SELECT key, slot FROM entries WHERE key IN ({placeholders})", batch
+                ):
+                    slots[key] = slot
+            for key, slot in slots.items():
+                self._file.seek(slot * self._row_bytes)
+                row = np.frombuffer(self._file.read(self._row_bytes), dtype=DTYPE)
+                found[key] = row.astype(np.float32).tolist()
+            if slots:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in slots]
+                )
+                self._db.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, items):
+        """Stores (key, vector) pairs, evicting least recently used entries when full."""
+        if not items:
+            return
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(items[0][1])
+                self._db.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('dim', ?)", (self.dim,))
+
+            # Another thread may have stored the same text while we were embedding.
+            items = list(dict(items).items())
+            keys = [key for key, _ in items]
+            present = set()
+            for i in range(0, len(keys), SQL_BATCH):
+                batch = keys[i : i + SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                present.update(
+                    r[0] for r in self._db.execute(f"SELECT key FROM entries WHERE key IN ({placeholders})", batch)
+                )
+            items = [(key, vector) for key, vector in items if key not in present and len(vector) == self.dim]
+
+            overflow = self._count + len(items) - self.max_entries
+            if overflow > 0:
+                self._evict(overflow)
+
+            now = time.time()
+            rows = []
+            for key, vector in items:
+                if self._free_slots:
+                    slot = self._free_slots.pop()
+                else:
+                    slot = self._next_slot
+                    self._next_slot += 1
+                self._file.seek(slot * self._row_bytes)
+                self._file.write(np.asarray(vector, dtype=DTYPE).tobytes())
+                rows.append((key, slot, now))
+            self._file.flush()
+
+            # Vectors are on disk before the index points at them.
+            self._db.executemany("INSERT INTO entries (key, slot, last_used) VALUES (?, ?, ?)", rows)
+            self._count += len(rows)
+            self._db.commit()
+
+    def _evict(self, count):
+        victims = self._db.execute(
+            "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?", (count,)
+        ).fetchall()
+        self._db.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+        self._free_slots.extend(slot for _, slot in victims)
+        self._count -= len(victims)
+        self.evictions += len(victims)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": self._count,
+                "max_entries": self.max_entries,
+                "dim": self.dim,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "size_bytes": self._next_slot * self._row_bytes if self.dim else 0,
+            }
+
+
+class OllamaBatchEmbeddings(Embeddings):
+    """
+    Ollama embeddings over /api/embed, which takes many texts per request
+    (the older /api/embeddings takes one). Uses the same instruction prefixes
+    as LangChain's OllamaEmbeddings. Queries go through a QueryBatcher when
+    one is attached, so concurrent questions share a request.
+    """
+
+    query_instruction = "query: "
+    embed_instruction = "passage: "
+
+    def __init__(self, model, base_url):
+        self.model = model
+        self.client = ollama.Client(host=base_url)
+        self.batcher = None
+
+    def _embed(self, texts):
+        vectors = []
+        for i in range(0, len(texts), EMBED_REQUEST_BATCH):
+            response = self.client.embed(
+                model=self.model, input=texts[i : i + EMBED_REQUEST_BATCH], keep_alive=llm_client.KEEP_ALIVE
+            )
+            vectors.extend(list(v) for v in response["embeddings"])
+        return vectors
+
+    def embed_documents(self, texts):
+        return self._embed([self.embed_instruction + t for t in texts])
+
+    def embed_queries(self, texts):
+        return self._embed([self.query_instruction + t for t in texts])
+
+    def embed_query(self, text):
+        if self.batcher is not None:
+            return self.batcher.embed(text)
+        return self.embed_queries([text])[0]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts missing from the cache to Ollama."""
+
+    def __init__(self, base, cache):
+        self.base = base
+        self.cache = cache
+
+    def _embed(self, kind, texts, compute):
+        keys = [text_key(kind, t) for t in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = compute(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts):
+        return self._embed("doc", texts, self.base.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("query", [text], lambda ts: [self.base.embed_query(t) for t in ts])[0]
+
+
+def get_embeddings():
+    """Returns the process-wide cached embeddings client used by indexing and queries."""
+    global _shared_embeddings
+    with _shared_lock:
+        if _shared_embeddings is None:
+            model = config.EMBEDDING_MODEL
+            base = OllamaBatchEmbeddings(model, config.OLLAMA_HOST)
+            if config.EMBED_BATCH_WINDOW_MS > 0:
+                base.batcher = QueryBatcher(base.embed_queries, config.EMBED_BATCH_WINDOW_MS, config.EMBED_BATCH_MAX)
+            if config.EMBEDDING_CACHE_ENABLED:
+                # /api/embed returns normalized vectors, unlike the /api/embeddings
+                # ones cached before, so they get their own cache directory.
+                cache_dir = os.path.join(config.EMBEDDING_CACHE_DIR, re.sub(r"[^\w.-]", "_", model) + ".embed")
+                cache = EmbeddingCache(cache_dir, config.EMBEDDING_CACHE_MAX_ENTRIES)
+                _shared_embeddings = CachedEmbeddings(base, cache)
+                print(f"🗃️ Embedding cache ready at '{cache_dir}' ({cache.stats()['entries']} entries).")
+            else:
+                _shared_embeddings = base
+        return _shared_embeddings
+
+
+def _base_embeddings():
+    embeddings = get_embeddings()
+    return embeddings.base if isinstance(embeddings, CachedEmbeddings) else embeddings
+
+
+def batcher_stats():
+    batcher = _base_embeddings().batcher
+    if batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **batcher.stats()}
+
+
+def _cache_counts():
+    """Hits and misses of the embedding cache, once it is open."""
+    if not isinstance(_shared_embeddings, CachedEmbeddings):
+        return None
+    cache = _shared_embeddings.cache
+    return {"hit": cache.hits, "miss": cache.misses}
+
+
+metrics.EMBEDDING_CACHE.set_function(_cache_counts)
+
+
+def cache_stats():
+    if not config.EMBEDDING_CACHE_ENABLED:
+        return {"enabled": False}
+    return {"enabled": True, **get_embeddings().cache.stats()}
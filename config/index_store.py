@@ -0,0 +1,95 @@
+import os
+import time
+import shutil
+
+from config import config
+
+# ===========================
+# Versioned index directories
+# ===========================
+#
+# faiss_index/
+#   CURRENT                 name of the live version
+#   versions/<version>/     index.faiss, chunk store, lexical index, manifest.json
+#
+# Builds write into a fresh version directory and only flip CURRENT once the
+# new index is completely on disk, so readers never see a half-written index.
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+
+
+def versions_root(index_path=None):
+    return os.path.join(index_path or config.INDEX_PATH, VERSIONS_DIR)
+
+
+def current_version(index_path=None):
+    """Returns the live version name, "legacy" for a pre-versioning index, or None."""
+    index_path = index_path or config.INDEX_PATH
+    pointer = os.path.join(index_path, CURRENT_FILE)
+    if os.path.exists(pointer):
+        with open(pointer, "r", encoding="utf-8") as f:
+            version = f.read().strip()
+        if version and os.path.isdir(os.path.join(versions_root(index_path), version)):
+            return version
+    if os.path.exists(os.path.join(index_path, "index.faiss")):
+        return "legacy"
+    return None
+
+
+def version_dir(version, index_path=None):
+    index_path = index_path or config.INDEX_PATH
+    if version == "legacy":
+        return index_path
+    return os.path.join(versions_root(index_path), version)
+
+
+def current_index_dir(index_path=None):
+    version = current_version(index_path)
+    return version_dir(version, index_path) if version else None
+
+
+def new_version_dir(index_path=None):
+    """Creates an empty staging directory for the next index version."""
+    root = versions_root(index_path)
+    os.makedirs(root, exist_ok=True)
+    version = str(int(time.time() * 1000))
+    while os.path.exists(os.path.join(root, version)):
+        version = str(int(version) + 1)
+    path = os.path.join(root, version)
+    os.makedirs(path)
+    return version, path
+
+
+def publish_version(version, index_path=None):
+    """Atomically points CURRENT at a fully written version and prunes old ones."""
+    index_path = index_path or config.INDEX_PATH
+    pointer = os.path.join(index_path, CURRENT_FILE)
+    tmp_pointer = pointer + ".tmp"
+    with open(tmp_pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(tmp_pointer, pointer)
+
+    # A pre-versioning index lives directly in index_path; it is superseded now.
+    for name in ("index.faiss", "index.pkl", "manifest.json"):
+        legacy_file = os.path.join(index_path, name)
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+    prune_versions(index_path)
+
+
+def discard_version(version, index_path=None):
+    shutil.rmtree(version_dir(version, index_path), ignore_errors=True)
+
+
+def prune_versions(index_path=None, keep=None):
+    """Deletes all but the newest `keep` versions. The live version is never deleted."""
+    keep = config.INDEX_KEEP_VERSIONS if keep is None else keep
+    root = versions_root(index_path)
+    if not os.path.isdir(root):
+        return
+    live = current_version(index_path)
+    versions = sorted(os.listdir(root), key=lambda v: int(v) if v.isdigit() else 0, reverse=True)
+    for version in versions[keep:]:
+        if version != live:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
@@ -0,0 +1,303 @@
+import os
+import time
+import asyncio
+import hashlib
+import concurrent.futures
+from langchain_community.vectorstores import FAISS  # type: ignore
+
+from config import config
+from config import build_index
+from config import embedding_cache
+from config import shards
+from wiki import wiki_loader
+from wiki import wiki_sync
+from wiki import clean_data
+
+# ===========================
+# Streaming ingestion
+# ===========================
+#
+#   fetch -> pages -> clean -> cleaned -> split -> chunks -> embed -> embedded -> add
+#
+# Every arrow is a bounded asyncio queue, so a slow stage (usually embedding)
+# holds back the ones before it instead of letting pages pile up in memory.
+# The add stage is the only writer to the wiki's shard and its manifest. It
+# adds whole pages at a time and publishes a new index version every
+# INGEST_PUBLISH_INTERVAL seconds, so pages become searchable while the wiki
+# is still downloading. Raw and cleaned page files are always written too:
+# a full-scan build_index drops the vectors of any page it cannot find on disk.
+
+DONE = object()  # Queue sentinel: the stage feeding this queue has finished
+
+
+async def run_stage(workers, outbox, consumers):
+    """Runs a stage's workers, then tells each consumer of `outbox` that no more items are coming."""
+    results = await asyncio.gather(*workers)
+    if outbox is not None:
+        for _ in range(consumers):
+            await outbox.put(DONE)
+    return results
+
+
+class IngestPipeline:
+    def __init__(self, api_url, on_publish=None):
+        self.api_url = api_url
+        self.shard = shards.shard_name(api_url)
+        self.index_path = shards.shard_index_path(self.shard)
+        self.on_publish = on_publish
+        self.embeddings = embedding_cache.get_embeddings()
+        self.text_splitter = build_index.make_text_splitter()
+        self.vector_store = None
+        self.manifest = None
+        self.raw_files = {}  # Clean manifest entries of the raw files written, by path under the wiki's directory
+        self.dirty = False
+        self.started = None
+        self.last_publish = None
+        self.first_publish = None
+        self.publishes = 0
+        self.pages_in = 0
+        self.pages_unchanged = 0
+        self.pages_indexed = 0
+        self.chunks_indexed = 0
+
+    def load(self, allow_new=False):
+        """
+        Loads the shard's live index. Returns False if there is none that can be
+        updated incrementally, unless `allow_new` lets the pipeline start it empty.
+        """
+        index_dir, manifest = build_index.live_manifest(self.index_path)
+        if manifest is None:
+            if not allow_new:
+                return False
+            self.manifest = {"settings": build_index.INDEX_SETTINGS, "files": {}}
+            print(f"🆕 Streaming into a new shard '{self.shard}'.")
+            return True
+        try:
+            self.vector_store = build_index.load_for_update(index_dir, self.embeddings)
+        except Exception as e:
+            print(f"⚠️ Could not load the live index for streaming ingestion: {e}")
+            return False
+        self.manifest = manifest
+        print(f"🔁 Streaming into shard '{self.shard}' at '{index_dir}' ({self.vector_store.index.ntotal} vectors).")
+        return True
+
+    # ---- stages ----
+
+    async def sink(self, category, title, text, image_path):
+        """Page sink for the fetcher. Waits while the clean stage is backed up."""
+        if text is None:
+            # The fetch failed. Replacing the page with nothing would drop its
+            # vectors; the sync retries it instead.
+            return
+        raw = wiki_loader.format_page(text, image_path)
+        rel_path = wiki_sync.rel_page_path(category, title, self.api_url)
+        wiki_loader.save_page_data(category, title, text, image_path, self.api_url)
+        data = raw.encode("utf-8")
+        wiki_path = os.path.relpath(rel_path, shards.wiki_prefix(self.shard) or ".")
+        self.raw_files[wiki_path] = {"hash": hashlib.sha1(data).hexdigest(), "size": len(data)}
+        self.pages_in += 1
+        await self.pages.put((rel_path, raw))
+
+    async def clean_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.pages.get()
+            if item is DONE:
+                return
+            rel_path, raw = item
+            cleaned = await loop.run_in_executor(self.cpu_pool, clean_data.clean_page, raw)
+            path = os.path.join(config.DATA_DIR_CLEANED, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(cleaned)
+            await self.cleaned.put((rel_path, cleaned))
+
+    async def split_worker(self):
+        while True:
+            item = await self.cleaned.get()
+            if item is DONE:
+                return
+            rel_path, text = item
+            file_hash = build_index.hash_text(text)
+            previous = self.manifest["files"].get(rel_path)
+            if previous is not None and previous["hash"] == file_hash:
+                self.pages_unchanged += 1
+                continue
+            path = os.path.join(config.DATA_DIR_CLEANED, rel_path)
+            chunks, ids = build_index.split_file(self.text_splitter, path, rel_path, text)
+            await self.chunks.put((rel_path, file_hash, chunks, ids))
+
+    async def embed_worker(self):
+        """Embeds whole pages, grouping queued pages up to INGEST_EMBED_BATCH chunks per call."""
+        loop = asyncio.get_running_loop()
+        finished = False
+        while not finished:
+            item = await self.chunks.get()
+            if item is DONE:
+                return
+            batch = [item]
+            size = len(item[2])
+            while size < config.INGEST_EMBED_BATCH:
+                try:
+                    item = self.chunks.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if item is DONE:
+                    finished = True
+                    break
+                batch.append(item)
+                size += len(item[2])
+            texts = [chunk.page_content for _, _, chunks, _ in batch for chunk in chunks]
+            vectors = await loop.run_in_executor(self.io_pool, self.embeddings.embed_documents, texts) if texts else []
+            await self.embedded.put((batch, vectors))
+
+    async def add_worker(self):
+        while True:
+            item = await self.embedded.get()
+            if item is DONE:
+                return
+            batch, vectors = item
+            offset = 0
+            for rel_path, file_hash, chunks, ids in batch:
+                self.replace_file(rel_path, file_hash, chunks, ids, vectors[offset : offset + len(chunks)])
+                offset += len(chunks)
+            if self.dirty and self.vector_store is not None and (
+                self.last_publish is None or time.monotonic() - self.last_publish >= config.INGEST_PUBLISH_INTERVAL
+            ):
+                await self.publish()
+
+    # ---- index updates (add stage only) ----
+
+    def replace_file(self, rel_path, file_hash, chunks, ids, vectors):
+        previous = self.manifest["files"].get(rel_path)
+        if previous is not None and previous["chunks"]:
+            self.vector_store.delete(previous["chunks"])
+        if chunks:
+            text_embeddings = list(zip((chunk.page_content for chunk in chunks), vectors))
+            metadatas = [chunk.metadata for chunk in chunks]
+            if self.vector_store is None:
+                self.vector_store = FAISS.from_embeddings(text_embeddings, self.embeddings, metadatas=metadatas, ids=ids)
+            else:
+                self.vector_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        self.manifest["files"][rel_path] = {"hash": file_hash, "chunks": ids}
+        self.pages_indexed += 1
+        self.chunks_indexed += len(chunks)
+        self.dirty = True
+
+    def remove_files(self, rel_paths):
+        for rel_path in rel_paths:
+            previous = self.manifest["files"].pop(rel_path, None)
+            if previous is not None:
+                if previous["chunks"]:
+                    self.vector_store.delete(previous["chunks"])
+                self.dirty = True
+            try:
+                os.remove(os.path.join(config.DATA_DIR_CLEANED, rel_path))
+            except OSError:
+                pass
+
+    async def publish(self):
+        loop = asyncio.get_running_loop()
+        version = await loop.run_in_executor(
+            None, build_index.publish_index, self.vector_store, self.manifest, self.index_path
+        )
+        self.dirty = False
+        self.publishes += 1
+        self.last_publish = time.monotonic()
+        if self.first_publish is None:
+            self.first_publish = self.last_publish - self.started
+        print(f"📢 Published shard '{self.shard}' version {version} ({self.pages_indexed} pages indexed so far).")
+        if self.on_publish is not None:
+            await loop.run_in_executor(None, self.on_publish)
+
+    # ---- driver ----
+
+    async def run(self, produce):
+        """
+        Streams the pages `produce(sink)` hands to its sink into the index.
+        `produce` returns (changed, removed) page paths; removed pages are
+        dropped from the index at the end. Returns the same pair.
+        """
+        self.started = time.monotonic()
+        size = config.INGEST_QUEUE_SIZE
+        self.pages = asyncio.Queue(maxsize=size)
+        self.cleaned = asyncio.Queue(maxsize=size)
+        self.chunks = asyncio.Queue(maxsize=size)
+        self.embedded = asyncio.Queue(maxsize=max(1, config.INGEST_EMBED_WORKERS))
+        clean_workers = max(1, config.INGEST_CLEAN_WORKERS)
+        embed_workers = max(1, config.INGEST_EMBED_WORKERS)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=clean_workers) as cpu_pool, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=embed_workers) as io_pool:
+            self.cpu_pool = cpu_pool
+            self.io_pool = io_pool
+            tasks = [asyncio.ensure_future(stage) for stage in (
+                run_stage([produce(self.sink)], self.pages, clean_workers),
+                run_stage([self.clean_worker() for _ in range(clean_workers)], self.cleaned, 1),
+                run_stage([self.split_worker()], self.chunks, embed_workers),
+                run_stage([self.embed_worker() for _ in range(embed_workers)], self.embedded, 1),
+                run_stage([self.add_worker()], None, 0),
+            )]
+            try:
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                raise
+
+        changed, removed = results[0][0]
+        self.remove_files(removed)
+        if self.dirty and self.vector_store is not None:
+            await self.publish()
+        self.update_clean_manifest(removed)
+        self.report()
+        return changed, removed
+
+    def update_clean_manifest(self, removed):
+        """Records the page files in the wiki's clean manifest so walk_and_clean does not clean them again."""
+        prefix = shards.wiki_prefix(self.shard)
+        output_dir = os.path.join(config.DATA_DIR_CLEANED, prefix)
+        manifest = clean_data.load_clean_manifest(output_dir)
+        manifest.update(self.raw_files)
+        for rel_path in removed:
+            manifest.pop(os.path.relpath(rel_path, prefix or "."), None)
+        os.makedirs(output_dir, exist_ok=True)
+        clean_data.save_clean_manifest(output_dir, manifest)
+
+    def report(self):
+        elapsed = time.monotonic() - self.started
+        first = f"{self.first_publish:.1f}s" if self.first_publish is not None else "n/a"
+        print(
+            f"✅ Streamed {self.pages_in} pages in {elapsed:.1f}s: {self.pages_indexed} indexed "
+            f"({self.chunks_indexed} chunks), {self.pages_unchanged} unchanged, "
+            f"{self.publishes} publishes, first searchable after {first}."
+        )
+
+
+def ingest_wiki(api_url, categories, recipe_categories=None, full=False, on_publish=None):
+    """
+    Syncs a wiki straight into its shard. Returns (changed, removed) page
+    paths, or None when the shard has no index that can be updated
+    incrementally, in which case the caller should fall back to the batch path.
+    """
+    state = wiki_sync.load_state(api_url)
+    pipeline = IngestPipeline(api_url, on_publish)
+    # A mod shard can start empty when every one of its pages is about to flow
+    # through. The default shard also holds pages no sync knows about.
+    allow_new = pipeline.shard != shards.DEFAULT_SHARD and (full or state is None)
+    if not pipeline.load(allow_new):
+        return None
+
+    synced = {}
+
+    async def produce(sink):
+        changed, removed, synced["state"] = await wiki_sync.sync_changes_async(
+            api_url, categories, recipe_categories, full, sink
+        )
+        return changed, removed
+
+    result = asyncio.run(pipeline.run(produce))
+    # Saved only after the final publish: if a later stage failed, the next
+    # sync still sees these pages as changed and streams them again.
+    wiki_sync.save_state(synced["state"])
+    return result
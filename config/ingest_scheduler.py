@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import uuid
+import threading
+import traceback
+
+from config import config
+from config import metrics
+from config import shards
+
+# ===========================
+# Ingestion scheduler
+# ===========================
+#
+# Every wiki sync (/admin/add-wiki, /admin/detect-mods) is a job in one queue:
+#   - at most one queued job per wiki; asking again merges into it (categories
+#     and mods are added, `force` / `full` are kept if either asked for them)
+#   - INGEST_WORKERS threads download wikis, never the same wiki twice at once
+#   - downloads that finish within INGEST_COALESCE_SECONDS of each other, or
+#     while other downloads are still running, are cleaned and indexed in one
+#     pass, followed by one QA chain reload, instead of one rebuild per wiki
+# In INGEST_MODE=pipeline a wiki streams straight into its shard while it
+# downloads; those streams take the indexing lock one at a time, as before,
+# and only their reloads are coalesced.
+# Jobs are saved to INGEST_JOBS_FILE on every change. After a restart,
+# unfinished downloads are queued again (wiki syncs are incremental, so
+# little is fetched twice) and finished downloads still waiting for the
+# index keep their page list and are indexed in the next pass.
+# A failed index pass puts its jobs back to wait, with their page lists, and
+# retries them after INGEST_RETRY_BACKOFF seconds, doubling the wait each
+# time. After INGEST_INDEX_RETRIES retries the jobs fail and their pages are
+# left for the wiki's next sync.
+
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+STREAMING = "streaming"
+WAITING_INDEX = "waiting_index"
+INDEXING = "indexing"
+DONE = "done"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+RUNNING = (DOWNLOADING, STREAMING)
+ACTIVE = (QUEUED, DOWNLOADING, STREAMING, WAITING_INDEX, INDEXING)
+FINISHED = (DONE, SKIPPED, FAILED)
+
+DEFAULT_CATEGORIES = ["Crafting", "Items", "Blocks", "Mobs"]
+PROCESSED_WIKIS_FILE = os.path.join(config.DATA_DIR_CLEANED, "processed_wikis.json")
+
+# Held by anything that writes cleaned pages or index shards.
+indexing_lock = threading.Lock()
+
+
+def load_processed_wikis():
+    """{api_url: time of the last successful sync}."""
+    if os.path.exists(PROCESSED_WIKIS_FILE):
+        try:
+            with open(PROCESSED_WIKIS_FILE, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    return {}
+
+
+def save_processed_wiki(wiki_url):
+    data = load_processed_wikis()
+    data[wiki_url] = time.time()
+    os.makedirs(os.path.dirname(PROCESSED_WIKIS_FILE), exist_ok=True)
+    with open(PROCESSED_WIKIS_FILE, "w") as f:
+        json.dump(data, f)
+
+
+def recently_synced(api_url):
+    return time.time() - load_processed_wikis().get(api_url, 0) < config.WIKI_SYNC_INTERVAL
+
+
+class IngestScheduler:
+    def __init__(self, path, workers, window, history):
+        self.path = path
+        self.workers = max(1, workers)
+        self.window = window
+        self.history = history
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._jobs = {}  # id -> job dict, in submission order
+        self._reload_requested = None  # monotonic time of the first reload request not yet served
+        self._started = False
+        self.index_passes = 0
+        self._load()
+
+    # ---- persistence ----
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                jobs = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read ingestion jobs from {self.path} ({e}). Starting with an empty queue.")
+            return
+        resumed = 0
+        for job in jobs:
+            if job["state"] in RUNNING:
+                job["state"] = QUEUED
+                job["restarts"] = job.get("restarts", 0) + 1
+            elif job["state"] == INDEXING:
+                job["state"] = WAITING_INDEX
+                job["restarts"] = job.get("restarts", 0) + 1
+            if job["state"] in ACTIVE:
+                job["waiting_since"] = None if job["state"] == QUEUED else time.monotonic()
+                resumed += 1
+            self._jobs[job["id"]] = job
+            self.index_passes = max(self.index_passes, job.get("index_pass") or 0)
+        if resumed:
+            print(f"🔁 Resuming {resumed} ingestion jobs from {self.path}.")
+
+    def _save(self):
+        """Writes every job to disk. Called under the lock."""
+        finished = [job_id for job_id, job in self._jobs.items() if job["state"] in FINISHED]
+        for job_id in finished[: max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump([{k: v for k, v in job.items() if k != "waiting_since"} for job in self._jobs.values()], f)
+        os.replace(tmp_path, self.path)
+
+    def _update(self, job, **fields):
+        with self._changed:
+            job.update(fields)
+            self._save()
+            self._changed.notify_all()
+
+    # ---- submitting ----
+
+    def submit(self, api_url, categories=None, mods=(), force=False, full=False):
+        """
+        Queues a sync of `api_url`, or merges the request into the wiki's queued
+        job. A request that adds nothing to a download already running is
+        answered with that job. Returns (job, created).
+        """
+        categories = sorted(set(categories or DEFAULT_CATEGORIES))
+        mods = sorted({m for m in mods if m})
+        with self._changed:
+            for job in self._jobs.values():
+                if job["api_url"] != api_url:
+                    continue
+                if job["state"] == QUEUED:
+                    job["categories"] = sorted(set(job["categories"]) | set(categories))
+                    job["mods"] = sorted(set(job["mods"]) | set(mods))
+                    job["force"] = job["force"] or force
+                    job["full"] = job["full"] or full
+                    job["requests"] += 1
+                    self._save()
+                    return self._status(job), False
+                if job["state"] in RUNNING and not full and set(categories) <= set(job["categories"]) and set(mods) <= set(job["mods"]):
+                    job["requests"] += 1
+                    self._save()
+                    return self._status(job), False
+            job = {
+                "id": uuid.uuid4().hex[:12],
+                "api_url": api_url,
+                "shard": shards.shard_name(api_url),
+                "categories": categories,
+                "mods": mods,
+                "force": force,
+                "full": full,
+                "state": QUEUED,
+                "stage": "waiting for a download slot",
+                "requests": 1,
+                "restarts": 0,
+                "submitted_at": time.time(),
+                "started_at": None,
+                "downloaded_at": None,
+                "finished_at": None,
+                "changed_pages": None,
+                "removed_pages": None,
+                "paths": [],
+                "index_pass": None,
+                "index_attempts": 0,
+                "error": None,
+                "waiting_since": None,
+            }
+            self._jobs[job["id"]] = job
+            self._save()
+            self._changed.notify_all()
+            status = self._status(job)
+        print(f"📥 Queued ingestion job {job['id']} for {api_url}.")
+        return status, True
+
+    # ---- status ----
+
+    def jobs(self, state=None):
+        """Every job, newest first, optionally only those in `state`."""
+        with self._lock:
+            jobs = [self._status(job) for job in self._jobs.values() if state is None or job["state"] == state]
+        return jobs[::-1]
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._status(job) if job is not None else None
+
+    @staticmethod
+    def _status(job):
+        status = {k: v for k, v in job.items() if k not in ("paths", "waiting_since")}
+        end = job["finished_at"] or time.time()
+        status["elapsed_s"] = round(end - (job["started_at"] or job["submitted_at"]), 1)
+        return status
+
+    def is_active(self, api_url):
+        with self._lock:
+            return any(j["api_url"] == api_url and j["state"] in ACTIVE for j in self._jobs.values())
+
+    def counts(self):
+        counts = dict.fromkeys(ACTIVE + FINISHED, 0)
+        with self._lock:
+            for job in self._jobs.values():
+                counts[job["state"]] += 1
+        return counts
+
+    # ---- workers ----
+
+    def start(self):
+        """Starts the download workers and the indexer. Jobs submitted earlier wait until then."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._download_loop, name=f"ingest-download-{i}", daemon=True).start()
+        threading.Thread(target=self._index_loop, name="ingest-index", daemon=True).start()
+        print(f"🗂️ Ingestion scheduler started ({self.workers} download workers, {self.window:g}s coalescing window).")
+
+    def _next_job(self):
+        """The oldest queued job whose wiki is not downloading already. Called under the lock."""
+        busy = {j["api_url"] for j in self._jobs.values() if j["state"] in RUNNING}
+        for job in self._jobs.values():
+            if job["state"] == QUEUED and job["api_url"] not in busy:
+                return job
+        return None
+
+    def _download_loop(self):
+        while True:
+            with self._changed:
+                job = self._next_job()
+                while job is None:
+                    self._changed.wait()
+                    job = self._next_job()
+                job.update(state=DOWNLOADING, stage="starting", started_at=time.time())
+                self._save()
+            try:
+                self._download(job)
+            except Exception as e:
+                metrics.INGESTION_ERRORS.inc()
+                print(f"❌ Ingestion job {job['id']} for {job['api_url']} failed: {e}")
+                traceback.print_exc()
+                self._update(job, state=FAILED, stage="download failed", error=str(e), finished_at=time.time())
+
+    def _download(self, job):
+        from wiki import wiki_sync
+
+        api_url = job["api_url"]
+        if not job["force"] and recently_synced(api_url):
+            print(f"✅ Wiki {api_url} was processed recently. Skipping download.")
+            self._update(job, state=SKIPPED, stage="synced recently", finished_at=time.time())
+            return
+
+        with self._lock:
+            shards.register_shard(api_url, job["mods"])
+        print(f"🚀 Starting ingestion job {job['id']} for {api_url}...")
+
+        if config.INGEST_MODE == "pipeline" and self._stream(job):
+            return
+
+        self._update(job, stage="downloading changed pages")
+        changed, removed = wiki_sync.sync_wiki(api_url, set(job["categories"]), full=job["full"])
+        if not changed and not removed:
+            print(f"✨ Wiki {api_url} is already up to date.")
+            save_processed_wiki(api_url)
+            self._update(job, state=DONE, stage="up to date", changed_pages=0, removed_pages=0, finished_at=time.time())
+            return
+        self._update(
+            job,
+            state=WAITING_INDEX,
+            stage="waiting for the next index pass",
+            changed_pages=len(changed),
+            removed_pages=len(removed),
+            paths=changed + removed,
+            downloaded_at=time.time(),
+            waiting_since=time.monotonic(),
+        )
+
+    def _stream(self, job):
+        """Streams the wiki into its shard. Returns False when it has to go through the batch path instead."""
+        from config import ingest_pipeline
+
+        self._update(job, state=STREAMING, stage="waiting for the indexing lock")
+        with indexing_lock:
+            self._update(job, stage="streaming pages into the index")
+            streamed = ingest_pipeline.ingest_wiki(
+                job["api_url"], set(job["categories"]), full=job["full"], on_publish=self.request_reload
+            )
+        if streamed is None:
+            print("⚠️ No index to stream into yet. Falling back to batch ingestion.")
+            self._update(job, state=DOWNLOADING)
+            return False
+        changed, removed = streamed
+        save_processed_wiki(job["api_url"])
+        self._update(
+            job, state=DONE, stage="streamed", changed_pages=len(changed), removed_pages=len(removed),
+            downloaded_at=time.time(), finished_at=time.time(),
+        )
+        print(f"✅ Ingestion job {job['id']} for {job['api_url']} complete.")
+        return True
+
+    def request_reload(self):
+        """Asks for a QA chain reload in the next index pass (streamed shards publish many versions)."""
+        with self._changed:
+            if self._reload_requested is None:
+                self._reload_requested = time.monotonic()
+            self._changed.notify_all()
+
+    # ---- indexer ----
+
+    def _waiting(self, now):
+        """Jobs waiting for the index whose retry delay, if any, is over. Called under the lock."""
+        return [j for j in self._jobs.values() if j["state"] == WAITING_INDEX and j["waiting_since"] <= now]
+
+    def _ready_since(self, now):
+        """When the oldest unserved download or reload request arrived, or None. Called under the lock."""
+        times = [j["waiting_since"] for j in self._waiting(now)]
+        if self._reload_requested is not None:
+            times.append(self._reload_requested)
+        return min(times) if times else None
+
+    def _next_retry(self, now):
+        """Seconds until the next failed job may be retried, or None. Called under the lock."""
+        times = [j["waiting_since"] for j in self._jobs.values() if j["state"] == WAITING_INDEX and j["waiting_since"] > now]
+        return min(times) - now if times else None
+
+    def _downloads_pending(self):
+        return any(j["state"] in (QUEUED,) + RUNNING for j in self._jobs.values())
+
+    def _index_loop(self):
+        while True:
+            with self._changed:
+                # Wait for work, then give the downloads still running until the window closes to join in.
+                while True:
+                    now = time.monotonic()
+                    since = self._ready_since(now)
+                    if since is not None:
+                        left = since + self.window - now
+                        if left <= 0 or not self._downloads_pending():
+                            break
+                    else:
+                        left = self._next_retry(now)
+                    self._changed.wait(left)
+                batch = self._waiting(time.monotonic())
+                reload = self._reload_requested is not None
+                self._reload_requested = None
+                self.index_passes += 1
+                index_pass = self.index_passes
+                for job in batch:
+                    job.update(state=INDEXING, stage="cleaning and indexing", index_pass=index_pass)
+                self._save()
+            try:
+                self._index(batch, index_pass, reload)
+            except Exception as e:
+                metrics.INGESTION_ERRORS.inc()
+                print(f"❌ Index pass {index_pass} failed: {e}")
+                traceback.print_exc()
+                for job in batch:
+                    self._retry(job, str(e))
+
+    def _retry(self, job, error):
+        """Puts a job back to wait for a later index pass, or gives up on it after INGEST_INDEX_RETRIES retries."""
+        attempts = job.get("index_attempts", 0) + 1
+        if attempts > config.INGEST_INDEX_RETRIES:
+            self._update(job, index_attempts=attempts)
+            self._give_up(job, error)
+            return
+        delay = config.INGEST_RETRY_BACKOFF * 2 ** (attempts - 1)
+        print(f"🔁 Retrying ingestion job {job['id']} for {job['api_url']} in {delay:g}s (retry {attempts}/{config.INGEST_INDEX_RETRIES}).")
+        self._update(
+            job,
+            state=WAITING_INDEX,
+            stage=f"index pass failed, retrying in {delay:g}s",
+            error=error,
+            index_attempts=attempts,
+            waiting_since=time.monotonic() + delay,
+        )
+
+    def _give_up(self, job, error):
+        """Fails a job whose pages were downloaded but not indexed; the wiki's next sync downloads them again."""
+        from wiki import wiki_sync
+
+        try:
+            marked = wiki_sync.mark_pending(job["api_url"], job["paths"])
+            print(f"↩️ {marked} pages of {job['api_url']} will be downloaded again by its next sync.")
+        except Exception as e:
+            print(f"⚠️ Could not mark the pages of {job['api_url']} for the next sync: {e}")
+        self._update(job, state=FAILED, stage="indexing failed", error=error, finished_at=time.time())
+
+    def _index(self, batch, index_pass, reload):
+        """Cleans every page the batch downloaded, updates each shard it touched once, then reloads once."""
+        from config import build_index
+        from config.rag_pipeline import reload_qa_chain
+        from wiki import clean_data
+
+        by_shard = {}
+        for job in batch:
+            by_shard.setdefault(job["shard"], set()).update(job["paths"])
+        published = reload
+        if batch:
+            paths = sorted(set().union(*by_shard.values()))
+            print(
+                f"🧩 Index pass {index_pass}: {len(batch)} wikis, {len(paths)} pages, "
+                f"{len(by_shard)} shards."
+            )
+            started = time.monotonic()
+            with indexing_lock:
+                clean_data.walk_and_clean(paths=paths)
+                for shard, shard_paths in sorted(by_shard.items()):
+                    if build_index.build_index(paths=sorted(shard_paths), shard=shard):
+                        published = True
+            metrics.INGESTION_INDEX_PASSES.inc()
+            print(f"🧩 Index pass {index_pass} finished in {time.monotonic() - started:.1f}s.")
+        if published:
+            reload_qa_chain()
+
+        for job in batch:
+            save_processed_wiki(job["api_url"])
+            self._update(job, state=DONE, stage="indexed", paths=[], finished_at=time.time())
+            print(f"✅ Ingestion job {job['id']} for {job['api_url']} complete.")
+
+
+ingest_scheduler = IngestScheduler(
+    config.INGEST_JOBS_FILE, config.INGEST_WORKERS, config.INGEST_COALESCE_SECONDS, config.INGEST_JOB_HISTORY
+)
+metrics.INGESTION_JOBS.set_function(lambda: sum(v for k, v in ingest_scheduler.counts().items() if k in ACTIVE))
+metrics.INGESTION_QUEUE.set_function(lambda: ingest_scheduler.counts()[QUEUED])
@@ -0,0 +1,154 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+import numpy as np
+
+# ===========================
+# Lexical (BM25) index
+# ===========================
+#
+# Built next to every index version from the chunks in its chunk store:
+#   lexical.json  vocabulary, chunk IDs, page titles -> chunk numbers
+#   lexical.npz   CSR postings (offsets, chunk numbers, term frequencies)
+#                 and chunk lengths
+#
+# Page titles come from the cleaned file names ("Netherite Upgrade.txt"), so a
+# question naming an item can be matched to its page without any embedding.
+
+LEXICAL_JSON = "lexical.json"
+LEXICAL_NPZ = "lexical.npz"
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TITLE_TOKENS = 6
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or the to what when where "
+    "which who why with you your my me get make use".split()
+)
+
+
+def stem(token):
+    """Very light plural folding, so "shields" matches "shield"."""
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [stem(t) for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def title_of(source):
+    return os.path.splitext(os.path.basename(source))[0]
+
+
+class LexicalIndex:
+    def __init__(self, vocab, chunk_ids, titles, offsets, docs, tfs, lengths):
+        self.vocab = {term: i for i, term in enumerate(vocab)}
+        self.chunk_ids = chunk_ids
+        self.titles = titles  # normalized title -> chunk numbers of that page
+        self.offsets = offsets
+        self.docs = docs
+        self.tfs = tfs
+        self.lengths = lengths
+        self.avg_length = float(lengths.mean()) if len(lengths) else 0.0
+
+    def __len__(self):
+        return len(self.chunk_ids)
+
+    def search(self, tokens, n):
+        """Returns up to n (chunk_id, BM25 score) pairs, best first."""
+        if not len(self) or not tokens:
+            return []
+        scores = np.zeros(len(self), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / max(self.avg_length, 1e-9))
+        for term in set(tokens):
+            i = self.vocab.get(term)
+            if i is None:
+                continue
+            start, end = self.offsets[i], self.offsets[i + 1]
+            docs = self.docs[start:end]
+            tfs = self.tfs[start:end].astype(np.float32)
+            df = end - start
+            idf = math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[docs])
+        n = min(n, int(np.count_nonzero(scores)))
+        if n == 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return [(self.chunk_ids[i], float(scores[i])) for i in top]
+
+    def match_titles(self, tokens):
+        """
+        Finds page titles spelled out in the question. Returns (chunk_id,
+        matched title length) pairs, longest titles first.
+        """
+        matches = {}
+        for size in range(min(MAX_TITLE_TOKENS, len(tokens)), 0, -1):
+            for start in range(len(tokens) - size + 1):
+                key = " ".join(tokens[start : start + size])
+                if key in self.titles and key not in matches:
+                    matches[key] = size
+        hits = []
+        for key, size in sorted(matches.items(), key=lambda m: -m[1]):
+            hits.extend((self.chunk_ids[i], size) for i in self.titles[key])
+        return hits
+
+    def save(self, index_dir):
+        vocab = [None] * len(self.vocab)
+        for term, i in self.vocab.items():
+            vocab[i] = term
+        with open(os.path.join(index_dir, LEXICAL_JSON), "w", encoding="utf-8") as f:
+            json.dump({"vocab": vocab, "chunk_ids": self.chunk_ids, "titles": self.titles}, f)
+        np.savez(
+            os.path.join(index_dir, LEXICAL_NPZ),
+            offsets=self.offsets, docs=self.docs, tfs=self.tfs, lengths=self.lengths,
+        )
+
+
+def build(chunks):
+    """Builds a LexicalIndex from (chunk_id, text, source) tuples."""
+    chunk_ids = []
+    lengths = []
+    postings = {}
+    titles = {}
+    for n, (chunk_id, text, source) in enumerate(chunks):
+        tokens = tokenize(text)
+        chunk_ids.append(chunk_id)
+        lengths.append(len(tokens))
+        for term, tf in Counter(tokens).items():
+            postings.setdefault(term, []).append((n, tf))
+        title = " ".join(tokenize(title_of(source)))
+        if title:
+            titles.setdefault(title, []).append(n)
+
+    vocab = sorted(postings)
+    offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+    for i, term in enumerate(vocab):
+        offsets[i + 1] = offsets[i] + len(postings[term])
+    docs = np.empty(offsets[-1], dtype=np.int32)
+    tfs = np.empty(offsets[-1], dtype=np.uint16)
+    for i, term in enumerate(vocab):
+        entries = postings[term]
+        docs[offsets[i] : offsets[i + 1]] = [d for d, _ in entries]
+        tfs[offsets[i] : offsets[i + 1]] = [min(tf, 65535) for _, tf in entries]
+    return LexicalIndex(vocab, chunk_ids, titles, offsets, docs, tfs, np.asarray(lengths, dtype=np.float32))
+
+
+def load(index_dir):
+    """Loads the lexical index of an index version, or returns None if it has none."""
+    json_path = os.path.join(index_dir, LEXICAL_JSON)
+    npz_path = os.path.join(index_dir, LEXICAL_NPZ)
+    if not (os.path.exists(json_path) and os.path.exists(npz_path)):
+        return None
+    with open(json_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with np.load(npz_path, allow_pickle=False) as arrays:
+        return LexicalIndex(
+            meta["vocab"], meta["chunk_ids"], meta["titles"],
+            arrays["offsets"], arrays["docs"], arrays["tfs"], arrays["lengths"],
+        )
@@ -0,0 +1,189 @@
+import re
+import time
+import threading
+from typing import Any
+
+import ollama  # type: ignore
+from pydantic import PrivateAttr  # type: ignore
+from langchain_core.language_models.chat_models import BaseChatModel  # type: ignore
+from langchain_core.messages import AIMessage, AIMessageChunk  # type: ignore
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult  # type: ignore
+
+from config import config
+from config import metrics
+
+# ===========================
+# Shared Ollama LLM client
+# ===========================
+#
+# One chat model for the whole process, used by the QA chain and the streaming
+# path alike. It talks to Ollama through the ollama client, whose HTTP
+# connection pool is reused across requests, and asks Ollama to keep the model
+# loaded for OLLAMA_KEEP_ALIVE. At startup both the LLM and the embedding
+# model are loaded, and a background thread can ping them every
+# LLM_KEEP_WARM_INTERVAL seconds so Ollama never unloads them between players.
+
+DURATION = re.compile(r"-?(\d+(\.\d*)?(ns|us|µs|ms|s|m|h))+")  # Go duration, as Ollama parses keep_alive
+
+
+def parse_keep_alive(value):
+    """
+    OLLAMA_KEEP_ALIVE as Ollama accepts it: seconds as a number ("-1" is
+    sent as -1, forever) or a duration string such as "30m" or "-1m".
+    """
+    value = value.strip()
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if DURATION.fullmatch(value):
+        return value
+    raise ValueError(f"OLLAMA_KEEP_ALIVE={value!r} is neither a number of seconds nor a duration like '30m' or '-1m'.")
+
+
+# Checked at import, so a bad value stops the server at startup instead of failing every request.
+KEEP_ALIVE = parse_keep_alive(config.OLLAMA_KEEP_ALIVE)
+
+ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+_llm = None
+_llm_lock = threading.Lock()
+_keep_warm_thread = None
+_prefill_rate = None  # Recent prompt tokens per second, smoothed
+PREFILL_SMOOTHING = 0.2
+
+
+class PooledChatOllama(BaseChatModel):
+    """Chat model over a persistent ollama.Client."""
+
+    model: str
+    base_url: str
+    keep_alive: Any = None
+    _client: Any = PrivateAttr(default=None)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client = ollama.Client(host=self.base_url)
+
+    @property
+    def _llm_type(self):
+        return "ollama-pooled"
+
+    def _request(self, messages, stop, stream):
+        return self._client.chat(
+            model=self.model,
+            messages=[{"role": ROLES.get(m.type, "user"), "content": m.content} for m in messages],
+            stream=stream,
+            keep_alive=self.keep_alive,
+            options={"stop": stop} if stop else None,
+        )
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Streamed underneath too, so time to first token is measured the same way.
+        content = []
+        metadata = {}
+        for chunk in self._stream(messages, stop):
+            content.append(chunk.message.content)
+            metadata.update(chunk.message.response_metadata)
+        message = AIMessage(content="".join(content), response_metadata=metadata)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        started = time.monotonic()
+        first_token = None
+        for part in self._request(messages, stop, stream=True):
+            if first_token is None and part["message"]["content"]:
+                first_token = time.monotonic()
+                metrics.STAGE_SECONDS.observe(first_token - started, stage="llm_ttft")
+            metadata = {}
+            if part.get("done"):
+                metadata = _metadata(part)
+                metrics.STAGE_SECONDS.observe(time.monotonic() - started, stage="generate")
+                _record_generation(metadata)
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=part["message"]["content"], response_metadata=metadata)
+            )
+            if run_manager is not None and chunk.text:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def _metadata(response):
+    """Ollama's timing and token counts from a final response."""
+    return {
+        key: response.get(key)
+        for key in ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+        if response.get(key) is not None
+    }
+
+
+def _record_generation(metadata):
+    """Logs the prompt size and prefill time Ollama reports for a generation, and exports its speed."""
+    global _prefill_rate
+    if metadata.get("eval_count") and metadata.get("eval_duration"):
+        metrics.LLM_TOKENS_PER_SECOND.observe(metadata["eval_count"] / (metadata["eval_duration"] / 1e9))
+    tokens = metadata.get("prompt_eval_count")
+    nanoseconds = metadata.get("prompt_eval_duration")
+    if not tokens or not nanoseconds:
+        return
+    metrics.LLM_PROMPT_TOKENS.observe(tokens)
+    rate = tokens / (nanoseconds / 1e9)
+    _prefill_rate = rate if _prefill_rate is None else _prefill_rate + PREFILL_SMOOTHING * (rate - _prefill_rate)
+    print(f"🧮 Prompt: {tokens} tokens, prefill {nanoseconds / 1e6:.0f}ms ({rate:.0f} tokens/s).")
+
+
+def prefill_rate():
+    """Recent prefill speed in prompt tokens per second, or None before the first generation."""
+    return _prefill_rate
+
+
+def get_llm():
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = PooledChatOllama(
+                model=config.LLM_MODEL, base_url=config.OLLAMA_HOST, keep_alive=KEEP_ALIVE
+            )
+        return _llm
+
+
+def warm_up():
+    """Loads the LLM and the embedding model into Ollama. Returns seconds taken per model."""
+    client = ollama.Client(host=config.OLLAMA_HOST)
+    timings = {}
+    started = time.monotonic()
+    # An empty prompt only loads the model.
+    client.generate(model=config.LLM_MODEL, prompt="", keep_alive=KEEP_ALIVE)
+    timings[config.LLM_MODEL] = time.monotonic() - started
+    started = time.monotonic()
+    client.embed(model=config.EMBEDDING_MODEL, input="warm up", keep_alive=KEEP_ALIVE)
+    timings[config.EMBEDDING_MODEL] = time.monotonic() - started
+    return timings
+
+
+def _keep_warm():
+    first = True
+    while True:
+        try:
+            timings = warm_up()
+            if first:
+                loaded = ", ".join(f"{model} in {seconds:.1f}s" for model, seconds in timings.items())
+                print(f"🔥 Models warmed up: {loaded} (keep_alive {KEEP_ALIVE}).")
+        except Exception as e:
+            print(f"⚠️ Could not warm up Ollama models: {e}")
+        first = False
+        if config.LLM_KEEP_WARM_INTERVAL <= 0:
+            return
+        time.sleep(config.LLM_KEEP_WARM_INTERVAL)
+
+
+def start_keep_warm():
+    """Warms both models in the background, then keeps pinging them if configured."""
+    global _keep_warm_thread
+    if _keep_warm_thread is None and config.LLM_WARMUP:
+        _keep_warm_thread = threading.Thread(target=_keep_warm, name="keep-warm", daemon=True)
+        _keep_warm_thread.start()
@@ -0,0 +1,195 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+# ===========================
+# Prometheus metrics
+# ===========================
+#
+# A small in-process registry rendered by GET /metrics in the Prometheus text
+# format. Counters, gauges and histograms are updated where the work happens;
+# values other modules already keep (cache hits, queue depth, index sizes)
+# are read through callbacks when /metrics is scraped, so nothing is counted
+# twice. Every metric is named notchnet_*.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 500)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _labels_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = "notchnet_" + name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+        self._callback = None
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def set_function(self, callback):
+        """
+        Reads the values at scrape time instead: `callback` returns a number,
+        or a dict of label value tuples to numbers for labelled metrics.
+        """
+        self._callback = callback
+
+    def _samples(self):
+        if self._callback is None:
+            with self._lock:
+                return list(self._values.items())
+        try:
+            values = self._callback()
+        except Exception:
+            return []  # The source is not loaded yet
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            return [((), values)]
+        return [(key if isinstance(key, tuple) else (key,), value) for key, value in values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._samples()):
+            lines.append(f"{self.name}{_labels_text(self.labels, key)} {_number(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._values.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                labels = _labels_text(self.labels + ("le",), key + (_number(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels_text(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_number(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# ---- RAG pipeline ----
+
+STAGE_SECONDS = Histogram(
+    "stage_seconds",
+    "Time spent in each answer stage (embed, vector_search, lexical_search, context, llm_ttft, generate).",
+    ["stage"],
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_tokens_per_second", "Answer tokens generated per second, as reported by Ollama.", buckets=RATE_BUCKETS
+)
+LLM_PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens", "Prompt tokens per generation.", buckets=(128, 256, 512, 1024, 2048, 4096, 8192)
+)
+REQUEST_SECONDS = Histogram("request_seconds", "Total time to answer a question.", ["kind"])
+REQUEST_ERRORS = Counter("request_errors_total", "Questions that failed with an error.", ["kind"])
+REQUESTS_IN_FLIGHT = Gauge("requests_in_flight", "Questions currently being answered.")
+INGESTION_ERRORS = Counter("ingestion_errors_total", "Wiki syncs that failed.")
+INGESTION_INDEX_PASSES = Counter("ingestion_index_passes_total", "Coalesced clean-and-index passes over finished downloads.")
+MOD_RESOLUTIONS = Counter("mod_resolutions_total", "Mods resolved to a wiki by source (cache, db, fuzzy, stored, network, none).", ["source"])
+
+# Read from their owners when scraped.
+ANSWER_CACHE = Counter("answer_cache_total", "Answer cache lookups by result (hit, miss, collapsed).", ["result"])
+EMBEDDING_CACHE = Counter("embedding_cache_total", "Embedding cache lookups by result (hit, miss).", ["result"])
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "Generations waiting for an LLM slot.")
+LLM_ACTIVE = Gauge("llm_active", "Generations holding an LLM slot.")
+LLM_REJECTED = Counter("llm_rejected_total", "Questions turned away by the LLM gate.", ["status"])
+INDEX_VERSION = Gauge("index_version", "Published version (creation time in ms) of each loaded shard.", ["shard"])
+INDEX_VECTORS = Gauge("index_vectors", "Vectors in each loaded shard.", ["shard"])
+INGESTION_JOBS = Gauge("ingestion_jobs_active", "Ingestion jobs queued, downloading or waiting for the index.")
+INGESTION_QUEUE = Gauge("ingestion_jobs_queued", "Ingestion jobs waiting for a download slot.")
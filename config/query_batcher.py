@@ -0,0 +1,118 @@
+import time
+import queue
+import threading
+import collections
+import concurrent.futures
+
+# ===========================
+# Query embedding micro-batcher
+# ===========================
+#
+# Concurrent requests each need their question embedded. Instead of one
+# Ollama call per question, the first question to arrive opens a short
+# window (EMBED_BATCH_WINDOW_MS); every question submitted before it closes,
+# up to EMBED_BATCH_MAX, is embedded in the same /api/embed call and each
+# caller gets its own vector back. An idle server pays at most one window of
+# extra latency; a busy one makes far fewer round trips.
+
+STATS_WINDOW = 1000  # Recent batches kept for the percentile metrics
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class QueryBatcher:
+    def __init__(self, embed_many, window_ms, max_batch):
+        self.embed_many = embed_many  # list of texts -> list of vectors
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.errors = 0
+        self._sizes = collections.deque(maxlen=STATS_WINDOW)
+        self._waits = collections.deque(maxlen=STATS_WINDOW)
+        self._calls = collections.deque(maxlen=STATS_WINDOW)
+
+    def embed(self, text):
+        """Embeds one query, sharing the Ollama call with queries submitted at the same time."""
+        self._ensure_started()
+        future = concurrent.futures.Future()
+        self._queue.put((text, future, time.monotonic()))
+        return future.result()
+
+    def _ensure_started(self):
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="query-batcher", daemon=True)
+                    self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Never exits: callers block on their futures, so a dead thread would hang them all.
+        while True:
+            batch = self._collect()
+            try:
+                self._embed_batch(batch)
+            except Exception as e:
+                with self._stats_lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _embed_batch(self, batch):
+        started = time.monotonic()
+        # Identical questions in one window are embedded once.
+        texts = list(dict.fromkeys(text for text, _, _ in batch))
+        vectors = self.embed_many(texts)
+        if len(vectors) != len(texts):
+            raise RuntimeError(f"Embedding returned {len(vectors)} vectors for {len(texts)} texts")
+        vectors = dict(zip(texts, vectors))
+        finished = time.monotonic()
+        with self._stats_lock:
+            self.batches += 1
+            self.queries += len(batch)
+            self._sizes.append(len(batch))
+            self._calls.append(finished - started)
+            self._waits.extend(started - submitted for _, _, submitted in batch)
+        for text, future, _ in batch:
+            future.set_result(vectors[text])
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = list(self._sizes)
+            waits = list(self._waits)
+            calls = list(self._calls)
+            return {
+                "window_ms": self.window * 1000,
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "queries": self.queries,
+                "errors": self.errors,
+                "queued": self._queue.qsize(),
+                "avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                "max_batch_size": max(sizes) if sizes else 0,
+                "queue_wait_ms_p50": round(_percentile(waits, 0.5) * 1000, 2),
+                "queue_wait_ms_p95": round(_percentile(waits, 0.95) * 1000, 2),
+                "embed_call_ms_p50": round(_percentile(calls, 0.5) * 1000, 2),
+                "embed_call_ms_p95": round(_percentile(calls, 0.95) * 1000, 2),
+            }
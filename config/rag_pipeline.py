@@ -1,23 +1,45 @@
 import os
+import time
+import asyncio
+import threading
+import concurrent.futures
+from contextlib import contextmanager
 import faiss  # type: ignore
+import numpy as np
 import requests  # type: ignore
 
-from langchain_community.vectorstores import FAISS  # type: ignore
 from langchain_classic.chains import create_retrieval_chain  # type: ignore
 from langchain_classic.chains.combine_documents import create_stuff_documents_chain  # type: ignore
 from langchain_core.prompts import PromptTemplate  # type: ignore
-from langchain_community.embeddings import OllamaEmbeddings  # type: ignore
-from langchain_community.chat_models import ChatOllama  # type: ignore
+from langchain_core.runnables import RunnableLambda  # type: ignore
 
 from config import config
+from config import embedding_cache
+from config import lexical_index
+from config import ann_index
+from config import chunk_store
+from config import shards
+from config import llm_client
+from config import context_packer
+from config import metrics
+from config.answer_cache import InFlight, answer_cache, make_key, split_tokens
+from config.admission import Overloaded, llm_gate
 
 # ===========================
 # Configuration
 # ===========================
 
 INDEX_PATH = config.INDEX_PATH
-qa_chain = None
-_retriever = None  # Cached retriever for streaming
+_active = None  # ActiveIndex currently serving requests
+_active_lock = threading.Lock()
+_load_lock = threading.Lock()  # Serializes index loads and swaps
+_llm = None
+_search_pool = concurrent.futures.ThreadPoolExecutor(max_workers=config.SHARD_SEARCH_WORKERS)
+_llm_pool = concurrent.futures.ThreadPoolExecutor(max_workers=config.LLM_MAX_CONCURRENCY)  # Async-mode generations
+
+NO_DOCUMENTS = "No relevant documents found."
+NO_ANSWER = "No answer generated."
+SORRY = "❌ Sorry, I couldn't find a good answer to your question."
 
 NUM_CORES = os.cpu_count()
 os.environ["OLLAMA_NUM_THREADS"] = str(NUM_CORES)
@@ -73,87 +95,384 @@ def check_ollama():
         ) from e
 
 
-def build_retriever():
-    """
-    Builds a retriever by loading the pre-built FAISS index from disk.
-    """
-    check_ollama()
+class ActiveIndex:
+    """One loaded set of shard versions. Requests hold on to it until they finish."""
 
-    embedding_model = OllamaEmbeddings(model="nomic-embed-text", base_url=config.OLLAMA_HOST)
+    def __init__(self, version, retriever, qa_chain, registry):
+        self.version = version
+        self.retriever = retriever
+        self.qa_chain = qa_chain
+        self.registry = registry
+        self.in_flight = 0
+        self.retired = False
+
+    def select_shards(self, mods):
+        return shards.select_shards(mods, self.retriever.stores, self.registry)
+
+
+class ShardIndex:
+    """A shard's memory-mapped vectors and chunk store. Chunk texts are only read for hits."""
+
+    def __init__(self, index, chunks):
+        self.index = index
+        self.chunks = chunks
+
+    def search_by_vector(self, vector, k):
+        distances, rows = self.index.search(np.asarray([vector], dtype=np.float32), k)
+        return [(self.chunks.document(int(row)), float(d)) for d, row in zip(distances[0], rows[0]) if row >= 0]
 
-    if not os.path.exists(INDEX_PATH):
-        print(f"❌ FATAL: FAISS index not found at {INDEX_PATH}")
-        print("Please run the `build_index.py` script first to create the index.")
-        raise FileNotFoundError(f"FAISS index not found. Run `build_index.py` first.")
 
+class ShardedRetriever:
+    """
+    Searches several shard indexes in parallel and merges their hits. The
+    question is embedded once and reused for every shard. With hybrid search,
+    BM25 and page-title hits from each shard's lexical index are fused with
+    the vector hits by reciprocal rank, and the embedding is skipped entirely
+    when the question names a page that BM25 also ranks first.
+    """
+
+    def __init__(self, stores, versions, k, lexical=None, embeddings=None):
+        self.stores = stores  # {shard: ShardIndex}
+        self.versions = versions  # {shard: version}
+        self.lexical = lexical or {}  # {shard: LexicalIndex or None}
+        self.k = k
+        self.embeddings = embeddings  # Query embeddings; the shared cached client if None
+
+    @property
+    def version(self):
+        return ",".join(f"{shard}@{version}" for shard, version in sorted(self.versions.items()))
+
+    def _search_shard(self, shard, vector):
+        return self.stores[shard].search_by_vector(vector, self.k)
+
+    def _vector_hits(self, question, names):
+        with metrics.STAGE_SECONDS.time(stage="embed"):
+            vector = (self.embeddings or embedding_cache.get_embeddings()).embed_query(question)
+        with metrics.STAGE_SECONDS.time(stage="vector_search"):
+            if len(names) == 1:
+                hits = [(names[0], doc, score) for doc, score in self._search_shard(names[0], vector)]
+            else:
+                results = _search_pool.map(lambda n: self._search_shard(n, vector), names)
+                hits = [(name, doc, score) for name, result in zip(names, results) for doc, score in result]
+        hits.sort(key=lambda hit: hit[2])  # L2 distance, lower is closer
+        return hits[: self.k]
+
+    def _lexical_hits(self, tokens, names):
+        """Returns (title hits, BM25 hits) as (shard, chunk_id, score) lists, best first."""
+        titles = []
+        bm25 = []
+        for name in names:
+            index = self.lexical.get(name)
+            if index is None:
+                continue
+            titles.extend((name, chunk_id, size) for chunk_id, size in index.match_titles(tokens))
+            bm25.extend((name, chunk_id, score) for chunk_id, score in index.search(tokens, config.LEXICAL_CANDIDATES))
+        titles.sort(key=lambda hit: -hit[2])
+        bm25.sort(key=lambda hit: -hit[2])
+        return titles, bm25
+
+    @staticmethod
+    def _confident(titles, bm25):
+        """A named page that BM25 also ranks first is answer enough without the embedding."""
+        if not titles or not bm25:
+            return False
+        best = titles[0][2]
+        pages = {(shard, chunk_id.rsplit("::", 1)[0]) for shard, chunk_id, size in titles if size == best}
+        shard, chunk_id, _ = bm25[0]
+        return (shard, chunk_id.rsplit("::", 1)[0]) in pages
+
+    def _document(self, shard, chunk_id):
+        return self.stores[shard].chunks.search(chunk_id)
+
+    def search(self, question, shard_names=None):
+        names = [n for n in (self.stores if shard_names is None else shard_names) if n in self.stores]
+        if not names:
+            return []
+        if not config.HYBRID_SEARCH or not any(self.lexical.get(n) is not None for n in names):
+            return [doc for _, doc, _ in self._vector_hits(question, names)]
+
+        with metrics.STAGE_SECONDS.time(stage="lexical_search"):
+            titles, bm25 = self._lexical_hits(lexical_index.tokenize(question), names)
+        rankings = [[(s, c) for s, c, _ in titles], [(s, c) for s, c, _ in bm25]]
+        docs = {}
+        if not (config.LEXICAL_SKIP_EMBEDDING and self._confident(titles, bm25)):
+            ranking = []
+            for shard, doc, _ in self._vector_hits(question, names):
+                key = (shard, doc.id or id(doc))
+                docs[key] = doc
+                ranking.append(key)
+            rankings.append(ranking)
+
+        # Reciprocal rank fusion: every list votes 1 / (RRF_K + rank) for its hits.
+        scores = {}
+        for ranking in rankings:
+            for rank, key in enumerate(ranking):
+                scores[key] = scores.get(key, 0.0) + 1.0 / (config.RRF_K + rank + 1)
+        results = []
+        for key in sorted(scores, key=scores.get, reverse=True):
+            doc = docs.get(key) or self._document(*key)
+            if doc is not None:
+                results.append(doc)
+                if len(results) == self.k:
+                    break
+        return results
+
+    def invoke(self, question):
+        return self.search(question)
+
+
+def _load_shard(index_dir):
     try:
-        db = FAISS.load_local(
-            INDEX_PATH, embedding_model, allow_dangerous_deserialization=True
+        if not chunk_store.exists(index_dir):
+            raise FileNotFoundError(f"'{index_dir}' has no chunk store (built by an older version)")
+        # Memory-map the vectors instead of reading them into RAM.
+        index = faiss.read_index(
+            os.path.join(index_dir, "index.faiss"), faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
         )
-        print(f"🔁 Loaded cached FAISS index from {INDEX_PATH}.")
-        return db.as_retriever()
+        return ShardIndex(ann_index.configure(index), chunk_store.ChunkStore(index_dir))
     except Exception as e:
         print(f"❌ Error loading FAISS index: {e}")
         print(
-            "The index might be corrupted. Try deleting the 'faiss_index' directory and re-running `build_index.py`."
+            "The index might be corrupted or outdated. Re-run `build_index.py`, or delete the 'faiss_index' directory and re-run it."
         )
         raise e
 
 
-def build_qa_chain():
-    global qa_chain, _retriever
-    if qa_chain is not None:
-        return qa_chain
+def build_retriever(previous=None):
+    """
+    Builds a retriever over every shard's pre-built FAISS index. Shards whose
+    version did not change since `previous` (a ShardedRetriever) are reused
+    instead of being loaded again, so publishing one wiki's shard only loads
+    that shard.
+    """
+    live = shards.live_shards()
+    if not live:
+        print(f"❌ FATAL: FAISS index not found at {INDEX_PATH}")
+        print("Please run the `build_index.py` script first to create the index.")
+        raise FileNotFoundError("FAISS index not found. Run `build_index.py` first.")
+
+    stores = {}
+    versions = {}
+    lexical = {}
+    for shard, (version, index_dir) in live.items():
+        if previous is not None and previous.versions.get(shard) == version:
+            stores[shard] = previous.stores[shard]
+            lexical[shard] = previous.lexical.get(shard)
+        else:
+            started = time.monotonic()
+            stores[shard] = _load_shard(index_dir)
+            lexical[shard] = lexical_index.load(index_dir)
+            print(f"🔁 Loaded shard '{shard}' version {version} from {index_dir} in {time.monotonic() - started:.2f}s.")
+        versions[shard] = version
+    return ShardedRetriever(stores, versions, config.RETRIEVER_K, lexical)
 
-    _retriever = build_retriever()
 
-    print(f"🔧 Loading local LLM ({config.LLM_MODEL})...")
-    llm_model = ChatOllama(model=config.LLM_MODEL, base_url=config.OLLAMA_HOST)
-    print("✅ LLM loaded.")
+def _get_llm():
+    global _llm
+    if _llm is None:
+        check_ollama()
+        print(f"🔧 Loading local LLM ({config.LLM_MODEL})...")
+        _llm = llm_client.get_llm()
+        print("✅ LLM loaded.")
+    return _llm
+
+
+def _load_active_index():
+    """Loads the current on-disk shard versions completely, without publishing them."""
+    retriever = build_retriever(_active.retriever if _active is not None else None)
 
     print("🔧 Building new LCEL retrieval chain...")
-    document_chain = create_stuff_documents_chain(llm_model, QA_PROMPT)
-    qa_chain = create_retrieval_chain(_retriever, document_chain)
+    document_chain = create_stuff_documents_chain(_get_llm(), QA_PROMPT)
+    # The chain input carries the shards selected for the request next to the question.
+    retrieve = RunnableLambda(lambda inputs: _retrieve(retriever, inputs["input"], inputs.get("shards")))
+    chain = create_retrieval_chain(retrieve, document_chain)
+    print(f"✅ QA chain built successfully (shards {retriever.version}).")
+    return ActiveIndex(retriever.version, retriever, chain, shards.load_registry())
+
+
+def _retrieve(retriever, question, shard_names=None):
+    """Retrieved chunks, packed into the context token budget."""
+    docs = retriever.search(question, shard_names)
+    if not config.CONTEXT_PACKING:
+        return docs
+    with metrics.STAGE_SECONDS.time(stage="context"):
+        return context_packer.pack(docs)
+
+
+def _swap_active_index(new_active):
+    global _active
+    with _active_lock:
+        old_active = _active
+        _active = new_active
+        if old_active is not None:
+            old_active.retired = True
+            drained = old_active.in_flight == 0
+    # Answers from the previous index are keyed by the old version and can no
+    # longer be hit, so drop them right away.
+    answer_cache.clear()
+    if old_active is not None and drained:
+        print(f"♻️ Index version {old_active.version} released.")
 
-    print("✅ QA chain built successfully.")
-    return qa_chain
+
+def build_qa_chain():
+    if _active is not None:
+        return _active.qa_chain
+    with _load_lock:
+        # Another request may have finished loading while we waited.
+        if _active is None:
+            _swap_active_index(_load_active_index())
+    return _active.qa_chain
 
 
 def reload_qa_chain():
-    """Forces a reload of the QA chain, useful after index updates."""
-    global qa_chain, _retriever
+    """
+    Loads the current index version in the caller's thread, then swaps it in.
+    Requests already running keep using the version they started with.
+    """
     print("🔄 Reloading QA chain...")
-    qa_chain = None
-    _retriever = None
-    build_qa_chain()
+    with _load_lock:
+        _swap_active_index(_load_active_index())
     print("✅ QA chain reloaded.")
 
 
-def generate_answer(question: str) -> str:
-    global qa_chain
-    if qa_chain is None:
+def _index_versions():
+    active = _active
+    if active is None:
+        return None
+    return {shard: int(version) for shard, version in active.retriever.versions.items() if str(version).isdigit()}
+
+
+def _index_vectors():
+    active = _active
+    if active is None:
+        return None
+    return {shard: store.index.ntotal for shard, store in active.retriever.stores.items()}
+
+
+metrics.INDEX_VERSION.set_function(_index_versions)
+metrics.INDEX_VECTORS.set_function(_index_vectors)
+
+
+@contextmanager
+def _track(kind):
+    """Counts a question as in flight and records how long it took and whether it failed."""
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    started = time.monotonic()
+    rejected = False
+    try:
+        yield
+    except Overloaded:
+        rejected = True  # Counted by the LLM gate
+        raise
+    except Exception:
+        metrics.REQUEST_ERRORS.inc(kind=kind)
+        raise
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        if not rejected:
+            metrics.REQUEST_SECONDS.observe(time.monotonic() - started, kind=kind)
+
+
+def _count_failure(kind, event_type, content):
+    """Streams report failures as events; finding no documents is not one."""
+    if event_type == "error" and content not in (NO_DOCUMENTS, NO_ANSWER):
+        metrics.REQUEST_ERRORS.inc(kind=kind)
+
+
+@contextmanager
+def _use_active_index():
+    if _active is None:
         print("🔧 Building QA chain for the first time...")
-        qa_chain = build_qa_chain()
+        build_qa_chain()
+    with _active_lock:
+        active = _active
+        active.in_flight += 1
+    try:
+        yield active
+    finally:
+        _release(active)
+
 
+@contextmanager
+def _hold(active):
+    """Keeps an index a request is already using alive for work that outlives the request."""
+    with _active_lock:
+        active.in_flight += 1
     try:
-        result = qa_chain.invoke({"input": question})
-        answer = result.get("answer", "").strip()
-        sources = result.get("context", [])
+        yield active
+    finally:
+        _release(active)
 
-        if not answer:
-            return "❌ Sorry, I couldn't find a good answer to your question."
 
-        formatted_sources = []
-        for doc in sources:
-            source_name = doc.metadata.get("source", "Unknown")
-            filename = os.path.basename(source_name)
-            formatted_sources.append(f"- {filename}")
+def _release(active):
+    with _active_lock:
+        active.in_flight -= 1
+        drained = active.retired and active.in_flight == 0
+    if drained:
+        print(f"♻️ Index version {active.version} drained and released.")
 
-        print(f"\n💬 Answer: {answer}\n")
-        if formatted_sources:
-            print("📚 Sources:")
-            for src in formatted_sources:
-                print(src)
+
+def _invoke_qa_chain(qa_chain, question: str, shard_names=None) -> str:
+    result = qa_chain.invoke({"input": question, "shards": shard_names})
+    answer = result.get("answer", "").strip()
+    sources = result.get("context", [])
+
+    if not answer:
+        return ""
+
+    formatted_sources = []
+    for doc in sources:
+        source_name = doc.metadata.get("source", "Unknown")
+        filename = os.path.basename(source_name)
+        formatted_sources.append(f"- {filename}")
+
+    print(f"\n💬 Answer: {answer}\n")
+    if formatted_sources:
+        print("📚 Sources:")
+        for src in formatted_sources:
+            print(src)
+
+    return answer
+
+
+def generate_answer(question: str, mods=None) -> str:
+    """Answers from the default shard plus the shards of `mods` (every shard if None)."""
+    with _track("answer"), _use_active_index() as active:
+        return _generate_answer(active, question, active.select_shards(mods))
+
+
+def _generate_answer(active, question, shard_names):
+    try:
+        if not config.ANSWER_CACHE_ENABLED:
+            with llm_gate.slot():
+                answer = _invoke_qa_chain(active.qa_chain, question, shard_names)
+        else:
+            key = make_key(question, (active.version, tuple(shard_names)))
+            answer = answer_cache.get(key)
+            if answer is not None:
+                print("⚡ Answer cache hit.")
+            else:
+                flight, is_leader = answer_cache.join_flight(key)
+                if not is_leader:
+                    print("🔗 Same question already in progress, waiting for its answer...")
+                    answer = flight.wait()
+                else:
+                    try:
+                        with llm_gate.slot():
+                            answer = _invoke_qa_chain(active.qa_chain, question, shard_names)
+                        if answer:
+                            answer_cache.put(key, answer)
+                        for token in split_tokens(answer):
+                            flight.publish(token)
+                        flight.finish(answer)
+                    except Exception as e:
+                        flight.fail(e)
+                        raise
+                    finally:
+                        answer_cache.end_flight(key, flight)
+
+        if not answer:
+            return SORRY
 
         return f"{answer}\n"
 
@@ -162,46 +481,176 @@ def generate_answer(question: str) -> str:
         raise e
 
 
-def generate_answer_stream(question: str):
+def generate_answer_stream(question: str, mods=None):
     """
     Generator function that yields answer chunks as they are generated.
     Yields tuples of (chunk_type, content) where chunk_type is 'token', 'done', or 'error'.
+    Cached answers are replayed as tokens, and a question that is already being
+    answered for another request follows that generation instead of starting a new one.
+    Only the default shard and the shards of `mods` are searched (every shard if None).
     """
-    global qa_chain, _retriever
-    if qa_chain is None or _retriever is None:
-        print("🔧 Building QA chain for the first time...")
-        build_qa_chain()
+    with _track("stream"), _use_active_index() as active:
+        for event in _generate_answer_stream(active, question, active.select_shards(mods)):
+            _count_failure("stream", *event)
+            yield event
+
+
+def _generate_answer_stream(active, question, shard_names):
+    if not config.ANSWER_CACHE_ENABLED:
+        with llm_gate.slot():
+            yield from _stream_answer(active.retriever, question, shard_names)
+        return
+
+    key = make_key(question, (active.version, tuple(shard_names)))
+    cached = answer_cache.get(key)
+    if cached is not None:
+        print("⚡ Answer cache hit, replaying stream.")
+        for token in split_tokens(cached):
+            yield ("token", token)
+        yield ("done", "")
+        return
+
+    flight, is_leader = answer_cache.join_flight(key)
+    if not is_leader:
+        print("🔗 Same question already in progress, following its stream...")
+        for token in flight.iter_tokens():
+            yield ("token", token)
+        if flight.error is not None:
+            yield ("error", flight.error)
+        else:
+            yield ("done", "")
+        return
+
+    try:
+        with llm_gate.slot():
+            yield from _lead_stream(active.retriever, question, shard_names, key, flight)
+    finally:
+        answer_cache.end_flight(key, flight)
+
+
+def _lead_stream(retriever, question, shard_names, key, flight):
+    """Streams a generation while publishing it to `flight`, and to the answer cache under `key`."""
+    for event_type, content in _stream_answer(retriever, question, shard_names):
+        if event_type == "token":
+            flight.publish(content)
+        elif event_type == "done":
+            answer = "".join(flight.tokens).strip()
+            if key is not None:
+                answer_cache.put(key, answer)
+            flight.finish(answer)
+        elif event_type == "error":
+            flight.fail(content)
+        yield (event_type, content)
+
+
+def _end_flight(key, flight):
+    if key is not None:
+        answer_cache.end_flight(key, flight)
+    elif not flight.done:
+        flight.fail("Generation was interrupted.")
+
+
+def _lead_in_thread(active, question, shard_names, key, flight, granted_at):
+    with _hold(active):
+        try:
+            for _ in _lead_stream(active.retriever, question, shard_names, key, flight):
+                pass
+        finally:
+            llm_gate.release(granted_at)
+            _end_flight(key, flight)
+
+
+async def astream_answer(question: str, mods=None):
+    """
+    Async counterpart of generate_answer_stream for the async server. The
+    generation runs on a worker thread once it gets an LLM slot; this request
+    and any others asking the same question follow it on the event loop, so a
+    connection waiting for tokens does not hold a thread.
+    Raises Overloaded before the first event if no slot can be had.
+    """
+    with _track("stream"):
+        async for event in _astream_answer(question, mods):
+            _count_failure("stream", *event)
+            yield event
+
+
+async def _astream_answer(question, mods):
+    loop = asyncio.get_running_loop()
+    if _active is None:
+        await loop.run_in_executor(None, build_qa_chain)
+    with _use_active_index() as active:
+        shard_names = active.select_shards(mods)
+        key = None
+        if config.ANSWER_CACHE_ENABLED:
+            key = make_key(question, (active.version, tuple(shard_names)))
+            cached = answer_cache.get(key)
+            if cached is not None:
+                print("⚡ Answer cache hit, replaying stream.")
+                for token in split_tokens(cached):
+                    yield ("token", token)
+                yield ("done", "")
+                return
+            flight, is_leader = answer_cache.join_flight(key)
+        else:
+            flight, is_leader = InFlight(), True
+
+        if is_leader:
+            try:
+                granted_at = await llm_gate.acquire_async()
+            except BaseException:
+                _end_flight(key, flight)
+                raise
+            loop.run_in_executor(_llm_pool, _lead_in_thread, active, question, shard_names, key, flight, granted_at)
+        else:
+            print("🔗 Same question already in progress, following its stream...")
+
+        async for token in flight.aiter_tokens():
+            yield ("token", token)
+        if flight.error is not None:
+            yield ("error", flight.error)
+        else:
+            yield ("done", "")
+
 
+async def agenerate_answer(question: str, mods=None) -> str:
+    """Async counterpart of generate_answer, built on the streamed answer."""
+    tokens = []
+    with _track("answer"):
+        async for event_type, content in _astream_answer(question, mods):
+            if event_type == "token":
+                tokens.append(content)
+            elif event_type == "error":
+                if content in (NO_DOCUMENTS, NO_ANSWER):
+                    return SORRY
+                raise RuntimeError(content)
+    answer = "".join(tokens).strip()
+    return f"{answer}\n" if answer else SORRY
+
+
+def _stream_answer(retriever, question: str, shard_names=None):
     try:
-        # Get documents using the cached retriever
-        docs = _retriever.invoke(question)
+        # Get documents from the selected shards of the active index
+        docs = _retrieve(retriever, question, shard_names)
         
         if not docs:
-            yield ("error", "No relevant documents found.")
+            yield ("error", NO_DOCUMENTS)
             return
 
         # Build context from documents
         context = "\n\n".join([doc.page_content for doc in docs])
         
-        # Create streaming LLM
-        streaming_llm = ChatOllama(
-            model=config.LLM_MODEL, 
-            base_url=config.OLLAMA_HOST,
-            streaming=True
-        )
-        
         # Format the prompt
         formatted_prompt = QA_PROMPT.format(context=context, input=question)
         
         # Stream the response
         full_response = ""
-        for chunk in streaming_llm.stream(formatted_prompt):
+        for chunk in _get_llm().stream(formatted_prompt):
             if hasattr(chunk, 'content') and chunk.content:
                 full_response += chunk.content
                 yield ("token", chunk.content)
         
         if not full_response.strip():
-            yield ("error", "No answer generated.")
+            yield ("error", NO_ANSWER)
             return
             
         yield ("done", "")
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import shutil
+from urllib.parse import urlparse
+
+from config import config
+from config import index_store
+
+# ===========================
+# Per-wiki index shards
+# ===========================
+#
+# faiss_index/
+#   shards.json               shard -> api_url + mod names it answers for
+#   shards/<shard>/           a versioned index (see index_store) per wiki
+#
+# A shard is named after its wiki's host. Raw and cleaned pages are stored
+# per wiki as well:
+#   data/wiki_pages[_cleaned]/<category>/<title>.txt                the default wiki
+#   data/wiki_pages[_cleaned]/_wikis/<shard>/<category>/<title>.txt every other wiki
+# so one wiki can be cleaned, indexed or deleted by looking only at its own
+# directory, and two wikis with the same category and page title never
+# overwrite each other. MediaWiki strips leading underscores from category
+# names, so "_wikis" can never clash with a category.
+
+SHARDS_DIR = "shards"
+REGISTRY_FILE = "shards.json"
+WIKIS_DIR = "_wikis"
+
+
+def shard_name(api_url):
+    return re.sub(r"[^\w.-]", "_", urlparse(api_url).netloc or api_url)
+
+
+DEFAULT_SHARD = shard_name(config.WIKI_API_URL_DEFAULT)
+
+
+def shard_index_path(shard):
+    return os.path.join(config.INDEX_PATH, SHARDS_DIR, shard)
+
+
+def wiki_prefix(shard):
+    """A shard's page directory relative to the raw and cleaned data roots ("" for the default wiki)."""
+    return "" if shard == DEFAULT_SHARD else os.path.join(WIKIS_DIR, shard)
+
+
+def shard_of_path(rel_path):
+    """The shard a page path relative to a data root belongs to."""
+    parts = rel_path.replace(os.sep, "/").split("/", 2)
+    if len(parts) == 3 and parts[0] == WIKIS_DIR:
+        return parts[1]
+    return DEFAULT_SHARD
+
+
+def group_by_shard(rel_paths):
+    """{shard: [page paths]} for page paths relative to a data root."""
+    groups = {}
+    for rel_path in rel_paths:
+        groups.setdefault(shard_of_path(rel_path), []).append(rel_path)
+    return groups
+
+
+def stored_shards(root):
+    """Shards other than the default one with a page directory under `root`."""
+    wikis_dir = os.path.join(root, WIKIS_DIR)
+    if not os.path.isdir(wikis_dir):
+        return []
+    return sorted(name for name in os.listdir(wikis_dir) if os.path.isdir(os.path.join(wikis_dir, name)))
+
+
+def wiki_files(root, shard):
+    """Page paths (relative to `root`) in a shard's directory. The default wiki's walk skips the other wikis."""
+    base = os.path.join(root, wiki_prefix(shard))
+    files = []
+    for dirpath, dirnames, filenames in os.walk(base):
+        if shard == DEFAULT_SHARD and dirpath == base and WIKIS_DIR in dirnames:
+            dirnames.remove(WIKIS_DIR)
+        files.extend(os.path.relpath(os.path.join(dirpath, name), root) for name in filenames if name.endswith(".txt"))
+    return files
+
+
+def normalize_mod(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def request_mods(data):
+    """The player's loaded mods from a question's JSON body, if sent. Returns (mods, error)."""
+    mods = data.get("mods")
+    if mods is not None and (not isinstance(mods, list) or not all(isinstance(m, str) for m in mods)):
+        return None, "'mods' must be a list of mod names"
+    return mods, None
+
+
+# ---- registry ----
+
+def load_registry():
+    try:
+        with open(os.path.join(config.INDEX_PATH, REGISTRY_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_registry(registry):
+    os.makedirs(config.INDEX_PATH, exist_ok=True)
+    path = os.path.join(config.INDEX_PATH, REGISTRY_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def register_shard(api_url, mods=()):
+    """Records the wiki behind a shard and the mod names it should be searched for."""
+    shard = shard_name(api_url)
+    registry = load_registry()
+    entry = registry.setdefault(shard, {"api_url": api_url, "mods": []})
+    entry["mods"] = sorted(set(entry["mods"]) | {m for m in mods if m})
+    save_registry(registry)
+    return shard
+
+
+def unregister_shard(shard):
+    registry = load_registry()
+    if registry.pop(shard, None) is not None:
+        save_registry(registry)
+
+
+# ---- shard contents ----
+
+def shard_files(shard):
+    """Cleaned relative paths that belong to `shard`."""
+    return set(wiki_files(config.DATA_DIR_CLEANED, shard))
+
+
+def all_shards():
+    """Every shard that has pages or is registered, default shard first."""
+    names = set(stored_shards(config.DATA_DIR_CLEANED)) | set(load_registry()) | {DEFAULT_SHARD}
+    return [DEFAULT_SHARD] + sorted(names - {DEFAULT_SHARD})
+
+
+def live_shards():
+    """Returns {shard: (version, index_dir)} for shards with a published version."""
+    root = os.path.join(config.INDEX_PATH, SHARDS_DIR)
+    live = {}
+    if os.path.isdir(root):
+        for shard in sorted(os.listdir(root)):
+            index_dir = index_store.current_index_dir(shard_index_path(shard))
+            if index_dir is not None:
+                live[shard] = (index_store.current_version(shard_index_path(shard)), index_dir)
+    return live
+
+
+def select_shards(mods, available, registry):
+    """
+    Picks the shards to search for a player's mod list: the default shard
+    plus every shard registered for (or named after) one of the mods.
+    Without a mod list every shard is searched.
+    """
+    if mods is None:
+        return sorted(available)
+    wanted = {normalize_mod(m) for m in mods if isinstance(m, str)}
+    selected = set()
+    for shard in available:
+        if shard == DEFAULT_SHARD:
+            selected.add(shard)
+            continue
+        names = {normalize_mod(m) for m in registry.get(shard, {}).get("mods", [])}
+        names.add(normalize_mod(shard.split(".", 1)[0]))
+        if names & wanted:
+            selected.add(shard)
+    return sorted(selected)
+
+
+def remove_shard(shard):
+    shutil.rmtree(shard_index_path(shard), ignore_errors=True)
+    unregister_shard(shard)
+
+
+def retire_global_index():
+    """Deletes the pre-sharding global index once every shard has been built."""
+    index_path = config.INDEX_PATH
+    for name in (index_store.CURRENT_FILE, "index.faiss", "index.pkl", "manifest.json"):
+        path = os.path.join(index_path, name)
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(index_store.versions_root(index_path), ignore_errors=True)
@@ -0,0 +1,92 @@
+import time
+import threading
+import traceback
+from contextlib import contextmanager
+
+# ===========================
+# Startup progress
+# ===========================
+#
+# The server binds its port straight away and loads the RAG pipeline (heavy
+# imports, index shards, QA chain) on a background thread. Each step is a
+# timed stage, logged as it finishes and reported by /healthz and /readyz.
+# A load that fails (Ollama not up yet, say) is retried until it succeeds.
+
+LOAD_RETRY_SECONDS = 10
+
+STARTED = time.monotonic()  # When the server began importing
+_lock = threading.Lock()
+_stages = []
+_status = "starting"  # starting -> loading -> ready
+_error = None
+_loader = None
+
+
+def record(name, seconds, status="done"):
+    with _lock:
+        _stages.append({"name": name, "status": status, "seconds": round(seconds, 3)})
+    print(f"⏱️ {name}: {seconds:.2f}s")
+
+
+@contextmanager
+def stage(name):
+    """Times one startup step and records it, failed or not."""
+    entry = {"name": name, "status": "running", "seconds": None}
+    with _lock:
+        # A retried stage replaces its earlier attempt.
+        _stages[:] = [e for e in _stages if e["name"] != name]
+        _stages.append(entry)
+    started = time.monotonic()
+    try:
+        yield
+    except BaseException:
+        entry["status"] = "failed"
+        raise
+    else:
+        entry["status"] = "done"
+    finally:
+        entry["seconds"] = round(time.monotonic() - started, 3)
+        print(f"⏱️ {name}: {entry['seconds']:.2f}s ({entry['status']})")
+
+
+def _run(load):
+    global _status, _error
+    while True:
+        try:
+            load()
+            break
+        except Exception as e:
+            traceback.print_exc()
+            with _lock:
+                _error = str(e)
+            print(f"⚠️ Startup load failed, retrying in {LOAD_RETRY_SECONDS}s: {e}")
+            time.sleep(LOAD_RETRY_SECONDS)
+    with _lock:
+        _status = "ready"
+        _error = None
+    print(f"✅ Ready to answer after {time.monotonic() - STARTED:.2f}s.")
+
+
+def start(load):
+    """Runs `load` on a background thread; the server is ready once it returns."""
+    global _loader, _status
+    with _lock:
+        if _loader is not None:
+            return
+        _status = "loading"
+        _loader = threading.Thread(target=_run, args=(load,), name="startup-loader", daemon=True)
+    _loader.start()
+
+
+def is_ready():
+    return _status == "ready"
+
+
+def report():
+    with _lock:
+        return {
+            "status": _status,
+            "uptime_s": round(time.monotonic() - STARTED, 3),
+            "stages": [dict(entry) for entry in _stages],
+            "error": _error,
+        }
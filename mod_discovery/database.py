@@ -1,6 +1,7 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, engine
+from sqlalchemy import create_engine, Column, Integer, Float, String, Index, func, engine
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.schema import CreateIndex
 
 Base = declarative_base()
 
@@ -19,6 +20,21 @@ class Mod(Base):
     def __repr__(self):
         return f"<Mod(name='{self.name}', slug='{self.slug}')>"
 
+# Case-insensitive name lookups (lower(name) IN (...)) use this index.
+Index("ix_mods_name_lower", func.lower(Mod.name))
+
+
+class ModWiki(Base):
+    """Result of a network wiki search for a mod, so it is not repeated."""
+    __tablename__ = 'mod_wikis'
+
+    key = Column(String, primary_key=True)  # Normalized mod name
+    api_url = Column(String, nullable=True)  # None: no wiki was found
+    checked_at = Column(Float, nullable=False)
+
+    def __repr__(self):
+        return f"<ModWiki(key='{self.key}', api_url='{self.api_url}')>"
+
 # Database Setup
 DB_NAME = "mods.db"
 # Use absolute path relative to this file's directory if possible, or just local
@@ -29,9 +45,18 @@ DB_PATH = os.path.join(BASE_DIR, DB_NAME)
 engine = create_engine(f"sqlite:///{DB_PATH}")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def ensure_schema():
+    """Creates missing tables and indexes (create_all skips the indexes of existing tables)."""
+    Base.metadata.create_all(bind=engine)
+    # checkfirst does not see SQLite expression indexes, so let SQLite check.
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
 def init_db():
     print(f"📦 Initializing database at {DB_PATH}...")
-    Base.metadata.create_all(bind=engine)
+    ensure_schema()
     print("✅ Database tables created.")
 
 def get_db():
@@ -1,7 +1,17 @@
+import os
+import math
 import requests
 import urllib.parse
 import re
 import time
+import threading
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import config
+from config import metrics
+from config import shards
+from mod_discovery import database
 
 MODRINTH_API_URL = "https://api.modrinth.com/v2"
 
@@ -151,3 +161,314 @@ def fetch_full_project_details(slug):
     except:
         pass
     return None
+
+
+# ===========================
+# Mod -> wiki resolver
+# ===========================
+#
+# /admin/detect-mods sends the whole mod list of a pack, which is resolved
+# local-first in one pass:
+#   1. the in-process LRU of earlier results
+#   2. one batched mods.db query on the indexed slug and lower(name) columns
+#   3. normalized names and trigram similarity against an in-memory index of
+#      mods.db, for spellings that differ ("Just Enough Items (JEI)")
+#   4. earlier network searches, stored in mods.db's mod_wikis table
+# Only mods that are still unresolved are searched online, all in parallel,
+# and their results are stored so the next pack finds them locally. Only
+# MediaWiki wikis can be ingested, so a GitHub or other wiki listed in mods.db
+# counts as a miss and the mod's catalog name is searched instead.
+
+# The game, mod loaders and pure library mods have no wiki worth learning.
+IGNORED_MODS = {shards.normalize_mod(m) for m in (
+    "minecraft", "java", "mcp", "fml", "forge", "neoforge", "fabricloader", "fabric", "fabric-api",
+    "quilt_loader", "quilted_fabric_api", "fabric-language-kotlin", "kotlinforforge", "mixinextras",
+    "cloth-config", "architectury", "forgeconfigapiport",
+)}
+MEDIAWIKI_FARMS = (".fandom.com", ".wikia.com", ".wiki.gg")
+TRIGRAM_MIN_LENGTH = 4  # Shorter names only match exactly
+
+
+def clean_mod_name(mod):
+    """
+    Strips a jar file name down to the mod's name: "sodium-fabric-0.5.8+mc1.20.4.jar" -> "sodium".
+    """
+    name = re.sub(r"\.jar$", "", os.path.basename(str(mod).strip()), flags=re.I)
+    name = re.sub(r"[-_+ ]v?\d+(\.\d+)+.*$", "", name)
+    name = re.sub(r"[-_ ](fabric|forge|neoforge|quilt)$", "", name, flags=re.I)
+    return name.strip()
+
+
+def mod_key(mod):
+    return shards.normalize_mod(clean_mod_name(mod))
+
+
+def slugify(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+
+def wiki_api_url(wiki_url):
+    """
+    The MediaWiki API URL of a wiki link, or None when it is not a MediaWiki we know.
+    """
+    if not wiki_url:
+        return None
+    parts = urllib.parse.urlsplit(wiki_url)
+    if parts.path.endswith("api.php"):
+        return f"{parts.scheme}://{parts.netloc}{parts.path}"
+    if parts.hostname and parts.hostname.endswith(MEDIAWIKI_FARMS):
+        return f"https://{parts.hostname}/api.php"
+    return None
+
+
+def filter_mods(raw_mods):
+    """
+    Drops blanks, duplicates, the game, loaders and library mods; keeps the names as sent.
+    """
+    mods = []
+    seen = set()
+    for mod in raw_mods:
+        if not isinstance(mod, str):
+            continue
+        key = mod_key(mod)
+        if not key or key in IGNORED_MODS or key in seen:
+            continue
+        seen.add(key)
+        mods.append(mod)
+    return mods
+
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class ModCatalog:
+    """mods.db's mods by normalized name/slug and by trigram, reloaded when the file changes."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.mods = []  # (name, wiki_url, downloads)
+        self.by_key = {}  # normalized name or slug -> index in mods
+        self.by_trigram = {}  # trigram -> keys containing it
+        self.grams = {}  # key -> its trigrams
+
+    def _refresh(self):
+        try:
+            mtime = os.path.getmtime(self.db_path)
+        except OSError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+        with database.SessionLocal() as db:
+            rows = db.query(database.Mod.name, database.Mod.slug, database.Mod.wiki_url, database.Mod.downloads).all()
+        self.mods, self.by_key, self.by_trigram, self.grams = [], {}, {}, {}
+        # Most downloaded first, so it keeps a name or slug that several mods share.
+        for name, slug, wiki_url, downloads in sorted(rows, key=lambda r: -(r[3] or 0)):
+            self.mods.append((name, wiki_url, downloads or 0))
+            for key in (shards.normalize_mod(name), shards.normalize_mod(slug)):
+                if not key or key in self.by_key:
+                    continue
+                self.by_key[key] = len(self.mods) - 1
+                grams = self.grams[key] = frozenset(_trigrams(key))
+                for gram in grams:
+                    self.by_trigram.setdefault(gram, []).append(key)
+        self._mtime = mtime
+
+    def match(self, key, threshold):
+        """
+        Returns the (name, wiki_url, downloads) of the closest mod, or None.
+        Exact normalized matches win; otherwise the best trigram Dice score of
+        at least `threshold`, ties going to the most downloaded mod.
+        """
+        with self._lock:
+            self._refresh()
+            index = self.by_key.get(key)
+            if index is not None:
+                return self.mods[index]
+            if len(key) < TRIGRAM_MIN_LENGTH:
+                return None
+            grams = _trigrams(key)
+            # A name scoring at least `threshold` has between `needed` and
+            # `most` trigrams and shares at least `needed` of ours, so it
+            # contains one of our rarest len - needed + 1.
+            needed = math.ceil(threshold * len(grams) / (2 - threshold) - 1e-9)
+            most = len(grams) * (2 - threshold) / threshold + 1e-9
+            rarest = sorted(grams, key=lambda g: len(self.by_trigram.get(g, ())))[: len(grams) - needed + 1]
+            candidates = {other for gram in rarest for other in self.by_trigram.get(gram, ())}
+            best, best_score = None, -1
+            for other in candidates:
+                size = len(self.grams[other])
+                if size < needed or size > most:
+                    continue
+                score = 2 * len(grams & self.grams[other]) / (len(grams) + size)
+                if score < threshold:
+                    continue
+                candidate = self.mods[self.by_key[other]]
+                if score > best_score or (score == best_score and candidate[2] > best[2]):
+                    best, best_score = candidate, score
+            return best
+
+
+class ModWikiResolver:
+    def __init__(self, cache_size, workers):
+        self.cache_size = cache_size
+        self.workers = workers
+        self.catalog = ModCatalog(database.DB_PATH)
+        self._cache = OrderedDict()  # key -> (api_url, stored_at)
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self.resolved = Counter()
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return False, None
+            api_url, stored_at = entry
+            if api_url is None and time.time() - stored_at > config.MOD_WIKI_RECHECK_SECONDS:
+                del self._cache[key]
+                return False, None
+            self._cache.move_to_end(key)
+            return True, api_url
+
+    def _remember(self, key, api_url):
+        with self._lock:
+            self._cache[key] = (api_url, time.time())
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _count(self, source, amount=1):
+        self.resolved[source] += amount
+        metrics.MOD_RESOLUTIONS.inc(amount, source=source)
+
+    def _lookup_db(self, names):
+        """One query for all `names` (key -> cleaned name) by slug or lower(name); returns key -> (name, wiki_url)."""
+        slugs = {slugify(name): key for key, name in names.items()}
+        lowered = {name.lower(): key for key, name in names.items()}
+        Mod = database.Mod
+        with database.SessionLocal() as db:
+            rows = (
+                db.query(Mod.name, Mod.slug, Mod.wiki_url)
+                .filter(Mod.slug.in_(list(slugs)) | database.func.lower(Mod.name).in_(list(lowered)))
+                .order_by(Mod.downloads.desc())
+                .all()
+            )
+        found = {}
+        for name, slug, wiki_url in rows:
+            key = slugs.get(slug) or lowered.get(name.lower())
+            if key and key not in found:
+                found[key] = (name, wiki_url)
+        return found
+
+    def _stored(self, keys):
+        with database.SessionLocal() as db:
+            rows = db.query(database.ModWiki).filter(database.ModWiki.key.in_(list(keys))).all()
+            return {row.key: (row.api_url, row.checked_at) for row in rows}
+
+    def _store(self, results):
+        now = time.time()
+        with database.SessionLocal() as db:
+            for key, api_url in results.items():
+                db.merge(database.ModWiki(key=key, api_url=api_url, checked_at=now))
+            db.commit()
+
+    def _search(self, names):
+        """Looks for the wikis of `names` (key -> name to search) online, in parallel."""
+        if not names or self.workers <= 0:
+            return {}
+        keys = list(names)
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(keys))) as pool:
+            urls = list(pool.map(lambda key: find_wiki_fallback(names[key]), keys))
+        found = dict(zip(keys, urls))
+        self._store(found)
+        return found
+
+    def resolve(self, mods):
+        """
+        Maps every mod name to the MediaWiki API URL of its wiki, or None.
+        """
+        started = time.monotonic()
+        keys = {mod: mod_key(mod) for mod in mods}
+        results = {}
+        pending = {}  # key -> cleaned name
+        for mod, key in keys.items():
+            if not key or key in results or key in pending:
+                continue
+            hit, api_url = self._cached(key)
+            if hit:
+                results[key] = api_url
+                self._count("cache" if api_url else "none")
+            else:
+                pending[key] = clean_mod_name(mod)
+
+        cached = len(results)
+        online = {}  # key -> name to search
+        if pending:
+            if not self._schema_ready:
+                database.ensure_schema()
+                self._schema_ready = True
+            matched = self._lookup_db(pending)
+            for key, name in pending.items():
+                source = "db"
+                if key not in matched:
+                    mod = self.catalog.match(key, config.MOD_FUZZY_THRESHOLD)
+                    if mod:
+                        matched[key] = mod[:2]
+                        source = "fuzzy"
+                api_url = wiki_api_url(matched[key][1]) if key in matched else None
+                if api_url:
+                    results[key] = api_url
+                    self._count(source)
+                else:
+                    online[key] = matched[key][0] if key in matched else name
+
+        if online:
+            for key, (api_url, checked_at) in self._stored(online).items():
+                if api_url or time.time() - checked_at <= config.MOD_WIKI_RECHECK_SECONDS:
+                    results[key] = api_url
+                    del online[key]
+                    self._count("stored" if api_url else "none")
+        searched = self._search(online)
+        results.update(searched)
+        found = sum(1 for api_url in searched.values() if api_url)
+        if found:
+            self._count("network", found)
+        # Searches that found nothing, and misses not searched (MOD_DISCOVERY_WORKERS=0)
+        unresolved = len(online) - found
+        if unresolved:
+            self._count("none", unresolved)
+
+        for key in pending:
+            self._remember(key, results.get(key))
+        resolved = sum(1 for url in results.values() if url)
+        print(
+            f"🧩 Resolved {cached + len(pending)} mods to {resolved} wikis in {(time.monotonic() - started) * 1000:.0f}ms "
+            f"({cached} cached, {len(searched)} searched online)"
+        )
+        return {mod: results.get(key) for mod, key in keys.items()}
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._cache)
+        return {"entries": entries, "max_entries": self.cache_size, "resolved": dict(self.resolved)}
+
+
+resolver = ModWikiResolver(config.MOD_WIKI_CACHE_SIZE, config.MOD_DISCOVERY_WORKERS)
+
+
+def resolve_wikis(mods):
+    """
+    Resolves a whole mod list at once; returns {mod: api_url or None}.
+    """
+    return resolver.resolve(mods)
+
+
+def find_wiki_for_mod(mod):
+    """
+    Finds the MediaWiki API URL of one mod's wiki, or None.
+    """
+    return resolver.resolve([mod]).get(mod)
@@ -1,44 +1,35 @@
+from config import startup
 from flask import Flask, request, jsonify, Response  # type: ignore
 from flask_cors import CORS  # type: ignore
 from flask_limiter import Limiter  # type: ignore
 from flask_limiter.util import get_remote_address  # type: ignore
-from config.rag_pipeline import generate_answer, generate_answer_stream, reload_qa_chain
 from config import config
-from config import build_index
-from wiki import wiki_loader
-from wiki import clean_data
+from config import metrics
+from config import shards
+from config.answer_cache import answer_cache
+from config.admission import Overloaded, llm_gate
+from config import ingest_scheduler as ingestion
+from config.ingest_scheduler import ingest_scheduler
 import multiprocessing
-import threading
-import os
+import itertools
+import time
 import json
 
+# The RAG pipeline, indexing and wiki modules pull in LangChain, FAISS and
+# aiohttp, so they are imported where they are used (or by the background
+# loader) rather than here: the port is bound before any of them load.
+
 app = Flask(__name__)
 limiter = Limiter(get_remote_address, app=app)
 CORS(app)
 
-# Global state for indexing
-indexing_lock = threading.Lock()
-in_progress_wikis = set()
-PROCESSED_WIKIS_FILE = os.path.join(config.DATA_DIR_CLEANED, "processed_wikis.json")
 
-def load_processed_wikis():
-    import json
-    if os.path.exists(PROCESSED_WIKIS_FILE):
-        try:
-            with open(PROCESSED_WIKIS_FILE, "r") as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_processed_wiki(wiki_url):
-    import json
-    import time
-    data = load_processed_wikis()
-    data[wiki_url] = time.time()
-    os.makedirs(os.path.dirname(PROCESSED_WIKIS_FILE), exist_ok=True)
-    with open(PROCESSED_WIKIS_FILE, "w") as f:
-        json.dump(data, f)
+def overloaded_response(e):
+    """429/503 with a Retry-After hint when the LLM gate turns a question away."""
+    response = jsonify({"error": str(e), "queue_depth": e.queue_depth, "retry_after": e.retry_after})
+    response.status_code = e.status
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
 
 
 @app.route("/ask", methods=["POST"])
@@ -46,10 +37,17 @@ def ask_question():
     data = request.get_json()
     if not data or "question" not in data:
         return jsonify({"error": "Missing 'question' field"}), 400
+    mods, error = shards.request_mods(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    from config import rag_pipeline
 
     try:
-        answer = generate_answer(data["question"])
+        answer = rag_pipeline.generate_answer(data["question"], mods)
         return jsonify({"answer": answer})
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         import traceback
 
@@ -66,10 +64,30 @@ def ask_question_stream():
     data = request.get_json()
     if not data or "question" not in data:
         return jsonify({"error": "Missing 'question' field"}), 400
+    mods, error = shards.request_mods(data)
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Pull the first event before answering, so a question the LLM gate
+    # turns away still gets a proper 429/503 instead of an SSE error.
+    from config import rag_pipeline
+
+    events = rag_pipeline.generate_answer_stream(data["question"], mods)
+    first, failure = [], None
+    try:
+        first = [next(events)]
+    except StopIteration:
+        pass
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        failure = e
 
     def generate():
         try:
-            for event_type, content in generate_answer_stream(data["question"]):
+            if failure is not None:
+                raise failure
+            for event_type, content in itertools.chain(first, events):
                 event_data = json.dumps({"type": event_type, "content": content})
                 yield f"data: {event_data}\n\n"
         except Exception as e:
@@ -89,41 +107,6 @@ def ask_question_stream():
     )
 
 
-def background_wiki_processing(api_url, categories, force=False):
-    if api_url in in_progress_wikis:
-        print(f"⏩ Wiki {api_url} is already being processed. Skipping.")
-        return
-    
-    # Check cache if not forced
-    if not force:
-        import time
-        processed = load_processed_wikis()
-        last_time = processed.get(api_url, 0)
-        # Skip if processed in the last 24 hours
-        if time.time() - last_time < 86400:
-            print(f"✅ Wiki {api_url} was processed recently. Skipping download.")
-            return
-
-    in_progress_wikis.add(api_url)
-    print(f"🚀 Starting background wiki processing for {api_url}...")
-    try:
-        wiki_loader.fetch_wiki(api_url, set(categories))
-        clean_data.walk_and_clean()
-        
-        with indexing_lock:
-            build_index.build_index()
-            reload_qa_chain()
-            
-        save_processed_wiki(api_url)
-        print(f"✅ Background wiki processing complete for {api_url}!")
-    except Exception as e:
-        print(f"❌ Background wiki processing failed for {api_url}: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        in_progress_wikis.remove(api_url)
-
-
 @app.route("/admin/add-wiki", methods=["POST"])
 def add_wiki():
     data = request.get_json()
@@ -132,12 +115,43 @@ def add_wiki():
     
     api_url = data.get("api_url", config.WIKI_API_URL_DEFAULT)
     categories = data["categories"]
+    full = bool(data.get("full", False))
+    mods = data.get("mods", [])
+
+    job, created = ingest_scheduler.submit(api_url, categories, mods, force=True, full=full)
+
+    return jsonify({
+        "status": "processing_started" if created else "already_queued",
+        "shard": job["shard"],
+        "job": job,
+        "message": "Wiki sync and indexing queued. Follow it at /admin/jobs/" + job["id"],
+    })
+
+
+@app.route("/admin/remove-wiki", methods=["POST"])
+def remove_wiki():
+    data = request.get_json()
+    if not data or "api_url" not in data:
+        return jsonify({"error": "Missing 'api_url'"}), 400
 
-    # Start background thread
-    thread = threading.Thread(target=background_wiki_processing, args=(api_url, categories, True))
-    thread.start()
+    from config.rag_pipeline import reload_qa_chain
+    from wiki import wiki_sync, clean_data
 
-    return jsonify({"status": "processing_started", "message": "Wiki download and indexing started in background."})
+    api_url = data["api_url"]
+    shard = shards.shard_name(api_url)
+    if shard == shards.DEFAULT_SHARD:
+        return jsonify({"error": "The default wiki's shard cannot be removed"}), 400
+    if ingest_scheduler.is_active(api_url):
+        return jsonify({"error": "Wiki is being processed, try again later"}), 409
+
+    # Only this wiki's pages and shard are touched.
+    with ingestion.indexing_lock:
+        removed = wiki_sync.remove_wiki(api_url)
+        clean_data.remove_wiki(shard)
+        shards.remove_shard(shard)
+        reload_qa_chain()
+
+    return jsonify({"status": "success", "shard": shard, "removed_pages": len(removed)})
 
 
 @app.route("/admin/detect-mods", methods=["POST"])
@@ -150,24 +164,18 @@ def detect_mods():
     from mod_discovery import mod_discovery
     
     filtered_mods = mod_discovery.filter_mods(raw_mods)
+    wikis = mod_discovery.resolve_wikis(filtered_mods)
     found_wikis = []
     
-    processed = load_processed_wikis()
-    import time
-    
     for mod in filtered_mods:
-        wiki_url = mod_discovery.find_wiki_for_mod(mod)
+        wiki_url = wikis.get(mod)
         if wiki_url:
-            # Skip if already in progress or processed recently
-            last_time = processed.get(wiki_url, 0)
-            if wiki_url not in in_progress_wikis and (time.time() - last_time > 86400):
-                found_wikis.append({"mod": mod, "url": wiki_url})
-                # Trigger background processing for each found wiki
-                default_cats = ["Crafting", "Items", "Blocks", "Mobs"]
-                threading.Thread(target=background_wiki_processing, args=(wiki_url, default_cats)).start()
-            else:
-                reason = "in_progress" if wiki_url in in_progress_wikis else "recently_processed"
-                print(f"⏭️ Skipping background processing for {wiki_url} ({reason})")
+            # Skip if processed recently; mods sharing a wiki end up in one job
+            if ingestion.recently_synced(wiki_url):
+                print(f"⏭️ Skipping background processing for {wiki_url} (recently_processed)")
+                continue
+            job, created = ingest_scheduler.submit(wiki_url, ingestion.DEFAULT_CATEGORIES, [mod])
+            found_wikis.append({"mod": mod, "url": wiki_url, "job_id": job["id"], "queued": created})
             
     return jsonify({
         "status": "success", 
@@ -176,8 +184,25 @@ def detect_mods():
     })
 
 
+@app.route("/admin/jobs", methods=["GET"])
+def list_jobs():
+    """Ingestion jobs, newest first (?state=queued|downloading|...|failed to filter)."""
+    jobs = ingest_scheduler.jobs(request.args.get("state"))
+    return jsonify({"counts": ingest_scheduler.counts(), "index_passes": ingest_scheduler.index_passes, "jobs": jobs})
+
+
+@app.route("/admin/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = ingest_scheduler.job(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job)
+
+
 @app.route("/admin/reload-index", methods=["POST"])
 def reload_index():
+    from config.rag_pipeline import reload_qa_chain
+
     try:
         reload_qa_chain()
         return jsonify({"status": "success", "message": "QA Chain reloaded."})
@@ -185,6 +210,59 @@ def reload_index():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/admin/stats", methods=["GET"])
+def stats():
+    from config import embedding_cache
+    from mod_discovery import mod_discovery
+
+    return jsonify({
+        "embedding_cache": embedding_cache.cache_stats(),
+        "query_embedding": embedding_cache.batcher_stats(),
+        "answer_cache": answer_cache.stats(),
+        "llm": llm_gate.stats(),
+        "mod_resolver": mod_discovery.resolver.stats(),
+    })
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, cache, queue and index metrics."""
+    return Response(metrics.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: the process is up and serving HTTP, whatever it is still loading."""
+    return jsonify({"status": "ok", "uptime_s": startup.report()["uptime_s"]})
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: 200 once the index and QA chain are loaded, 503 with load progress until then."""
+    report = startup.report()
+    return jsonify(report), 200 if startup.is_ready() else 503
+
+
+def load_pipeline():
+    """Background startup: heavy imports, model warm-up, then the index and QA chain."""
+    with startup.stage("import RAG pipeline"):
+        from config import rag_pipeline
+    with startup.stage("import LLM client"):
+        from config import llm_client
+    llm_client.start_keep_warm()
+    # Before the index: syncing a wiki is how a missing index gets built.
+    ingest_scheduler.start()
+    with startup.stage("load index and QA chain"):
+        rag_pipeline.build_qa_chain()
+
+
 if __name__ == "__main__":
     multiprocessing.set_start_method("spawn", force=True)
-    app.run(host="0.0.0.0", port=8000, debug=False)
+    startup.record("import web server", time.monotonic() - startup.STARTED)
+    if config.SERVER_MODE == "async":
+        with startup.stage("import async server"):
+            import async_server
+        async_server.main(app, load_pipeline)
+    else:
+        startup.start(load_pipeline)
+        app.run(host="0.0.0.0", port=config.SERVER_PORT, debug=False, threaded=True)
@@ -1,41 +1,93 @@
 import os
 import re
+import json
+import time
+import hashlib
+import shutil
+import argparse
+import concurrent.futures
 from tqdm import tqdm  # type: ignore
 from config import config
+from config import shards
 
 SOURCE_DIR = config.DATA_DIR_RAW
 OUTPUT_DIR = config.DATA_DIR_CLEANED
+MANIFEST_FILE = ".clean_manifest.json"
+
+# Bump whenever clean_text / clean_and_save_file output changes, so files that
+# were cleaned by an older version are not skipped as unchanged.
+CLEANER_VERSION = 3
+
+# Below this many files a process pool costs more than it saves.
+MIN_PARALLEL_FILES = 200
 
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
 
-def clean_text(text):
-    """Applies a series of regex cleanups to the raw wiki text."""
-    # Remove ==Headers==
-    text = re.sub(r"==+.*?==+", "", text)
-    # Remove [[Category:...]] tags
-    text = re.sub(r"\[\[Category:.*?\]\]", "", text)
-    # Remove {{Templates}} - non-greedy, simple cases only
-    text = re.sub(r"\{\{.*?\}\}", "", text, flags=re.DOTALL)
-    # Remove remaining wikilink brackets
-    text = re.sub(r"\[\[|\]\]", "", text)
-    # Remove stray http links (we already processed the one we want)
-    text = re.sub(r"http\S+", "", text)
-    # Remove non-printable/non-ASCII characters
-    text = re.sub(r"[^ -~\n]", "", text)
-    # Collapse 3+ newlines down to 2
-    text = re.sub(r"\n{3,}", "\n\n", text)
-    return text.strip()
+# Wiki markup clean_text removes. Every alternative starts with a literal so
+# the regex engine can jump straight to candidate positions.
+_MARKUP = re.compile(r"==+.*?==+|\[\[Category:.*?\]\]|\{\{|\[\[|\]\]|http\S+")
+_TEMPLATE_BRACES = re.compile(r"\{\{|\}\}")
+_EXTRA_NEWLINES = re.compile(r"\n\n\n+")
+# Control characters other than "\n"; non-ASCII is dropped by encoding first.
+_CONTROL_CHARS = dict.fromkeys([c for c in range(32) if c != 10] + [127])
 
 
-def clean_and_save_file(filepath, relative_path, output_dir):
+def _skip_template(text, start):
     """
-    Cleans a single file and saves it to the output directory.
-    This function now also processes the ImageSourceURL and ImagePath tags.
+    Returns the index just past the {{template}} opening at `start`, following
+    nested templates. Unbalanced templates end at the first "}}"; returns None
+    if there is no "}}" at all.
     """
-    with open(filepath, "r", encoding="utf-8") as f:
-        raw_text = f.read()
+    depth = 0
+    for m in _TEMPLATE_BRACES.finditer(text, start):
+        depth += 1 if m.group() == "{{" else -1
+        if depth == 0:
+            return m.end()
+    close = text.find("}}", start + 2)
+    return None if close == -1 else close + 2
+
+
+def clean_text(text):
+    """
+    Cleans raw wiki text with one left-to-right scan over its markup: drops
+    ==Headers==, [[Category:...]] tags, nested {{Templates}}, wikilink brackets
+    and http links. The kept text is then stripped of non-printable/non-ASCII
+    characters and 3+ newline runs, both C-level operations.
+    """
+    out = []
+    pos = 0
+
+    # Search again from `pos` after every match: a match found inside a
+    # skipped template could run past its end and hide the markup after it.
+    while (m := _MARKUP.search(text, pos)):
+        start = m.start()
+        if start > pos:
+            out.append(text[pos:start])
+        pos = m.end()
+
+        if m.group() == "{{":
+            end = _skip_template(text, start)
+            if end is None:
+                out.append("{{")
+            else:
+                pos = end
 
+    out.append(text[pos:])
+    return _strip_text("".join(out))
+
+
+def _strip_text(text):
+    """Drops non-printable/non-ASCII characters and collapses 3+ newlines to 2."""
+    text = text.encode("ascii", "ignore").decode("ascii").translate(_CONTROL_CHARS)
+    return _EXTRA_NEWLINES.sub("\n\n", text).strip()
+
+
+def clean_page(raw_text):
+    """
+    Cleans the raw text of one page, turning the ImageSourceURL / ImagePath
+    tags at its top into an ImageLink tag at its end.
+    """
     image_link_tag = ""
 
     # 1. Look for our special ImageSourceURL tag (at the start of the file)
@@ -69,7 +121,18 @@ def clean_and_save_file(filepath, relative_path, output_dir):
 
     # 6. Append our new ImageLink tag to the *end* of the cleaned text
     # This ensures it's indexed along with the document.
-    cleaned_text = cleaned + image_link_tag
+    return cleaned + image_link_tag
+
+
+def clean_and_save_file(filepath, relative_path, output_dir):
+    """
+    Cleans a single file and saves it to the output directory.
+    This function now also processes the ImageSourceURL and ImagePath tags.
+    """
+    with open(filepath, "r", encoding="utf-8") as f:
+        raw_text = f.read()
+
+    cleaned_text = clean_page(raw_text)
 
     # 7. Save the cleaned file
     cleaned_path = os.path.join(output_dir, relative_path)
@@ -79,23 +142,172 @@ def clean_and_save_file(filepath, relative_path, output_dir):
         f.write(cleaned_text)
 
 
-def walk_and_clean(source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR):
-    """Walks the source directory, cleans all .txt files, and saves to output."""
-    file_list = []
-    print(f"🧹 Starting cleanup from '{source_dir}'...")
-    for root, _, files in os.walk(source_dir):
+def load_clean_manifest(output_dir):
+    """
+    Loads {relative path: {"hash", "size"}} of the raw input of every file
+    cleaned by the current cleaner version. Each wiki's directory has its own.
+    """
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("cleaner_version") != CLEANER_VERSION:
+        return {}
+    return manifest.get("files", {})
+
+
+def save_clean_manifest(output_dir, files):
+    path = os.path.join(output_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"cleaner_version": CLEANER_VERSION, "files": files}, f)
+    os.replace(tmp_path, path)
+
+
+def clean_task(task):
+    """
+    Worker entry point. Skips the file if its content hash matches the one
+    recorded for the existing output. Returns (relative_path, hash, size, cleaned).
+    """
+    full_path, relative_path, output_dir, known_hash = task
+    with open(full_path, "rb") as f:
+        raw = f.read()
+    file_hash = hashlib.sha1(raw).hexdigest()
+    if file_hash == known_hash and os.path.exists(os.path.join(output_dir, relative_path)):
+        return relative_path, file_hash, len(raw), False
+    clean_and_save_file(full_path, relative_path, output_dir)
+    return relative_path, file_hash, len(raw), True
+
+
+def iter_source_files(source_dir, skip_wikis=False):
+    """Yields (full path, relative path) of the .txt files under source_dir, without the other wikis' directories if `skip_wikis`."""
+    for root, dirs, files in os.walk(source_dir):
+        if skip_wikis and root == source_dir and shards.WIKIS_DIR in dirs:
+            dirs.remove(shards.WIKIS_DIR)
         for file in files:
             if file.endswith(".txt"):
                 full_path = os.path.join(root, file)
-                relative_path = os.path.relpath(full_path, source_dir)
-                file_list.append((full_path, relative_path))
+                yield full_path, os.path.relpath(full_path, source_dir)
 
-    # Use tqdm for a progress bar
-    for full_path, relative_path in tqdm(file_list, desc="Cleaning files"):
-        clean_and_save_file(full_path, relative_path, output_dir)
-    
-    print(f"✅ Cleaned files saved to '{output_dir}'")
+
+def walk_and_clean(source_dir=SOURCE_DIR, output_dir=OUTPUT_DIR, workers=None, force=False, paths=None, shard=None):
+    """
+    Walks the source directory, cleans changed .txt files, and saves to output.
+
+    Every wiki is cleaned on its own, from and into its own directory (see
+    shards.wiki_prefix) with its own manifest: `shard` limits the run to one
+    wiki, otherwise `paths` are grouped by wiki, or every wiki is cleaned.
+    A file is skipped when its cleaned output is newer than the input, or when
+    its content hash is unchanged since it was last cleaned. The rest are
+    cleaned across a process pool of `workers` processes (CLEAN_WORKERS).
+    If `paths` (relative to source_dir) is given, only those files are looked
+    at, and the outputs of the ones that no longer exist are removed.
+    Returns the relative paths of the files that were (re)cleaned.
+    """
+    if shard is None:
+        if paths is not None:
+            groups = shards.group_by_shard(paths)
+        else:
+            groups = dict.fromkeys([shards.DEFAULT_SHARD] + shards.stored_shards(source_dir))
+        cleaned = []
+        for name, group in groups.items():
+            cleaned += walk_and_clean(source_dir, output_dir, workers, force, group, name)
+        return cleaned
+
+    prefix = shards.wiki_prefix(shard)
+    if not prefix:
+        return _clean_wiki(source_dir, output_dir, workers, force, paths, skip_wikis=True)
+    cleaned = _clean_wiki(
+        os.path.join(source_dir, prefix),
+        os.path.join(output_dir, prefix),
+        workers,
+        force,
+        None if paths is None else [os.path.relpath(p, prefix) for p in paths],
+        skip_wikis=False,
+    )
+    return [os.path.join(prefix, p) for p in cleaned]
+
+
+def remove_wiki(shard):
+    """Deletes a wiki's cleaned pages and clean manifest."""
+    if shard == shards.DEFAULT_SHARD:
+        raise ValueError("The default wiki's pages are not in a directory of their own")
+    shutil.rmtree(os.path.join(OUTPUT_DIR, shards.wiki_prefix(shard)), ignore_errors=True)
+
+
+def _clean_wiki(source_dir, output_dir, workers, force, paths, skip_wikis):
+    workers = workers or config.CLEAN_WORKERS
+    manifest = {} if force and paths is None else load_clean_manifest(output_dir)
+    start = time.perf_counter()
+
+    if paths is None:
+        sources = iter_source_files(source_dir, skip_wikis)
+    else:
+        sources = []
+        for relative_path in paths:
+            full_path = os.path.join(source_dir, relative_path)
+            if os.path.exists(full_path):
+                sources.append((full_path, relative_path))
+                continue
+            manifest.pop(relative_path, None)
+            try:
+                os.remove(os.path.join(output_dir, relative_path))
+                print(f"🗑️ Removed cleaned copy of deleted page '{relative_path}'")
+            except OSError:
+                pass
+
+    tasks = []
+    skipped = 0
+    print(f"🧹 Starting cleanup from '{source_dir}'...")
+    for full_path, relative_path in sources:
+        known_hash = None if force else manifest.get(relative_path, {}).get("hash")
+        if known_hash is not None:
+            try:
+                out_mtime = os.path.getmtime(os.path.join(output_dir, relative_path))
+                if out_mtime >= os.path.getmtime(full_path):
+                    skipped += 1
+                    continue
+            except OSError:
+                pass
+        tasks.append((full_path, relative_path, output_dir, known_hash))
+
+    cleaned = []
+    if len(tasks) < MIN_PARALLEL_FILES or workers <= 1:
+        results = map(clean_task, tasks)
+        for relative_path, file_hash, size, was_cleaned in tqdm(results, total=len(tasks), desc="Cleaning files"):
+            manifest[relative_path] = {"hash": file_hash, "size": size}
+            if was_cleaned:
+                cleaned.append(relative_path)
+    else:
+        chunksize = config.CLEAN_CHUNKSIZE or max(1, len(tasks) // (workers * 4))
+        print(f"⚙️ Cleaning {len(tasks)} files with {workers} processes (chunksize {chunksize})...")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(clean_task, tasks, chunksize=chunksize)
+            for relative_path, file_hash, size, was_cleaned in tqdm(results, total=len(tasks), desc="Cleaning files"):
+                manifest[relative_path] = {"hash": file_hash, "size": size}
+                if was_cleaned:
+                    cleaned.append(relative_path)
+
+    os.makedirs(output_dir, exist_ok=True)
+    save_clean_manifest(output_dir, manifest)
+
+    elapsed = time.perf_counter() - start
+    total = len(tasks) + skipped
+    rate = total / elapsed if elapsed > 0 else 0.0
+    print(
+        f"✅ Cleaned {len(cleaned)} files, {total - len(cleaned)} unchanged, "
+        f"in {elapsed:.2f}s ({rate:.0f} files/sec). Saved to '{output_dir}'"
+    )
+    return cleaned
 
 
 if __name__ == "__main__":
-    walk_and_clean()
+    parser = argparse.ArgumentParser(description="Clean raw wiki pages for indexing.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of cleaning processes")
+    parser.add_argument("--force", action="store_true", help="Re-clean every file, even unchanged ones")
+    parser.add_argument("--shard", default=None, help="Only clean this wiki (a wiki host, e.g. minecraft.fandom.com)")
+    args = parser.parse_args()
+
+    walk_and_clean(workers=args.workers, force=args.force, shard=args.shard)
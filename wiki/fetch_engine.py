@@ -0,0 +1,130 @@
+import json
+import time
+import random
+import asyncio
+from urllib.parse import urlparse
+import aiohttp  # type: ignore
+from config import config
+
+USER_AGENT = "NotchNet/1.0 (internal-dev)"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    """Raised when a request still fails after all retries."""
+
+
+class FetchEngine:
+    """
+    asyncio HTTP client for wiki downloads. Keeps one pooled session and one
+    concurrency limit per host, and retries failures with jittered
+    exponential backoff, honoring Retry-After and MediaWiki maxlag errors.
+
+    Use it as `async with FetchEngine() as engine:`.
+    """
+
+    def __init__(self, per_host_limit=None, max_retries=None):
+        self.per_host_limit = per_host_limit or config.FETCH_CONCURRENCY_PER_HOST
+        self.max_retries = config.FETCH_MAX_RETRIES if max_retries is None else max_retries
+        self._sessions = {}
+        self._semaphores = {}
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+
+    async def __aenter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    async def __aexit__(self, *exc):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+    def _session_for(self, url):
+        host = urlparse(url).netloc
+        session = self._sessions.get(host)
+        if session is None:
+            connector = aiohttp.TCPConnector(limit=self.per_host_limit, ttl_dns_cache=300)
+            session = aiohttp.ClientSession(
+                connector=connector,
+                headers={"User-Agent": USER_AGENT},
+                timeout=aiohttp.ClientTimeout(total=config.FETCH_TIMEOUT),
+            )
+            self._sessions[host] = session
+            self._semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return session, self._semaphores[host]
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return float(retry_after) + random.uniform(0, 1)
+            except ValueError:
+                pass
+        delay = min(config.FETCH_BACKOFF_CAP, config.FETCH_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(delay / 2, delay)
+
+    async def _request(self, url, params=None, as_json=True):
+        session, semaphore = self._session_for(url)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            retry_after = None
+            try:
+                async with semaphore:
+                    async with session.get(url, params=params) as resp:
+                        body = await resp.read()
+                        self.requests += 1
+                        self.bytes += len(body)
+                        if resp.status in RETRY_STATUSES:
+                            retry_after = resp.headers.get("Retry-After")
+                            last_error = f"HTTP {resp.status}"
+                        elif resp.status >= 400:
+                            # Not worth retrying (404, 403, ...)
+                            self.errors += 1
+                            raise FetchError(f"HTTP {resp.status} from {url}")
+                        elif not as_json:
+                            return body
+                        else:
+                            data = json.loads(body)
+                            # With maxlag set, a lagged MediaWiki answers 200 with an error body.
+                            error = data.get("error") if isinstance(data, dict) else None
+                            if error and error.get("code") == "maxlag":
+                                retry_after = resp.headers.get("Retry-After", "5")
+                                last_error = f"maxlag: {error.get('info', '')}"
+                            else:
+                                return data
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                last_error = e
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, retry_after))
+        self.errors += 1
+        raise FetchError(f"{url} failed after {self.max_retries + 1} attempts: {last_error}")
+
+    async def get_json(self, url, params=None):
+        return await self._request(url, params, as_json=True)
+
+    async def get_bytes(self, url, params=None):
+        return await self._request(url, params, as_json=False)
+
+    def stats(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return {
+            "requests": self.requests,
+            "bytes": self.bytes,
+            "retries": self.retries,
+            "errors": self.errors,
+            "seconds": round(elapsed, 2),
+            "requests_per_sec": round(self.requests / elapsed, 1),
+            "bytes_per_sec": round(self.bytes / elapsed),
+        }
+
+    def report(self):
+        s = self.stats()
+        print(
+            f"📈 {s['requests']} requests, {s['bytes'] / 1e6:.1f} MB in {s['seconds']}s "
+            f"({s['requests_per_sec']} req/s, {s['bytes_per_sec'] / 1e3:.0f} KB/s, "
+            f"{s['retries']} retries, {s['errors']} errors)"
+        )
@@ -1,14 +1,12 @@
 import os
-import re
-import requests
-from time import sleep
-import concurrent.futures
+import asyncio
 from tqdm import tqdm  # type: ignore
 from config import config
+from config import shards
+from wiki.fetch_engine import FetchEngine, FetchError
 
 API_URL = config.WIKI_API_URL_DEFAULT
 DATA_DIR = config.DATA_DIR_RAW
-MAX_WORKERS = config.MAX_WORKERS
 
 
 def ensure_dir(path):
@@ -16,77 +14,121 @@ def ensure_dir(path):
         os.makedirs(path)
 
 
-def fetch_category_members(api_url, category, cmcontinue=None):
-    params = {
-        "action": "query",
-        "list": "categorymembers",
-        "cmtitle": f"Category:{category}",
-        "cmlimit": "50",
-        "format": "json",
-    }
+def api_params(**params):
+    """Adds the parameters every MediaWiki API request carries."""
+    params.setdefault("format", "json")
+    params["maxlag"] = str(config.WIKI_MAXLAG)
+    return params
+
+
+async def fetch_category_members(engine, api_url, category, cmcontinue=None):
+    params = api_params(
+        action="query",
+        list="categorymembers",
+        cmtitle=f"Category:{category}",
+        cmlimit="50",
+    )
     if cmcontinue:
         params["cmcontinue"] = cmcontinue
 
-    for _ in range(3):
-        try:
-            resp = requests.get(api_url, params=params)
-            resp.raise_for_status()
-            return resp.json()
-        except requests.exceptions.RequestException as e:
-            print(f"⚠️ Network error: {e}. Retrying in 3s...")
-            sleep(3)
+    try:
+        return await engine.get_json(api_url, params)
+    except FetchError as e:
+        print(f"⚠️ Could not list Category:{category}: {e}")
     return {}
 
 
-def fetch_page_content(api_url, title):
+async def fetch_page_content(engine, api_url, title):
     """
     Fetches the text extract AND the list of images for a page.
-    Returns: (text, images)
-    """
-    params = {
-        "action": "query",
-        "format": "json",
-        "prop": "extracts|images",
-        "explaintext": True,
-        "titles": title,
-    }
+    Returns: (text, images), with text None if the request failed.
+    """
+    params = api_params(
+        action="query",
+        prop="extracts|images",
+        explaintext="1",
+        titles=title,
+    )
 
     try:
-        resp = requests.get(api_url, params=params)
-        resp.raise_for_status()
-        data = resp.json()
+        data = await engine.get_json(api_url, params)
         pages = data.get("query", {}).get("pages", {})
 
         for page_id, page in pages.items():
             text = page.get("extract", "")
             images = page.get("images", [])
             return text, images
-    except requests.exceptions.RequestException as e:
+    except FetchError as e:
         print(f"❌ Failed to fetch {title}: {e}")
+        return None, []
 
     return "", []
 
 
-def save_page_data(category, title, text, image_path):
+async def fetch_image_url(engine, api_url, image_title):
+    """Looks up the file URL of a File: page."""
+    params = api_params(
+        action="query",
+        prop="imageinfo",
+        titles=image_title,
+        iiprop="url",
+    )
+    try:
+        data = await engine.get_json(api_url, params)
+        for _, page_info in data.get("query", {}).get("pages", {}).items():
+            image_url = page_info.get("imageinfo", [{}])[0].get("url")
+            if image_url:
+                return image_url
+    except FetchError as e:
+        print(f"❌ Failed to fetch image info for {image_title}: {e}")
+    return None
+
+
+def page_path(category, title, api_url=None):
+    """
+    Where a page of `category` is saved, e.g. data/wiki_pages/Items/Stick.txt,
+    or data/wiki_pages/_wikis/<wiki host>/Items/Stick.txt for any wiki but the default one.
+    """
+    safe_title = title.replace("/", "_")
+    prefix = shards.wiki_prefix(shards.shard_name(api_url)) if api_url else ""
+    return os.path.join(DATA_DIR, prefix, category, f"{safe_title}.txt")
+
+
+def format_page(text, image_path):
+    """The raw page file contents: an optional ImagePath line for the cleaning script, then the text."""
+    if image_path:
+        return f"ImagePath: {image_path}\n\n{text}"
+    return text
+
+
+def save_page_data(category, title, text, image_path, api_url=None):
     """
     Saves the page data. If an image_path is provided, it's written
     at the top of the file for the cleaning script to use.
     """
-    safe_title = title.replace("/", "_")
-    folder = os.path.join(DATA_DIR, category)
-    ensure_dir(folder)
-    path = os.path.join(folder, f"{safe_title}.txt")
+    path = page_path(category, title, api_url)
+    ensure_dir(os.path.dirname(path))
 
     try:
         with open(path, "w", encoding="utf-8") as f:
-            if image_path:
-                f.write(f"ImagePath: {image_path}\n\n")
-            f.write(text)
+            f.write(format_page(text, image_path))
     except Exception as e:
         print(f"❌ Failed to save {title}: {e}")
 
 
-def download_image(url, folder, filename):
+async def save_page(category, title, text, image_path):
+    """Default page sink: writes the page to DATA_DIR. Streaming ingestion passes its own."""
+    save_page_data(category, title, text, image_path)
+
+
+def page_sink(api_url):
+    """A page sink that writes into `api_url`'s own directory under DATA_DIR."""
+    async def save(category, title, text, image_path):
+        save_page_data(category, title, text, image_path, api_url)
+    return save
+
+
+async def download_image(engine, url, folder, filename):
     """Downloads an image from a URL and saves it to a folder."""
     ensure_dir(folder)
     path = os.path.join(folder, filename)
@@ -96,20 +138,25 @@ def download_image(url, folder, filename):
         return path
 
     try:
-        resp = requests.get(url)
-        resp.raise_for_status()
+        content = await engine.get_bytes(url)
         with open(path, "wb") as f:
-            f.write(resp.content)
+            f.write(content)
         return path
-    except requests.exceptions.RequestException as e:
+    except FetchError as e:
         print(f"❌ Failed to download image {url}: {e}")
     return None
 
 
-def discover_pages_to_fetch(api_url, category, recipe_categories, visited, work_items):
+def is_recipe_image(image_title):
+    lowered = image_title.lower()
+    return "crafting" in lowered or "recipe" in lowered
+
+
+async def discover_pages_to_fetch(engine, api_url, category, recipe_categories, visited, work_items):
     """
     PHASE 1: Recursively scans categories and adds work items to a list.
     A work item is a tuple: (title, category, is_recipe_category)
+    Subcategories are scanned concurrently.
     """
     if category in visited:
         return
@@ -118,9 +165,10 @@ def discover_pages_to_fetch(api_url, category, recipe_categories, visited, work_
 
     cmcontinue = None
     is_recipe_category = category in recipe_categories
+    subcategories = []
 
     while True:
-        data = fetch_category_members(api_url, category, cmcontinue)
+        data = await fetch_category_members(engine, api_url, category, cmcontinue)
         members = data.get("query", {}).get("categorymembers", [])
         if not members:
             break
@@ -128,8 +176,7 @@ def discover_pages_to_fetch(api_url, category, recipe_categories, visited, work_
         for member in members:
             title = member["title"]
             if title.startswith("Category:"):
-                subcat = title.replace("Category:", "")
-                discover_pages_to_fetch(api_url, subcat, recipe_categories, visited, work_items)
+                subcategories.append(title.replace("Category:", ""))
             else:
                 work_items.append((title, category, is_recipe_category))
 
@@ -138,81 +185,346 @@ def discover_pages_to_fetch(api_url, category, recipe_categories, visited, work_
         else:
             break
 
+    await asyncio.gather(*[
+        discover_pages_to_fetch(engine, api_url, subcat, recipe_categories, visited, work_items)
+        for subcat in subcategories
+    ])
 
-def process_page_work_item(api_url, work_item):
+
+async def process_page_work_item(engine, api_url, work_item, sink=save_page):
     """
-    PHASE 2: The actual work done by each thread.
-    Fetches one page and saves it.
+    PHASE 2: Fetches one page (and its recipe image, if any) and hands it to `sink`.
+    Returns None, without calling `sink`, if the page text could not be fetched.
     """
     title, category, is_recipe_category = work_item
 
-    text, images = fetch_page_content(api_url, title)
+    text, images = await fetch_page_content(engine, api_url, title)
+    if text is None:
+        return None
 
     image_path_to_save = None
     if is_recipe_category and images:
         for image in images:
             image_title = image.get("title", "")
-            if "crafting" in image_title.lower() or "recipe" in image_title.lower():
+            if is_recipe_image(image_title):
                 # Found a recipe image, now get its URL
-                image_info_params = {
-                    "action": "query",
-                    "format": "json",
-                    "prop": "imageinfo",
-                    "titles": image_title,
-                    "iiprop": "url"
-                }
-                try:
-                    info_resp = requests.get(api_url, params=image_info_params)
-                    info_resp.raise_for_status()
-                    info_data = info_resp.json()
-                    info_pages = info_data.get("query", {}).get("pages", {})
-                    for _, page_info in info_pages.items():
-                        image_url = page_info.get("imageinfo", [{}])[0].get("url")
-                        if image_url:
-                            image_filename = image_title.replace("File:", "")
-                            image_folder = "static/images/recipes"
-                            image_path_to_save = download_image(image_url, image_folder, image_filename)
-                            break # Stop after finding the first recipe image
-                except requests.exceptions.RequestException as e:
-                    print(f"❌ Failed to fetch image info for {image_title}: {e}")
+                image_url = await fetch_image_url(engine, api_url, image_title)
+                if image_url:
+                    image_filename = image_title.replace("File:", "")
+                    image_folder = "static/images/recipes"
+                    image_path_to_save = await download_image(engine, image_url, image_folder, image_filename)
             if image_path_to_save:
-                break
+                break # Stop after finding the first recipe image
 
-    save_page_data(category, title, text, image_path_to_save)
+    await sink(category, title, text, image_path_to_save)
     return title
 
 
-def fetch_wiki(api_url, categories, recipe_categories=None):
-    if recipe_categories is None:
-        recipe_categories = set()
+# ===========================
+# Batched fetching
+# ===========================
+#
+# Page metadata comes straight from generator=categorymembers (listing and
+# images together) or from WIKI_BATCH_SIZE titles per request, and image URLs
+# are resolved in bulk.
+# MediaWiki splits large results with `continue` (imcontinue, gcmcontinue,
+# excontinue); the loops below follow it and merge the pieces per page.
+#
+# Batching only saves round trips for listing, images and image URLs, not
+# for page text. TextExtracts allows 20 extracts per request, but practically
+# every MediaWiki returns one whole-article extract per response. Following
+# excontinue would fetch those one after another, so once a wiki is seen
+# doing this, the rest of its extracts are fetched one title per request,
+# concurrently. On such wikis page text is still one request per page.
+
+EXTRACTS_PER_REQUEST = 20  # TextExtracts' exlimit maximum
+_extracts_capped = set()  # API URLs that return one whole-article extract per response
+
+
+async def query_continued(engine, api_url, params):
+    """Runs an API query, following `continue` until complete. Yields each response."""
+    request = dict(params)
+    while True:
+        data = await engine.get_json(api_url, request)
+        yield data
+        if "continue" not in data:
+            break
+        request = {**params, **data["continue"]}
+
+
+def merge_pages(pages, data):
+    """Merges the pages of one (possibly partial) response into `pages`, keyed by title."""
+    for page in data.get("query", {}).get("pages", {}).values():
+        title = page.get("title")
+        if title is None:
+            continue
+        entry = pages.setdefault(title, {"title": title, "ns": page.get("ns", 0), "text": "", "images": []})
+        entry["images"].extend(page.get("images", []))
+
+
+async def fetch_extracts(engine, api_url, titles):
+    """
+    Fetches plain-text extracts for many titles. Returns {title: text}.
+    Takes one request per title on wikis that return one extract per response.
+    Titles whose fetch failed are left out.
+    """
+    extracts = {}
+
+    async def fetch_one(title):
+        text, _ = await fetch_page_content(engine, api_url, title)
+        if text is not None:
+            extracts[title] = text
+
+    async def fetch_group(group):
+        if api_url not in _extracts_capped:
+            params = api_params(
+                action="query", prop="extracts", explaintext="1", exlimit="max", titles="|".join(group)
+            )
+            try:
+                data = await engine.get_json(api_url, params)
+            except FetchError as e:
+                print(f"❌ Failed to fetch {len(group)} extracts: {e}")
+                return
+            query = data.get("query", {})
+            normalized = {n["to"]: n["from"] for n in query.get("normalized", [])}
+            for page in query.get("pages", {}).values():
+                if "extract" in page:
+                    extracts[normalized.get(page["title"], page["title"])] = page["extract"]
+            if "excontinue" in data.get("continue", {}):
+                if api_url not in _extracts_capped:
+                    print(f"ℹ️ {api_url} returns one extract per request; fetching the rest per title.")
+                _extracts_capped.add(api_url)
+        await asyncio.gather(*[fetch_one(t) for t in group if t not in extracts])
+
+    await asyncio.gather(*[
+        fetch_group(titles[i : i + EXTRACTS_PER_REQUEST]) for i in range(0, len(titles), EXTRACTS_PER_REQUEST)
+    ])
+    return extracts
+
+
+async def fetch_pages_batched(engine, api_url, titles):
+    """
+    Fetches text and images for many titles. Images take one request per
+    WIKI_BATCH_SIZE titles; text is fetched by fetch_extracts. Returns {requested_title: {"title", "text", "images"}}; "text" is None
+    when the page text could not be fetched.
+    """
+    results = {}
+    batch_size = config.WIKI_BATCH_SIZE
 
+    async def fetch_batch(batch):
+        pages = {}
+        normalized = {}
+        params = api_params(action="query", prop="images", imlimit="max", titles="|".join(batch))
+        try:
+            async for data in query_continued(engine, api_url, params):
+                merge_pages(pages, data)
+                for n in data.get("query", {}).get("normalized", []):
+                    normalized[n["from"]] = n["to"]
+        except FetchError as e:
+            print(f"❌ Failed to fetch a batch of {len(batch)} pages: {e}")
+            return
+        for title in batch:
+            page = pages.get(normalized.get(title, title))
+            if page is not None:
+                results[title] = page
+
+    await asyncio.gather(*[
+        fetch_batch(titles[i : i + batch_size]) for i in range(0, len(titles), batch_size)
+    ])
+
+    extracts = await fetch_extracts(engine, api_url, list(results))
+    for title, page in results.items():
+        page["text"] = extracts.get(title)
+    return results
+
+
+async def list_category_batched(engine, api_url, category):
+    """
+    Lists a category together with the images of its members via
+    generator=categorymembers. Returns (pages without text, subcategories).
+    """
+    params = api_params(
+        action="query",
+        generator="categorymembers",
+        gcmtitle=f"Category:{category}",
+        gcmlimit=str(config.WIKI_BATCH_SIZE),
+        prop="images",
+        imlimit="max",
+    )
+    members = {}
+    try:
+        async for data in query_continued(engine, api_url, params):
+            merge_pages(members, data)
+    except FetchError as e:
+        print(f"⚠️ Could not fetch Category:{category}: {e}")
+
+    pages = [p for p in members.values() if not p["title"].startswith("Category:")]
+    subcategories = [p["title"].replace("Category:", "", 1) for p in members.values() if p["title"].startswith("Category:")]
+    return pages, subcategories
+
+
+async def resolve_image_urls(engine, api_url, image_titles):
+    """Looks up the file URLs of many File: pages, WIKI_BATCH_SIZE per request."""
+    urls = {}
+    image_titles = sorted(set(image_titles))
+    batch_size = config.WIKI_BATCH_SIZE
+
+    async def resolve_batch(batch):
+        params = api_params(action="query", prop="imageinfo", iiprop="url", titles="|".join(batch))
+        try:
+            async for data in query_continued(engine, api_url, params):
+                for page in data.get("query", {}).get("pages", {}).values():
+                    image_url = (page.get("imageinfo") or [{}])[0].get("url")
+                    if image_url:
+                        urls[page["title"]] = image_url
+        except FetchError as e:
+            print(f"❌ Failed to resolve {len(batch)} image URLs: {e}")
+
+    await asyncio.gather(*[
+        resolve_batch(image_titles[i : i + batch_size]) for i in range(0, len(image_titles), batch_size)
+    ])
+    return urls
+
+
+async def save_pages_batched(engine, api_url, fetched, sink=save_page):
+    """
+    Hands fetched pages, given as (title, category, is_recipe_category, page)
+    tuples, to `sink`. Recipe images for all of them are resolved in bulk first.
+    Pages whose text could not be fetched are skipped.
+    """
+    fetched = [item for item in fetched if item[3]["text"] is not None]
+    wanted = {}
+    for title, category, is_recipe_category, page in fetched:
+        if is_recipe_category:
+            candidates = [i.get("title", "") for i in page["images"] if is_recipe_image(i.get("title", ""))]
+            if candidates:
+                wanted[(title, category)] = candidates[0]
+
+    image_urls = await resolve_image_urls(engine, api_url, wanted.values()) if wanted else {}
+
+    async def save(title, category, page):
+        image_path = None
+        image_title = wanted.get((title, category))
+        if image_title and image_title in image_urls:
+            image_path = await download_image(
+                engine, image_urls[image_title], "static/images/recipes", image_title.replace("File:", "")
+            )
+        await sink(category, title, page["text"], image_path)
+
+    await asyncio.gather(*[save(title, category, page) for title, category, _, page in fetched])
+
+
+async def fetch_category_tree_batched(
+    engine, api_url, category, recipe_categories, visited, saved, sink=save_page, failed=None
+):
+    """
+    Batched equivalent of discover_pages_to_fetch + process_page_work_item.
+    Pages are handed to `sink` one extract batch at a time, as soon as their
+    text arrives, while the rest of the tree is still being fetched. Pages
+    whose text could not be fetched go to `failed` instead of `saved`.
+    """
+    if category in visited:
+        return
+    visited.add(category)
+    print(f"🔍 Fetching pages in: {category}")
+
+    pages, subcategories = await list_category_batched(engine, api_url, category)
+    is_recipe_category = category in recipe_categories
+
+    async def fetch_group(group):
+        extracts = await fetch_extracts(engine, api_url, [page["title"] for page in group])
+        for page in group:
+            page["text"] = extracts.get(page["title"])
+        fetched = [(page["title"], category, is_recipe_category, page) for page in group]
+        await save_pages_batched(engine, api_url, fetched, sink)
+        saved.extend((page["title"], category) for page in group if page["text"] is not None)
+        if failed is not None:
+            failed.extend((page["title"], category) for page in group if page["text"] is None)
+
+    await asyncio.gather(
+        *[fetch_group(pages[i : i + EXTRACTS_PER_REQUEST]) for i in range(0, len(pages), EXTRACTS_PER_REQUEST)],
+        *[
+            fetch_category_tree_batched(engine, api_url, subcat, recipe_categories, visited, saved, sink, failed)
+            for subcat in subcategories
+        ],
+    )
+
+
+def report_failed(failed):
+    if failed:
+        print(f"⚠️ {len(failed)} pages could not be fetched.")
+
+
+async def fetch_wiki_batched(engine, api_url, categories, recipe_categories, sink=save_page, failed=None):
+    print(f"--- Fetching categories and pages from {api_url} in batches of {config.WIKI_BATCH_SIZE} ---")
+    visited = set()
+    saved = []
+    failed = [] if failed is None else failed
+    await asyncio.gather(*[
+        fetch_category_tree_batched(engine, api_url, cat, recipe_categories, visited, saved, sink, failed)
+        for cat in categories
+    ])
+    print(f"\n✅ Fetched {len(saved)} total pages.")
+    report_failed(failed)
+    return saved
+
+
+async def fetch_wiki_single(engine, api_url, categories, recipe_categories, sink=save_page, failed=None):
     print(f"--- Phase 1: Discovering all pages to fetch from {api_url} ---")
     visited = set()
     work_items = []
 
-    for cat in categories:
-        discover_pages_to_fetch(api_url, cat, recipe_categories, visited, work_items)
+    await asyncio.gather(*[
+        discover_pages_to_fetch(engine, api_url, cat, recipe_categories, visited, work_items)
+        for cat in categories
+    ])
 
     print(f"\n✅ Discovered {len(work_items)} total pages.")
 
-    print(f"\n--- Phase 2: Downloading pages with {MAX_WORKERS} workers ---")
+    print(f"\n--- Phase 2: Downloading pages ({engine.per_host_limit} concurrent requests per host) ---")
+
+    tasks = [asyncio.ensure_future(process_page_work_item(engine, api_url, item, sink)) for item in work_items]
+    for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+        try:
+            await task
+        except Exception as e:
+            tqdm.write(f"❌ A task failed: {e}")
+
+    saved = []
+    failed = [] if failed is None else failed
+    for (title, category, _), task in zip(work_items, tasks):
+        if task.exception() is None and task.result() is not None:
+            saved.append((title, category))
+        else:
+            failed.append((title, category))
+    report_failed(failed)
+    return saved
+
 
-    # Partial application to pass api_url to the worker function
-    from functools import partial
-    worker_func = partial(process_page_work_item, api_url)
+async def fetch_wiki_with_engine(engine, api_url, categories, recipe_categories=None, sink=save_page, failed=None):
+    """
+    Downloads every page in `categories`. Returns the saved (title, category)
+    pairs; pages that could not be fetched are added to `failed`.
+    """
+    if recipe_categories is None:
+        recipe_categories = set()
+    if config.WIKI_FETCH_MODE == "single":
+        return await fetch_wiki_single(engine, api_url, categories, recipe_categories, sink, failed)
+    return await fetch_wiki_batched(engine, api_url, categories, recipe_categories, sink, failed)
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = [executor.submit(worker_func, item) for item in work_items]
 
-        for future in tqdm(
-            concurrent.futures.as_completed(futures), total=len(work_items)
-        ):
-            try:
-                future.result()
-            except Exception as e:
-                tqdm.write(f"❌ A task failed: {e}")
+async def fetch_wiki_async(api_url, categories, recipe_categories=None):
+    async with FetchEngine() as engine:
+        saved = await fetch_wiki_with_engine(engine, api_url, categories, recipe_categories, page_sink(api_url))
+        engine.report()
 
     print("\n🎉 All pages downloaded successfully!")
+    return saved
+
+
+def fetch_wiki(api_url, categories, recipe_categories=None):
+    """Downloads every page in `categories` (recursively) from a MediaWiki API."""
+    return asyncio.run(fetch_wiki_async(api_url, categories, recipe_categories))
 
 
 if __name__ == "__main__":
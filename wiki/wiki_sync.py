@@ -0,0 +1,398 @@
+import os
+import re
+import json
+import time
+import shutil
+import asyncio
+import calendar
+from config import config
+from config import shards
+from wiki import wiki_loader
+from wiki.fetch_engine import FetchEngine, FetchError
+
+# ===========================
+# Revision-based wiki sync
+# ===========================
+#
+# data/wiki_state/<wiki>.json remembers, per page, the revision that was last
+# downloaded and the categories it was saved under. A sync asks the wiki what
+# changed since the previous one (list=recentchanges, or a bulk revision ID
+# check when the last sync is older than the wiki keeps recent changes),
+# re-downloads only those pages and reports which raw files were written or
+# deleted, so cleaning and indexing can leave everything else alone.
+
+STATE_VERSION = 1
+
+
+def state_path(api_url):
+    name = re.sub(r"[^\w.-]", "_", api_url.split("://", 1)[-1])
+    return os.path.join(config.WIKI_STATE_DIR, f"{name}.json")
+
+
+def load_state(api_url):
+    try:
+        with open(state_path(api_url), "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("version") != STATE_VERSION or state.get("api_url") != api_url:
+        return None
+    return state
+
+
+def save_state(state):
+    path = state_path(state["api_url"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def new_state(api_url, roots, recipe_categories):
+    return {
+        "version": STATE_VERSION,
+        "api_url": api_url,
+        "roots": sorted(roots),
+        "categories": sorted(roots),
+        "recipe_categories": sorted(recipe_categories),
+        "rc_cursor": None,
+        "synced_at": None,
+        "pending": [],
+        "pages": {},
+    }
+
+
+def category_key(name):
+    """MediaWiki treats underscores as spaces and ignores the case of the first letter."""
+    name = name.replace("_", " ").strip()
+    return name[:1].upper() + name[1:]
+
+
+def rel_page_path(category, title, api_url):
+    return os.path.relpath(wiki_loader.page_path(category, title, api_url), wiki_loader.DATA_DIR)
+
+
+def remove_page_file(category, title, api_url):
+    try:
+        os.remove(wiki_loader.page_path(category, title, api_url))
+    except OSError:
+        pass
+    return rel_page_path(category, title, api_url)
+
+
+def parse_timestamp(timestamp):
+    return calendar.timegm(time.strptime(timestamp, "%Y-%m-%dT%H:%M:%SZ"))
+
+
+# ===========================
+# API queries
+# ===========================
+
+async def server_time(engine, api_url):
+    params = wiki_loader.api_params(action="query", meta="siteinfo", siprop="general")
+    data = await engine.get_json(api_url, params)
+    timestamp = data.get("query", {}).get("general", {}).get("time")
+    return timestamp or time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+async def recent_changes(engine, api_url, since):
+    """Returns (titles, category keys) changed since the `since` timestamp."""
+    params = wiki_loader.api_params(
+        action="query",
+        list="recentchanges",
+        rcend=since,
+        rcdir="older",
+        rctype="edit|new|log|categorize",
+        rcprop="title|timestamp|loginfo",
+        rclimit="max",
+    )
+    titles = set()
+    categories = set()
+    async for data in wiki_loader.query_continued(engine, api_url, params):
+        for change in data.get("query", {}).get("recentchanges", []):
+            title = change.get("title")
+            if not title:
+                continue
+            # Template edits change category membership without editing the page.
+            if change.get("type") == "categorize" and title.startswith("Category:"):
+                categories.add(category_key(title.split(":", 1)[1]))
+                continue
+            titles.add(title)
+            target = (change.get("logparams") or {}).get("target_title")
+            if target:
+                titles.add(target)  # moves
+    return titles, categories
+
+
+async def list_category(engine, api_url, category):
+    """Returns (page titles, subcategory names) of a category."""
+    params = wiki_loader.api_params(
+        action="query", list="categorymembers", cmtitle=f"Category:{category}", cmlimit="max"
+    )
+    pages = set()
+    subcategories = set()
+    async for data in wiki_loader.query_continued(engine, api_url, params):
+        for member in data.get("query", {}).get("categorymembers", []):
+            title = member["title"]
+            if title.startswith("Category:"):
+                subcategories.add(title.split(":", 1)[1])
+            else:
+                pages.add(title)
+    return pages, subcategories
+
+
+async def fetch_page_info(engine, api_url, titles):
+    """
+    Looks up the latest revision and categories of many pages, WIKI_BATCH_SIZE
+    per request. Returns {title: {"revid", "touched", "categories"}}, with None
+    for pages that do not exist. Titles whose lookup failed are left out.
+    """
+    info = {}
+    titles = sorted(set(titles))
+    batch_size = config.WIKI_BATCH_SIZE
+
+    async def info_batch(batch):
+        params = wiki_loader.api_params(action="query", prop="info|categories", cllimit="max", titles="|".join(batch))
+        pages = {}
+        normalized = {}
+        try:
+            async for data in wiki_loader.query_continued(engine, api_url, params):
+                query = data.get("query", {})
+                for n in query.get("normalized", []):
+                    normalized[n["from"]] = n["to"]
+                for page in query.get("pages", {}).values():
+                    entry = pages.setdefault(page.get("title"), {
+                        "missing": "missing" in page or "invalid" in page,
+                        "revid": page.get("lastrevid"),
+                        "touched": page.get("touched"),
+                        "categories": [],
+                    })
+                    entry["categories"].extend(
+                        category_key(c["title"].split(":", 1)[1]) for c in page.get("categories", [])
+                    )
+        except FetchError as e:
+            print(f"❌ Failed to look up {len(batch)} pages: {e}")
+            return
+        for title in batch:
+            page = pages.get(normalized.get(title, title))
+            if page is not None:
+                info[title] = None if page["missing"] else page
+
+    await asyncio.gather(*[
+        info_batch(titles[i : i + batch_size]) for i in range(0, len(titles), batch_size)
+    ])
+    return info
+
+
+# ===========================
+# Sync
+# ===========================
+
+async def record_pages(engine, api_url, state, saved):
+    """Stores the current revision of freshly downloaded (title, category) pages."""
+    by_title = {}
+    for title, category in saved:
+        by_title.setdefault(title, set()).add(category)
+    info = await fetch_page_info(engine, api_url, by_title)
+
+    categories = set(state["categories"])
+    for title, saved_categories in by_title.items():
+        entry = state["pages"].setdefault(title, {"categories": []})
+        entry["categories"] = sorted(set(entry["categories"]) | saved_categories)
+        page = info.get(title)
+        # Without a revision ID the next sync simply downloads the page again.
+        entry["revid"] = page["revid"] if page else None
+        entry["touched"] = page["touched"] if page else None
+        categories |= saved_categories
+    state["categories"] = sorted(categories)
+
+
+async def full_sync(engine, api_url, categories, recipe_categories, previous, sink):
+    """Downloads every tracked category. Returns (changed, removed, state)."""
+    roots = set(categories)
+    if previous is not None:
+        roots |= set(previous["roots"])
+        recipe_categories = recipe_categories | set(previous["recipe_categories"])
+    print(f"📥 Full download of {len(roots)} categories from {api_url}...")
+
+    state = new_state(api_url, roots, recipe_categories)
+    failed = []
+    saved = await wiki_loader.fetch_wiki_with_engine(engine, api_url, roots, recipe_categories, sink, failed)
+    await record_pages(engine, api_url, state, saved)
+    # Not recorded, so the next sync downloads them; their old files are kept until then.
+    state["pending"] = sorted({title for title, _ in failed})
+
+    changed = {rel_page_path(category, title, api_url) for title, category in saved}
+    kept = changed | {rel_page_path(category, title, api_url) for title, category in failed}
+    removed = set()
+    if previous is not None:
+        for title, entry in previous["pages"].items():
+            for category in entry["categories"]:
+                rel_path = rel_page_path(category, title, api_url)
+                if rel_path not in kept:
+                    removed.add(remove_page_file(category, title, api_url))
+    return changed, removed, state
+
+
+async def incremental_sync(engine, api_url, state, categories, recipe_categories, sink):
+    """Re-downloads only the pages that changed since the last sync. Returns (changed, removed)."""
+    pages = state["pages"]
+    recipe_categories = recipe_categories | set(state["recipe_categories"])
+    state["recipe_categories"] = sorted(recipe_categories)
+    tracked = {category_key(c): c for c in state["categories"]}
+    changed = set()
+    removed = set()
+
+    # 1. Work out which pages may have changed
+    cursor = state.get("rc_cursor")
+    if cursor and time.time() - parse_timestamp(cursor) < config.WIKI_RC_MAX_AGE_DAYS * 86400:
+        candidates, changed_categories = await recent_changes(engine, api_url, cursor)
+        print(f"📰 {len(candidates)} pages and {len(changed_categories)} categories changed since {cursor}.")
+        relist = [tracked[key] for key in changed_categories if key in tracked]
+    else:
+        print("⏳ Last sync is older than the wiki's recent changes; comparing revision IDs instead.")
+        candidates = set(pages)
+        relist = list(state["categories"])
+    candidates |= set(state.get("pending", []))
+
+    new_roots = [c for c in categories if category_key(c) not in tracked]
+    for category in relist:
+        members, subcategories = await list_category(engine, api_url, category)
+        candidates |= members
+        candidates |= {title for title, entry in pages.items() if category in entry["categories"]}
+        new_roots.extend(sub for sub in subcategories if category_key(sub) not in tracked)
+
+    # 2. Categories seen for the first time are downloaded in full
+    failed = []
+    if new_roots:
+        new_roots = sorted(set(new_roots))
+        print(f"📥 Downloading {len(new_roots)} new categories: {', '.join(new_roots)}")
+        saved = await wiki_loader.fetch_wiki_with_engine(engine, api_url, new_roots, recipe_categories, sink, failed)
+        state["roots"] = sorted(set(state["roots"]) | {c for c in categories if c in new_roots})
+        state["categories"] = sorted(set(state["categories"]) | set(new_roots))
+        await record_pages(engine, api_url, state, saved)
+        changed |= {rel_page_path(category, title, api_url) for title, category in saved}
+        tracked = {category_key(c): c for c in state["categories"]}
+
+    # 3. Compare revisions and category membership with what is on disk
+    info = await fetch_page_info(engine, api_url, candidates)
+    pending = {title for title in candidates if title not in info}
+    pending |= {title for title, _ in failed}
+    to_fetch = {}
+    for title, page in info.items():
+        known = pages.get(title)
+        old_categories = set(known["categories"]) if known else set()
+        wanted = {tracked[key] for key in page["categories"] if key in tracked} if page else set()
+        for category in old_categories - wanted:
+            removed.add(remove_page_file(category, title, api_url))
+        if not wanted:
+            pages.pop(title, None)
+        elif not (known and known.get("revid") == page["revid"] and wanted == old_categories):
+            to_fetch[title] = (wanted, page)
+
+    # 4. Download the pages that changed
+    if to_fetch:
+        results = await wiki_loader.fetch_pages_batched(engine, api_url, list(to_fetch))
+        fetched = []
+        for title, (wanted, page_info) in to_fetch.items():
+            page = results.get(title)
+            if page is None or page["text"] is None:
+                # Keeps the old file and revision, so the next sync fetches it again.
+                pending.add(title)
+                continue
+            for category in sorted(wanted):
+                fetched.append((title, category, category in recipe_categories, page))
+                changed.add(rel_page_path(category, title, api_url))
+            pages[title] = {"revid": page_info["revid"], "touched": page_info["touched"], "categories": sorted(wanted)}
+        await wiki_loader.save_pages_batched(engine, api_url, fetched, sink)
+
+    state["pending"] = sorted(pending)
+    if pending:
+        print(f"⚠️ {len(pending)} pages could not be checked or downloaded and will be retried next sync.")
+    return changed, removed - changed
+
+
+async def sync_wiki_async(api_url, categories, recipe_categories=None, full=False, sink=None):
+    """Async sync_wiki. Downloaded pages are handed to `sink` (default: written to the wiki's directory)."""
+    changed, removed, state = await sync_changes_async(api_url, categories, recipe_categories, full, sink)
+    save_state(state)
+    return changed, removed
+
+
+async def sync_changes_async(api_url, categories, recipe_categories=None, full=False, sink=None):
+    """
+    sync_wiki_async without saving the new state. Returns (changed, removed,
+    state); the caller saves the state with save_state once the pages are safe.
+    """
+    recipe_categories = set(recipe_categories or ())
+    sink = sink or wiki_loader.page_sink(api_url)
+    previous = load_state(api_url)
+
+    async with FetchEngine() as engine:
+        # Taken before downloading, so edits made during the sync are picked up next time.
+        started = await server_time(engine, api_url)
+        if full or previous is None:
+            changed, removed, state = await full_sync(engine, api_url, categories, recipe_categories, previous, sink)
+        else:
+            state = previous
+            changed, removed = await incremental_sync(engine, api_url, state, categories, recipe_categories, sink)
+        state["rc_cursor"] = started
+        state["synced_at"] = time.time()
+        engine.report()
+
+    print(f"🔄 Synced {api_url}: {len(changed)} pages written, {len(removed)} removed.")
+    return sorted(changed), sorted(removed), state
+
+
+def mark_pending(api_url, rel_paths):
+    """
+    Forgets the revisions of the pages saved at `rel_paths` (raw page paths
+    relative to DATA_DIR), so the next sync downloads them again. For pages
+    that were downloaded but never made it into the index.
+    """
+    state = load_state(api_url)
+    if state is None:
+        return 0
+    wanted = set(rel_paths)
+    marked = set()
+    for title, entry in state["pages"].items():
+        if any(rel_page_path(category, title, api_url) in wanted for category in entry["categories"]):
+            entry["revid"] = None
+            marked.add(title)
+    state["pending"] = sorted(set(state.get("pending", [])) | marked)
+    save_state(state)
+    return len(marked)
+
+
+def remove_wiki(api_url):
+    """Deletes a wiki's downloaded pages and sync state. Returns the removed raw page paths."""
+    state = load_state(api_url)
+    if state is None:
+        return []
+    shard = shards.shard_name(api_url)
+    if shard != shards.DEFAULT_SHARD:
+        # The wiki's directory holds nothing else, so it goes as a whole.
+        removed = shards.wiki_files(config.DATA_DIR_RAW, shard)
+        shutil.rmtree(os.path.join(config.DATA_DIR_RAW, shards.wiki_prefix(shard)), ignore_errors=True)
+    else:
+        removed = [
+            remove_page_file(category, title, api_url)
+            for title, entry in state["pages"].items()
+            for category in entry["categories"]
+        ]
+    try:
+        os.remove(state_path(api_url))
+    except OSError:
+        pass
+    print(f"🗑️ Removed {len(removed)} pages of {api_url}.")
+    return sorted(removed)
+
+
+def sync_wiki(api_url, categories, recipe_categories=None, full=False):
+    """
+    Brings the local copy of a wiki up to date, downloading everything the
+    first time (or with full=True) and only changed pages afterwards.
+    Returns (changed, removed): raw page paths relative to DATA_DIR.
+    """
+    return asyncio.run(sync_wiki_async(api_url, categories, recipe_categories, full))